@@ -1,14 +1,33 @@
 
-import pandas as pd, numpy as np, geopandas as gp, os
+import pandas as pd, numpy as np, geopandas as gp, os, json
 from pathlib import Path
-            
-def combined_huc_csv(basin_ls, results_folder, huc):
+
+# Rows read from a basin file and appended to a combined file at a time
+batch_rows = 200000
+
+
+def _append_csv(paths, out_path, index=False, encoding='utf-8-sig'):
+    # Appends csvs to one csv a batch of rows at a time. The headers are read
+    # first and the combined csv has the union of their columns in order of
+    # appearance, with blanks where a csv lacks a column, like pd.concat() of
+    # the whole csvs. The index of a batch continues the row numbers of its csv
+    columns = []
+    for path in paths:
+        columns += [col for col in pd.read_csv(path, nrows=0).columns if col not in columns]
+    pd.DataFrame(columns=columns).to_csv(out_path, index=index, encoding=encoding)
+    for path in paths:
+        for batch in pd.read_csv(path, chunksize=batch_rows):
+            batch.reindex(columns=columns).to_csv(out_path, mode='a', header=False, index=index,
+                                                  encoding='utf-8')
+
+
+def combined_huc_csv(basin_ls, results_folder, huc, suffix=''):
     """Combines all the basins together into one csv by HUC.
 
         This function takes a list of basins and creates a combined csv. The 
         list of basins is used to read in each corresponding csv, which are 
-        concatenated into the same dataframe. That combined dataframe is then 
-        printed out to csv.
+        appended to the combined csv batch_rows rows at a time, so only one 
+        batch of one basin is in memory.
 
         Parameters:
             basin_ls (List):
@@ -17,6 +36,9 @@ def combined_huc_csv(basin_ls, results_folder, huc):
                 Folder on the Google Drive where csv are be saved.
             huc (string):
                 HUC value to be evaluated.
+            suffix (string, optional):
+                Suffix of the basin file names (e.g. '_2012' for the files
+                written by run_workflow.py).
             extension (string):
                 Csv extension that varies by HUC value.
             HUC_summary_list (List):
@@ -30,26 +52,22 @@ def combined_huc_csv(basin_ls, results_folder, huc):
         Returns:
             A single csv containing all the data from each basin csv.
     """        
-    os.chdir(results_folder)
-
     # Make list of names of files to be read in (by basin and HUC value)
-    extension = huc+'_indices.csv'
-    HUC_summary_list = [i+extension for i in basin_ls]
-
-    # Combine all basin csvs together into a dataframe
-    combined_csv = pd.concat([pd.read_csv(f) for f in HUC_summary_list])
+    extension = huc+suffix+'_indices.csv'
+    HUC_summary_list = [results_folder+i+extension for i in basin_ls]
 
-    # Export to csv 
-    combined_csv.to_csv(results_folder+huc+"_summary.csv", index=False, encoding='utf-8-sig')
+    # Append the basin csvs to the combined csv one batch at a time
+    _append_csv(HUC_summary_list, results_folder+huc+"_summary.csv")
     
     
-def combined_segGeo_csv(basin_ls, results_folder, year):
+def combined_segGeo_csv(basin_ls, results_folder, year, suffix='', ext='.shp', virtual=False):
     """Combines all the basins together into one csv.
 
-        This function takes a list of basins and creates a combined csv. The 
-        list of basins is used to read in each corresponding csv, which are 
-        concatenated into the same dataframe. That combined dataframe is then 
-        printed out to csv.
+        This function takes a list of basins and creates a combined file. The 
+        basin geometry files are appended to the combined file batch_rows rows 
+        at a time, so only one batch of one basin is in memory. With virtual 
+        the basin .gpkg or .shp files are not copied at all, and a virtual 
+        layer (.vrt, see write_vrt()) of their union is written instead.
 
         Parameters:
             basin_ls (List):
@@ -58,6 +76,16 @@ def combined_segGeo_csv(basin_ls, results_folder, year):
                 Folder on the Google Drive where csv are be saved.
             huc (string):
                 HUC value to be evaluated.
+            suffix (string, optional):
+                Suffix of the basin file names (e.g. '_2012' for the files
+                written by run_workflow.py).
+            ext (string, optional):
+                File extension of the basin and combined geometry files ('.shp',
+                '.gpkg' or '.parquet').
+            virtual (boolean, optional):
+                If True a virtual layer (.vrt) of the .gpkg or .shp basin files
+                is written instead of a combined copy. GeoParquet files are
+                always copied.
             extension (string):
                 Csv extension that varies by HUC value.
             HUC_summary_list (List):
@@ -69,34 +97,97 @@ def combined_segGeo_csv(basin_ls, results_folder, year):
     
 
         Returns:
-            A single csv containing all the data from each basin csv.
+            out_path (string): Path of the combined file or virtual layer.
     """        
-    os.chdir(results_folder)
-
     # Make list of names of files to be read in (by basin and HUC value)
-    extension = '_segGeo.shp'
-    basin_summary_list = [i+extension for i in basin_ls]
-
-    # Combine all basin csvs together into a dataframe
-    combined_csv = pd.concat([gp.read_file(b) for b in basin_summary_list])
-    print("all basins added")
-    
-    os.chdir(results_folder)
-    # Export to shp 
-    # combined_csv.to_csv("all_basins_segGeo.csv", index=False, encoding='utf-8-sig')
-    combined_csv.to_file("all_basins_segGeo_"+year+".shp")
+    extension = '_segGeo'+suffix+ext
+    basin_summary_list = [results_folder+i+extension for i in basin_ls]
+
+    # A virtual layer that reads the basin files in place
+    if virtual and ext != '.parquet':
+        out_path = results_folder+"all_basins_segGeo_"+year+'.vrt'
+        write_vrt(basin_summary_list, out_path, "all_basins_segGeo_"+year)
+        print("combined virtual layer written")
+        return out_path
+
+    # Append the basin files to the combined file one batch at a time
+    out_path = results_folder+"all_basins_segGeo_"+year+ext
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    if ext == '.parquet':
+        _append_parquet(basin_summary_list, out_path)
+    else:
+        for b in basin_summary_list:
+            start = 0
+            while True:
+                batch = gp.read_file(b, rows=slice(start, start+batch_rows))
+                if len(batch) == 0:
+                    break
+                batch.to_file(out_path, append=os.path.exists(out_path))
+                start += batch_rows
     print("combined shapefile written")
-    # print(type(combined_csv))
 
-    return combined_csv
+    return out_path
+
+
+def _append_parquet(paths, out_path):
+    # Appends GeoParquet files to one file a row group at a time with the
+    # schema of the first file (without its bounding box)
+    import pyarrow as pa, pyarrow.parquet as pq
+    writer = None
+    try:
+        for path in paths:
+            source = pq.ParquetFile(path)
+            for batch in source.iter_batches(batch_size=batch_rows):
+                table = pa.Table.from_batches([batch])
+                if writer is None:
+                    schema = source.schema_arrow
+                    geo = json.loads(schema.metadata[b'geo'])
+                    for column in geo['columns'].values():
+                        column.pop('bbox', None)
+                    schema = schema.with_metadata({**schema.metadata, b'geo': json.dumps(geo).encode()})
+                    writer = pq.ParquetWriter(out_path, schema)
+                writer.write_table(table.select(schema.names).cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_vrt(paths, out_path, layer):
+    """Writes a virtual layer (OGR VRT) of the union of vector files.
+
+        The VRT only lists the files, which are read in place by GDAL (and
+        geopandas, QGIS or ogr2ogr), so the combined layer takes no space and
+        is never out of date with the basin files.
+
+        Parameters:
+            paths (List):
+                Vector files (e.g. .gpkg or .shp) with one layer named like the file.
+            out_path (string):
+                Path of the .vrt file.
+            layer (string):
+                Name of the combined layer.
+    """
+    folder = os.path.dirname(os.path.abspath(out_path))
+    sources = []
+    for path in paths:
+        name = Path(path).stem
+        source = os.path.relpath(os.path.abspath(path), folder)
+        sources.append('    <OGRVRTLayer name="'+name+'">\n'
+                       '      <SrcDataSource relativeToVRT="1">'+source+'</SrcDataSource>\n'
+                       '      <SrcLayer>'+name+'</SrcLayer>\n'
+                       '    </OGRVRTLayer>\n')
+    with open(out_path, 'w') as f:
+        f.write('<OGRVRTDataSource>\n  <OGRVRTUnionLayer name="'+layer+'">\n'
+                + ''.join(sources) + '  </OGRVRTUnionLayer>\n</OGRVRTDataSource>\n')
     
-def combined_frag_csv(basin_ls, results_folder, year):
+def combined_frag_csv(basin_ls, results_folder, year, suffix=''):
     """Combines all the basins together into one csv.
 
         This function takes a list of basins and creates a combined csv. The 
         list of basins is used to read in each corresponding csv, which are 
-        concatenated into the same dataframe. That combined dataframe is then 
-        printed out to csv.
+        appended to the combined csv batch_rows rows at a time, so only one 
+        batch of one basin is in memory.
 
         Parameters:
             basin_ls (List):
@@ -105,6 +196,9 @@ def combined_frag_csv(basin_ls, results_folder, year):
                 Folder on the Google Drive where csv are be saved.
             huc (string):
                 HUC value to be evaluated.
+            suffix (string, optional):
+                Suffix of the basin file names (e.g. '_2012' for the files
+                written by run_workflow.py).
             extension (string):
                 Csv extension that varies by HUC value.
             HUC_summary_list (List):
@@ -116,24 +210,17 @@ def combined_frag_csv(basin_ls, results_folder, year):
     
 
         Returns:
-            A single csv containing all the data from each basin csv.
+            out_path (string): Path of the combined csv.
     """        
-    os.chdir(results_folder)
-
     # Make list of names of files to be read in (by basin and HUC value)
-    extension = '_fragments.csv'
-    basin_summary_list = [i+extension for i in basin_ls]
+    extension = '_fragments'+suffix+'.csv'
+    basin_summary_list = [results_folder+i+extension for i in basin_ls]
 
-    # Combine all basin csvs together into a dataframe
-    combined_csv = pd.concat([pd.read_csv(b) for b in basin_summary_list])
-    print("all basins added")
-    
-    os.chdir(results_folder)
-    # Export to shp 
-    # combined_csv.to_csv("all_basins_segGeo.csv", index=False, encoding='utf-8-sig')
-    combined_csv.to_csv("all_basins_frags_"+year+".csv")
+    # Append the basin csvs to the combined csv one batch at a time, keeping
+    # the row numbers of every basin as the index like pd.concat()
+    out_path = results_folder+"all_basins_frags_"+year+".csv"
+    _append_csv(basin_summary_list, out_path, index=True, encoding='utf-8')
     print("combined fragment csv written")
-    # print(type(combined_csv))
 
-    return combined_csv
+    return out_path
 
@@ -1,13 +1,17 @@
 #%%
-import geopandas as gp, pandas as pd, numpy as np, matplotlib.pyplot as plt, matplotlib.ticker as mtick, seaborn as sns
+import geopandas as gp, pandas as pd, numpy as np, matplotlib.pyplot as plt, matplotlib.ticker as mtick, seaborn as sns, os, sys
 from numpy.core.fromnumeric import size
 from decimal import Decimal, getcontext
 sns.set_style("ticks", {"axes.facecolor": ".8"})
 # %%
-# Specify input locations
-main_directory = 'Spinti_river_fragmentation_data_2022/'
+# Specify input locations and scenario years, the pipeline passes its own
+# (python script.py main_directory years, see run_pipeline.py)
+main_directory = sys.argv[1] if len(sys.argv) > 1 else 'Spinti_river_fragmentation_data_2022/'
+years = sys.argv[2].split(',') if len(sys.argv) > 2 else ['no_dams', '1920', '1950', '1980', '2012']
 data_folder = main_directory+'processed_data/'
 results_folder = main_directory+'analyzed_data/'
+plot_folder = results_folder+'bar_plots/'
+year = years[-1]
 
 #Inputs to plots
 basin_ls = ['Great_Basin', 'Colorado', 'Rio_Grande', 'California', 'Gulf_Coast', 'Red', 
@@ -25,9 +29,9 @@ fig.patch.set_alpha(0)
 pad=5
 
 for count, basin in enumerate(basin_ls):
-    big_dams = gp.read_file(data_folder+"grand_data/2010/"+basin+"_segGeo.shp", index_col='Hydroseq',
+    big_dams = pd.read_csv(results_folder+"grand_analyzed/"+year+"/"+basin+"_dams_"+year+".csv", index_col='Hydroseq',
                     usecols=['Hydroseq', 'DamID','Norm_stor'])
-    all_dams = gp.read_file(data_folder+"nabd_data/2010/"+basin+"_segGeo.shp", index_col='Hydroseq',
+    all_dams = pd.read_csv(results_folder+"nabd_analyzed/"+year+"/"+basin+"_dams_"+year+".csv", index_col='Hydroseq',
                     usecols=['Hydroseq', 'DamID', 'Norm_stor'])
     big_dams = big_dams[big_dams["DamID"]!=0]
     all_dams = all_dams[all_dams["DamID"]!=0]
@@ -123,5 +127,7 @@ for count, basin in enumerate(basin_ls):
     axs[3].plot([0, 1], [1, 1], transform=axs[3].transAxes, **kwargs)
 
     plt.tight_layout(rect=[0.05, 0, 0.95, 1])
-    # plt.savefig(results_folder+"bar_plots/together.png", bbox_inches='tight')
+
+os.makedirs(plot_folder, exist_ok=True)
+fig.savefig(plot_folder+"dam_bar_plots.png", bbox_inches='tight')
 # %%
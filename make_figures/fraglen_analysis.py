@@ -1,56 +1,99 @@
 
 import geopandas as gp, pandas as pd, numpy as np
 
-def frag_diff(results_folder):
-    natural_frag = gp.read_file(results_folder+"no_dams/huc8_indices_no_dams.shp")
-    natural_frag['LENGTHKM_l'].fillna(0,inplace=True)
-
-    #before 1920 bifurcation
-    frag_1920 = gp.read_file(results_folder+"1920/huc8_indices_1920.shp")
-    frag_1920.fillna(0.0,inplace=True)
-    frag_1920["frag_diff"] = frag_1920["LENGTHKM_l"] -  natural_frag["LENGTHKM_l"]
-    cfrag_1920 = frag_1920.copy()  #cumulative fragment difference
-    cfrag_1920.fillna(0.0,inplace=True)
-    cfrag_1920["frag_cudiff"] = frag_1920["LENGTHKM_l"] -  natural_frag["LENGTHKM_l"]
-
-    #before 1950 bifurcation
-    frag_1950 = gp.read_file(results_folder+"1950/huc8_indices_1950.shp")
-    frag_1950.fillna(0.0, inplace=True)
-    frag_1950["frag_diff"] = frag_1950["LENGTHKM_l"] -  frag_1920["LENGTHKM_l"]
-    cfrag_1950 = frag_1950.copy()   #cumulative fragment difference
-    cfrag_1950.fillna(0.0,inplace=True)
-    cfrag_1950["frag_cudiff"] = (frag_1950["LENGTHKM_l"] -  frag_1920["LENGTHKM_l"])+frag_1920["frag_diff"]
-
-    #before 1980 bifurcation
-    frag_1980 = gp.read_file(results_folder+"1980/huc8_indices_1980.shp")
-    frag_1980.fillna(0.0,inplace=True)
-    frag_1980["frag_diff"] = frag_1980["LENGTHKM_l"] -  frag_1950["LENGTHKM_l"]
-    cfrag_1980 = frag_1980.copy()   #cumulative fragment difference
-    cfrag_1980.fillna(0.0,inplace=True)
-    cfrag_1980["frag_cudiff"] = (frag_1980["LENGTHKM_l"] -  frag_1950["LENGTHKM_l"])+frag_1920["frag_diff"]+frag_1950["frag_diff"]
-
-    #2010 bifurcation
-    frag_2012 = gp.read_file(results_folder+"2010/huc8_indices_2010.shp")
-    frag_2012.fillna(0.0,inplace=True)
-    frag_2012["frag_diff"] = frag_2012["LENGTHKM_l"] -  frag_1980["LENGTHKM_l"]
-    cfrag_2012 = frag_2012.copy()   #cumulative fragment difference
-    cfrag_2012.fillna(0.0,inplace=True)
-    cfrag_2012["frag_cudiff"] = (frag_2012["LENGTHKM_l"] -  frag_1980["LENGTHKM_l"])+frag_1920["frag_diff"]+frag_1950["frag_diff"]+frag_1980["frag_diff"]
-    
-    #Save files
-    natural_frag.to_file(results_folder+"no_dams/huc8_no_dams_frag_diff.shp")
-    frag_1920.to_file(results_folder+"1920/huc8_1920_frag_diff.shp")
-    frag_1950.to_file(results_folder+"1950/huc8_1950_frag_diff.shp")
-    frag_1980.to_file(results_folder+"1980/huc8_1980_frag_diff.shp")
-    frag_2012.to_file(results_folder+"2010/huc8_2010_frag_diff.shp")
-    print("Save fragment difference shapefiles complete")
-    cfrag_1920.to_file(results_folder+"1920/huc8_1920_frag_cudiff.shp")
-    cfrag_1950.to_file(results_folder+"1950/huc8_1950_frag_cudiff.shp")
-    cfrag_1980.to_file(results_folder+"1980/huc8_1980_frag_cudiff.shp")
-    cfrag_2012.to_file(results_folder+"2010/huc8_2010_frag_cudiff.shp")
-    print("Save fragment cumulative difference shapefiles complete")
-
-def fraglen_density(basin, years,  bin_ls, data_folder):
+# Labels of the scenario years on the figures, the 2012 scenario holds the dams
+# completed through 2011 and is shown as 2010
+year_labels = {'no_dams': 'PD', '2012': '2010'}
+
+def frag_diff(results_folder, years=('no_dams', '1920', '1950', '1980', '2012'), column='LENGTHKM_len',
+              huc_folder=None):
+    """Change of a HUC8 index between the scenario years.
+
+    The index (by default the number of fragments, LENGTHKM_len) is read for
+    every year from the HUC8_summary.csv of the year, keyed by HUC8, so the
+    years do not need to list the HUC8s in the same order and HUC8s missing in
+    a year count as 0. HUC8s shared by basins are added together. The
+    year-over-year difference (frag_diff, 0 in the first year) and the
+    cumulative difference from the first year (frag_cudiff) are a diff and a
+    cumsum along the year axis, for any number of years.
+
+    Parameters:
+        results_folder (string):
+            Folder of a dam set with a folder for every year (e.g.
+            analyzed_data/nabd_analyzed/).
+        years (list, optional):
+            Scenario years in chronological order.
+        column (string, optional):
+            Column of the HUC8 summaries to compare.
+        huc_folder (string, optional):
+            Folder with HUC8_CONUS.shp. If given the table is also exported with
+            the HUC8 geometry (see export_frag_diff()).
+
+    Returns:
+        table (pandas.DataFrame): The index, frag_diff and frag_cudiff indexed
+            by HUC8 and Year, also saved to results_folder/huc8_frag_diff.csv.
+    """
+    values = []
+    for year in years:
+        summary = pd.read_csv(results_folder+year+"/HUC8_summary.csv", usecols=['HUC8', column])
+        values.append(summary.dropna(subset=['HUC8']).groupby('HUC8')[column].sum())
+    wide = pd.concat(values, axis=1, keys=years).fillna(0.0)
+    wide.index = wide.index.astype(np.int64)
+
+    # Differences along the year axis
+    index = wide.values
+    diff = np.diff(index, axis=1, prepend=index[:, :1])
+    table = pd.DataFrame({column: index.ravel(), 'frag_diff': diff.ravel(), 'frag_cudiff': np.cumsum(diff, axis=1).ravel()},
+                         index=pd.MultiIndex.from_product([wide.index, years], names=['HUC8', 'Year']))
+    table.to_csv(results_folder+"huc8_frag_diff.csv")
+    print("Save fragment difference table complete")
+
+    if huc_folder is not None:
+        export_frag_diff(table, huc_folder, results_folder+"huc8_frag_diff.gpkg")
+
+    return table
+
+
+def export_frag_diff(table, huc_folder, path):
+    """Joins the HUC8 change table to the HUC8 geometry and saves it.
+
+    Every HUC8 polygon is written once with a column for every measure and
+    year (e.g. frag_diff_1950), so the file does not repeat the geometry for
+    every year. HUC8s without results are 0.
+
+    Parameters:
+        table (pandas.DataFrame):
+            Table from frag_diff().
+        huc_folder (string):
+            Folder with HUC8_CONUS.shp.
+        path (string):
+            Output file (e.g. a GeoPackage, which keeps the full column names).
+
+    Returns:
+        huc8 (geopandas.GeoDataFrame): HUC8 geometry with the table by year.
+    """
+    years = list(table.index.unique('Year'))
+    wide = table.unstack('Year')
+    wide = wide[[(col, year) for col in table.columns for year in years]]
+    wide.columns = [col+'_'+year for col, year in wide.columns]
+
+    huc8 = gp.read_file(huc_folder+'HUC8_CONUS.shp')
+    huc8 = huc8[['OBJECTID', 'AreaSqKm', 'Name', 'States', 'HUC8_no', 'geometry']]
+    huc8 = huc8.merge(wide, left_on='HUC8_no', right_index=True, how='left')
+    huc8[wide.columns] = huc8[wide.columns].fillna(0.0)
+    huc8.to_file(path)
+    print("Save fragment difference geometry complete")
+
+    return huc8
+
+def fragments_path(results_folder, dam_set, year, basin):
+    """Path of the fragments csv of a basin (or of 'all_basins') in a scenario folder."""
+    folder = results_folder+dam_set+"_analyzed/"+year+"/"
+    if basin == 'all_basins':
+        return folder+"all_basins_frags_"+year+".csv"
+    return folder+basin+"_fragments_"+year+".csv"
+
+def fraglen_density(basin, years,  bin_ls, results_folder):
     bins = np.clip(bin_ls, bin_ls[0], bin_ls[-1])
     labels = [str(x) for x in bins[1:]]
     labels.append('total_frags')
@@ -62,8 +105,8 @@ def fraglen_density(basin, years,  bin_ls, data_folder):
     small_dams_fraglen = pd.DataFrame(0, index=years, columns=labels)
 
     for year in years:
-        all_dams_frags = pd.read_csv(data_folder+"nabd_data/"+year+"/"+basin+"_fragments.csv")
-        big_dams_frags = pd.read_csv(data_folder+"grand_data/"+year+"/"+basin+"_fragments.csv")
+        all_dams_frags = pd.read_csv(fragments_path(results_folder, 'nabd', year, basin))
+        big_dams_frags = pd.read_csv(fragments_path(results_folder, 'grand', year, basin))
         
         all_dams_fraglen_diff.loc[year,"total_frags"]=len(all_dams_frags["LENGTHKM"])
         big_dams_fraglen_diff.loc[year,"total_frags"]=len(big_dams_frags["LENGTHKM"])
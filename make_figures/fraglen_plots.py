@@ -1,12 +1,14 @@
 
-import geopandas as gp, pandas as pd, numpy as np, matplotlib.pyplot as plt, seaborn as sns
+import geopandas as gp, pandas as pd, numpy as np, matplotlib.pyplot as plt, seaborn as sns, os, sys
 import fraglen_analysis as fla
 from matplotlib.pyplot import cm
 
 sns.set_style("ticks", {"axes.facecolor": ".8"})
 
-# Specify input locations
-main_directory = 'Spinti_river_fragmentation_data_2022/'
+# Specify input locations and scenario years, the pipeline passes its own
+# (python fraglen_plots.py main_directory years, see run_pipeline.py)
+main_directory = sys.argv[1] if len(sys.argv) > 1 else 'Spinti_river_fragmentation_data_2022/'
+years = sys.argv[2].split(',') if len(sys.argv) > 2 else ['no_dams', '1920', '1950', '1980', '2012']
 data_folder = main_directory+'processed_data/'
 results_folder = main_directory+'analyzed_data/'
 plot_folder = main_directory+'analyzed_data/len_analysis/'
@@ -15,17 +17,15 @@ huc2 = gp.read_file(main_directory+"hucs/huc2_clipped.shp")
 basin_ls = ['Great_Basin', 'Colorado', 'Rio_Grande', 'California', 'Gulf_Coast', 'Red', 
 'Mississippi', 'Columbia', 'South_Atlantic', 'Great_Lakes', 'North_Atlantic', 'all_basins']
 
-#Number of fragments per HUC 8
-fla.frag_diff(results_folder)
+os.makedirs(plot_folder, exist_ok=True)
 
 #Plotting by fragment length over time
-years = ["no_dams", "1920", "1950", "1980", "2010"]
 bin_ls = [0, 10, 100, 1000, 10000]
 lengths = bin_ls[1:]
 length_dict={10: '0 - 10 km', 100: '10 - 100 km', 1000: '100 - 1,000 km', 10000: '1,000 - 10,000 km'}
 
 ##Plot labels
-xlabels =["PD", "1920", "1950", "1980", "2010"]
+xlabels = [fla.year_labels.get(year, year) for year in years]
 basin_abr = ["GB", "CO", "RG", "CA", "GC", "RE", "MI", "CB", "SA", "GL", "NA", "CONUS"]
 colors = ['#9e0142', '#d53e4f', '#f46d43', '#fdae61', '#fff66f', '#d1ef77', '#79ce6b', '#5bbb9d', '#3288bd', '#3952aa', '#4f438e', 'black']
 basin_ls2 = [i.replace("_", " ") for i in basin_ls]
@@ -38,7 +38,7 @@ fig2, axes2 = plt.subplots(1, 2, figsize=(25, 10))
 fig2.patch.set_alpha(0)
 for count, basin in enumerate(basin_ls):
     #Categorized fragment lengths figure 
-    fraglen_df =fla.fraglen_density(basin, years, bin_ls, data_folder)
+    fraglen_df =fla.fraglen_density(basin, years, bin_ls, results_folder)
     for row, l in enumerate(lengths):
         if basin != 'all_basins':
             basin = basin.replace("_", " ")
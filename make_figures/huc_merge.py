@@ -1,6 +1,6 @@
 import geopandas as gp, pandas as pd, numpy as np
 
-def HUC2_indices_merge(results_folder, year):
+def HUC2_indices_merge(results_folder, year, huc_folder='hucs/'):
     """Merges HUC2 summary with HUC2 shapefile.
         This function takes the combined HUC2 summary csv created in the
         create_combined_csv.py function and merges it with the HUC2 shapefile for
@@ -10,6 +10,8 @@ def HUC2_indices_merge(results_folder, year):
         Parameters:
             folder (string):
                 Folder where combined csv is saved.
+            huc_folder (string, optional):
+                Folder containing the HUC shapefiles for CONUS.
             HUC2_summary (pandas.DataFrame):
                 Dataframe containing indices summarized by HUC2.
                 columns
@@ -21,7 +23,7 @@ def HUC2_indices_merge(results_folder, year):
             A shapefile containing geometry and indices by HUC2.
     """  
     HUC2_summary = pd.read_csv(results_folder+'HUC2_summary.csv')
-    huc2 = gp.read_file("hucs/HUC2_CONUS.shp")
+    huc2 = gp.read_file(huc_folder+'HUC2_CONUS.shp')
     huc2 = huc2[['OBJECTID', 'AreaSqKm', 'AreaAcres', 'Name', 'States', 'HUC2_db', 'geometry']]
     huc2 = huc2.merge(HUC2_summary, left_on = 'HUC2_db', right_on = 'HUC2', how = 'left')
 
@@ -30,7 +32,7 @@ def HUC2_indices_merge(results_folder, year):
     
     return huc2
 
-def HUC4_indices_merge(results_folder, year):
+def HUC4_indices_merge(results_folder, year, huc_folder='hucs/'):
     """Merges HUC4 summary with HUC4 shapefile.
         This function takes the combined HUC4 summary csv created in the
         create_combined_csv.py function and merges it with the HUC4 shapefile for
@@ -40,6 +42,8 @@ def HUC4_indices_merge(results_folder, year):
         Parameters:
             folder (string):
                 Folder where combined csv is saved.
+            huc_folder (string, optional):
+                Folder containing the HUC shapefiles for CONUS.
             HUC4_summary (pandas.DataFrame):
                 Dataframe containing indices summarized by HUC4.
                 columns
@@ -51,7 +55,7 @@ def HUC4_indices_merge(results_folder, year):
             A shapefile containing geometry and indices by HUC4.
     """   
     HUC4_summary = pd.read_csv(results_folder+'HUC4_summary.csv')
-    huc4 = gp.read_file("hucs/HUC4_CONUS.shp")
+    huc4 = gp.read_file(huc_folder+'HUC4_CONUS.shp')
     huc4 = huc4[['OBJECTID', 'AreaSqKm', 'AreaAcres', 'Name', 'States', 'HUC4_no', 'geometry']]
     huc4 = huc4.merge(HUC4_summary, left_on = 'HUC4_no', right_on = 'HUC4', how = 'left')
     huc4 = huc4.drop(columns=['HUC4'])
@@ -61,7 +65,7 @@ def HUC4_indices_merge(results_folder, year):
     
     return huc4
 
-def HUC8_indices_merge(results_folder, year):
+def HUC8_indices_merge(results_folder, year, huc_folder='hucs/'):
     """Merges HUC8 summary with HUC8 shapefile.
         This function takes the combined HUC8 summary csv created in the
         create_combined_csv.py function and merges it with the HUC8 shapefile for
@@ -71,6 +75,8 @@ def HUC8_indices_merge(results_folder, year):
         Parameters:
             folder (string):
                 Folder where combined csv is saved.
+            huc_folder (string, optional):
+                Folder containing the HUC shapefiles for CONUS.
             HUC8_summary (pandas.DataFrame):
                 Dataframe containing indices summarized by HUC8.
                 columns
@@ -83,7 +89,7 @@ def HUC8_indices_merge(results_folder, year):
     """   
     HUC8_summary = pd.read_csv(results_folder+'HUC8_summary.csv')
     # huc8 = gp.read_file("HPC_runs_fixed/analyzed_data/huc8_indices.shp") 
-    huc8 = gp.read_file("hucs/HUC8_CONUS.shp") 
+    huc8 = gp.read_file(huc_folder+'HUC8_CONUS.shp') 
     huc8 = huc8[['OBJECTID', 'AreaSqKm', 'AreaAcres', 'Name', 'States', 'HUC8_no', 'geometry']]  
     huc8 = huc8.merge(HUC8_summary, left_on = 'HUC8_no', right_on = 'HUC8', how = 'left')
     huc8 = huc8.drop(columns=['HUC8'])
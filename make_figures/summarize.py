@@ -1,37 +1,45 @@
 # %%
-import geopandas as gp, pandas as pd, numpy as np
-import create_csvs as crc, huc_merge as hm
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'process_data'))
+import create_csvs as crc, huc_merge as hm, workflow as wf, geometry as geo
 # %%
-#Specifying inputs
+#Specifying inputs, the scenario years and dam sets match run_workflow.py
 basin_ls = ['California', 'Colorado', 'Columbia', 'Great_Basin', 'Great_Lakes',
 'Gulf_Coast','Mississippi', 'North_Atlantic', 'Red', 'Rio_Grande','South_Atlantic']
-years = ['no_dams', '1920', '1950', '1980', '2010']
+years = ['no_dams', '1920', '1950', '1980', '2012']
+dam_sets = ['nabd', 'grand']
 main_directory = 'Spinti_river_fragmentation_data_2022/'
-results_folder = main_directory+'analyzed_data/'
+huc_folder = main_directory+'hucs/'
 
-for year in years:
-    results_folder2 = results_folder+year+'/'
-    print("---------------"+year+"---------------")
+# Combine the basin segment geometry into a virtual layer (.vrt) that reads the
+# basin files in place instead of a copy (see create_csvs.py)
+virtual_segGeo = True
+ext = geo.geometry_exts[wf.geometry_formats[0]]
 
-    #HUC analysis
-    HUC_list=['HUC2','HUC4','HUC8']
+for dam_set in dam_sets:
+    for year in years:
+        results_folder = wf.scenario_folder(main_directory, dam_set, year)
+        print("---------------"+dam_set+" "+year+"---------------")
 
-    ## Create combined csv
-    for huc in HUC_list:
-        crc.combined_huc_csv(basin_ls, results_folder2, huc)
+        #HUC analysis
+        HUC_list=['HUC2','HUC4','HUC8']
 
-    ## Merge the combined csvs with HUC shapefiles
-    huc2 = hm.HUC2_indices_merge(results_folder2, year)  #HUC2
-    print("HUC 2 indices finished")
-    huc4 = hm.HUC4_indices_merge(results_folder2, year)  #HUC4
-    print("\n"+"HUC 4 indices finished")
-    huc8 = hm.HUC8_indices_merge(results_folder2, year)    #HUC8
-    print("\n" +"HUC 8 indices finished")
+        ## Create combined csv
+        for huc in HUC_list:
+            crc.combined_huc_csv(basin_ls, results_folder, huc, '_'+year)
 
-    #Create combined basin files
-    crc.combined_segGeo_csv(basin_ls, results_folder2, year)
-    crc.combined_frag_csv(basin_ls, results_folder2, year)
-    print("\n" +"Create combined csvs finished")
+        ## Merge the combined csvs with HUC shapefiles
+        huc2 = hm.HUC2_indices_merge(results_folder, year, huc_folder)  #HUC2
+        print("HUC 2 indices finished")
+        huc4 = hm.HUC4_indices_merge(results_folder, year, huc_folder)  #HUC4
+        print("\n"+"HUC 4 indices finished")
+        huc8 = hm.HUC8_indices_merge(results_folder, year, huc_folder)    #HUC8
+        print("\n" +"HUC 8 indices finished")
+
+        #Create combined basin files
+        crc.combined_segGeo_csv(basin_ls, results_folder, year, '_'+year, ext, virtual_segGeo)
+        crc.combined_frag_csv(basin_ls, results_folder, year, '_'+year)
+        print("\n" +"Create combined csvs finished")
 
 print("\n"+"** Summarize by HUC and all_basins complete **")
 # %%
@@ -1,26 +1,30 @@
 # %%
 from matplotlib import pyplot as plt
-import pandas as pd, numpy as np, geopandas as gp, os
+import pandas as pd, numpy as np, geopandas as gp, os, sys
 from pathlib import Path
+import fraglen_analysis as fla
 
-# Specify inputs locations
-main_directory = 'Spinti_river_fragmentation_data_2022/'
+# Specify inputs locations, scenario years and basins, the pipeline passes its
+# own (python weibull_plots.py main_directory years basins, see run_pipeline.py)
+main_directory = sys.argv[1] if len(sys.argv) > 1 else 'Spinti_river_fragmentation_data_2022/'
+years = sys.argv[2].split(',') if len(sys.argv) > 2 else ['no_dams', '1920', '1950', '1980', '2012']
 data_folder = main_directory+'processed_data/'
 results_folder = main_directory+'analyzed_data/'
 
-basins = ['Great_Basin', 'Rio_Grande', 'Gulf_Coast', 'Columbia', 'Great_Lakes', 'all_basins']
-dam_dict = {'no_dams':['nabd_data', 'no_dams'],'all_dams':['nabd_data', '2010'],'large_dams':['grand_data', '2010']}
+basins = sys.argv[3].split(',') if len(sys.argv) > 3 else ['Great_Basin', 'Rio_Grande', 'Gulf_Coast', 'Columbia', 'Great_Lakes', 'all_basins']
+dam_dict = {'no_dams':['nabd', 'no_dams'],'all_dams':['nabd', years[-1]],'large_dams':['grand', years[-1]]}
 
 c_all_dams = ['#9e0142', '#f46d43', '#fff66f', '#5bbb9d','#3952aa', '#a5a5a5']
 c_big_dams = ['#740030', '#9a422a', '#afa94c', '#326857', '#213063', '#636262']
 c_no_dams = ['black']
 color_dict = {z[0]: list(z[1:]) for z in zip(basins, c_all_dams, c_big_dams)}
+os.makedirs(results_folder+'weibull/', exist_ok=True)
 # %%
 for basin, c in color_dict.items():
     fig = plt.figure()
     ax = fig.add_subplot()
     for k,v in dam_dict.items():
-        basin_frags = pd.read_csv(gdrive+data_folder+v[0]+"/"+v[1]+"/"+basin+"_fragments.csv")
+        basin_frags = pd.read_csv(fla.fragments_path(results_folder, v[0], v[1], basin))
         frag_weibull = basin_frags[["LENGTHKM", "Frag_Index"]].copy()
         frag_weibull['rank'] = frag_weibull['LENGTHKM'].rank(method='dense', ascending=False)
         frag_weibull['weibull'] = frag_weibull['rank']/len(frag_weibull['LENGTHKM']+1)
@@ -46,13 +50,13 @@ for basin, c in color_dict.items():
         plt.legend()
         plt.tight_layout()
         fig.show()
-        fig.savefig(gdrive+results_folder+'weibull/'+basin+'_weibull.png', dpi = 150)
+        fig.savefig(results_folder+'weibull/'+basin+'_weibull.png', dpi = 150)
     else:
         basin = 'CONUS'
         plt.title(basin, size=15)
         plt.legend()
         plt.tight_layout()
         fig.show()
-        fig.savefig(gdrive+results_folder+'weibull/'+basin+'_weibull.png', dpi = 150)
+        fig.savefig(results_folder+'weibull/'+basin+'_weibull.png', dpi = 150)
 
 # %%
@@ -0,0 +1,311 @@
+import numpy as np, os, json
+
+
+def build_ancestry(segments):
+    """Builds the ancestry index of a basin's downstream tree.
+
+    Every segment is given a dense ID (0 to n-1) in order of its Hydroseq and
+    its downstream neighbor is its parent. The index holds
+        - DFS interval labels: the segments upstream of segment i (and i itself)
+          are the segments with tin in [tin[i], tin[i]+size[i])
+        - A binary lifting table: lift[k, i] is the dense ID of the segment
+          2**k steps downstream of i (-1 past the outlet)
+        - The depth of every segment (steps to its outlet) and the length
+          downstream of it to the outlet in km
+    Everything is built with whole array operations: the depths, lengths and
+    lifting table by pointer jumping and the sizes and labels one depth at a
+    time.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments indexed by Hydroseq with the columns
+            DnHydroseq, LENGTHKM and DamID.
+
+    Returns:
+        anc (dict): Dictionary of the index arrays (see write_ancestry()).
+    """
+    segments = segments.sort_index()
+    hydroseq = segments.index.values.astype(np.int64)
+    n = len(hydroseq)
+    parent = node_index({'hydroseq': hydroseq}, segments['DnHydroseq'].fillna(0).values)
+
+    # Depth, length to the outlet and the 2**k-th ancestors by pointer jumping
+    has_dn = parent >= 0
+    depth = has_dn.astype(np.int64)
+    length = segments['LENGTHKM'].fillna(0).values.astype(np.float64)
+    outlet_km = np.where(has_dn, length[np.maximum(parent, 0)], 0.0)
+    lift = [parent]
+    anc = parent.copy()
+    while (anc >= 0).any():
+        if len(lift) > np.log2(max(n, 2)) + 1:
+            raise ValueError('The downstream network has a cycle')
+        up = anc >= 0
+        depth[up] += depth[anc[up]]
+        outlet_km[up] += outlet_km[anc[up]]
+        anc = np.where(up, anc[np.maximum(anc, 0)], -1)
+        lift.append(anc.copy())
+    lift = np.array(lift[:-1] if len(lift) > 1 else lift, dtype=np.int32)
+
+    # Subtree sizes from the deepest segments down to the outlets
+    by_depth = np.argsort(-depth, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(depth[by_depth]) != 0])
+    bounds = np.append(starts, n)
+    size = np.ones(n, dtype=np.int64)
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        nodes = by_depth[a:b]
+        nodes = nodes[has_dn[nodes]]
+        np.add.at(size, parent[nodes], size[nodes])
+
+    # Preorder labels from the outlets up, siblings in order of Hydroseq
+    tin = np.zeros(n, dtype=np.int64)
+    for a, b in zip(bounds[::-1][1:], bounds[::-1][:-1]):
+        nodes = by_depth[a:b]
+        key = np.where(has_dn[nodes], parent[nodes], -1)
+        nodes = nodes[np.lexsort((nodes, key))]
+        key = np.where(has_dn[nodes], parent[nodes], -1)
+        csum = np.cumsum(size[nodes]) - size[nodes]
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        offset = csum - np.repeat(csum[first], np.diff(np.append(first, len(nodes))))
+        tin[nodes] = np.where(key >= 0, tin[np.maximum(key, 0)] + 1, 0) + offset
+        if key[0] < 0:
+            # Outlets are laid out one after the other
+            roots = nodes[key < 0]
+            tin[roots] = np.cumsum(size[roots]) - size[roots]
+
+    anc = {'hydroseq': hydroseq, 'parent': parent, 'depth': depth, 'outlet_km': outlet_km,
+           'tin': tin, 'size': size, 'lift': lift}
+    dams = segments['DamID'].fillna(0).values > 0
+
+    return set_dams(anc, hydroseq[dams], segments['DamID'].values[dams])
+
+
+def set_dams(anc, hydroseq, dam_id):
+    """Places dams on the segments of an ancestry index.
+
+    The dams are sorted by the DFS label of their segment for the range scans
+    of upstream_dams(). The network arrays are shared, so the same network
+    can be given the dams of many scenarios.
+
+    Parameters:
+        anc (dict):
+            Ancestry index.
+        hydroseq (numpy.ndarray):
+            Hydroseq of the segment of every dam.
+        dam_id (numpy.ndarray):
+            DamID of every dam.
+
+    Returns:
+        anc (dict): Ancestry index with the dam_tin, dam_node and dam_id arrays.
+    """
+    nodes = node_index(anc, hydroseq)
+    nodes, dam_id = nodes[nodes >= 0], np.asarray(dam_id)[nodes >= 0]
+    order = np.argsort(anc['tin'][nodes], kind='stable')
+    anc = dict(anc, dam_tin=np.asarray(anc['tin'][nodes][order]), dam_node=nodes[order],
+               dam_id=dam_id[order].astype(np.int64))
+
+    return anc
+
+
+def write_ancestry(segments, folder):
+    """Builds the ancestry index of a basin and writes it to a folder.
+
+    The arrays are written like the fragment graph (see fraggraph.py) so they
+    can be memory mapped.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments indexed by Hydroseq with the columns
+            DnHydroseq, LENGTHKM and DamID.
+        folder (string):
+            Folder where the arrays are saved. It is created if needed.
+
+    Returns:
+        Arrays written to folder
+            - hydroseq.npy: Hydroseq of every dense ID
+            - parent.npy: Dense ID of the downstream segment (-1 at outlets)
+            - depth.npy, outlet_km.npy: Steps and km to the outlet
+            - tin.npy, size.npy: DFS interval labels
+            - lift.npy: Binary lifting table
+            - dam_tin.npy, dam_node.npy, dam_id.npy: Dams in order of tin
+            - ancestry.json: Number of segments and dams
+    """
+    os.makedirs(folder, exist_ok=True)
+    anc = build_ancestry(segments)
+    for name, values in anc.items():
+        np.save(os.path.join(folder, name+'.npy'), values)
+
+    with open(os.path.join(folder, 'ancestry.json'), 'w') as f:
+        json.dump({'n_segments': len(anc['hydroseq']), 'n_dams': len(anc['dam_id']),
+                   'arrays': list(anc)}, f)
+
+
+def load_ancestry(folder, mmap=True):
+    """Loads an ancestry index written by write_ancestry().
+
+    Parameters:
+        folder (string):
+            Folder where the arrays are saved.
+        mmap (boolean, optional):
+            If True the arrays are memory mapped instead of read into memory.
+
+    Returns:
+        anc (dict): Dictionary of the index arrays.
+    """
+    mode = 'r' if mmap else None
+    with open(os.path.join(folder, 'ancestry.json')) as f:
+        meta = json.load(f)
+
+    return {name: np.load(os.path.join(folder, name+'.npy'), mmap_mode=mode) for name in meta['arrays']}
+
+
+def node_index(anc, hydroseq):
+    """Converts Hydroseqs to dense IDs (-1 if not in the basin)."""
+    hydroseq = np.atleast_1d(hydroseq).astype(np.int64)
+    pos = np.searchsorted(anc['hydroseq'], hydroseq)
+    pos = np.clip(pos, 0, len(anc['hydroseq'])-1)
+    return np.where(anc['hydroseq'][pos] == hydroseq, pos, -1)
+
+
+def is_upstream(anc, up, down):
+    """Tests whether segments are upstream of other segments.
+
+    Each test is two comparisons of the DFS labels, so millions of pairs are
+    tested at once.
+
+    Parameters:
+        anc (dict):
+            Ancestry index from build_ancestry() or load_ancestry().
+        up, down (numpy.ndarray):
+            Dense IDs of the pairs of segments (see node_index()).
+
+    Returns:
+        upstream (numpy.ndarray): True where up is upstream of down. A segment
+            is not upstream of itself.
+    """
+    tin, size = anc['tin'], anc['size']
+    up, down = np.atleast_1d(up), np.atleast_1d(down)
+    return (tin[up] > tin[down]) & (tin[up] < tin[down] + size[down])
+
+
+def upstream_dams(anc, nodes):
+    """Lists the dams upstream of segments with a range scan.
+
+    The dams upstream of a segment are a contiguous range of the dams sorted
+    by their DFS label, so each segment takes two binary searches.
+
+    Parameters:
+        anc (dict):
+            Ancestry index.
+        nodes (numpy.ndarray):
+            Dense IDs of the segments (e.g. gauges).
+
+    Returns:
+        indptr (numpy.ndarray): The dams of nodes[i] are dam_id[indptr[i]:indptr[i+1]]
+            (CSR format). A dam on the segment itself is included.
+        dam_id (numpy.ndarray): DamIDs of the dams.
+        dam_hydroseq (numpy.ndarray): Hydroseq of the segments of the dams.
+    """
+    tin, size = anc['tin'], anc['size']
+    nodes = np.atleast_1d(nodes)
+    lo = np.searchsorted(anc['dam_tin'], tin[nodes], side='left')
+    hi = np.searchsorted(anc['dam_tin'], tin[nodes] + size[nodes], side='left')
+    indptr = np.zeros(len(nodes)+1, dtype=np.int64)
+    np.cumsum(hi - lo, out=indptr[1:])
+    picks = _ranges(lo, hi)
+
+    return indptr, np.asarray(anc['dam_id'])[picks], np.asarray(anc['hydroseq'])[np.asarray(anc['dam_node'])[picks]]
+
+
+def _ranges(lo, hi):
+    # Concatenation of the integer ranges [lo[i], hi[i])
+    counts = hi - lo
+    total = counts.sum()
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    return offsets + np.arange(total)
+
+
+def downstream_path(anc, nodes):
+    """Lists the segments from segments to their outlets.
+
+    All of the paths are followed at the same time, one step per iteration,
+    so the work is proportional to the total path length.
+
+    Parameters:
+        anc (dict):
+            Ancestry index.
+        nodes (numpy.ndarray):
+            Dense IDs of the starting segments.
+
+    Returns:
+        indptr (numpy.ndarray): The path of nodes[i] is path[indptr[i]:indptr[i+1]]
+            (CSR format), starting at nodes[i] and ending at its outlet.
+        path (numpy.ndarray): Hydroseq of the segments of the paths.
+    """
+    parent = anc['parent']
+    nodes = np.atleast_1d(nodes)
+    indptr = np.zeros(len(nodes)+1, dtype=np.int64)
+    np.cumsum(anc['depth'][nodes] + 1, out=indptr[1:])
+    path = np.zeros(indptr[-1], dtype=np.int64)
+
+    pos, current = indptr[:-1].copy(), nodes.copy()
+    while len(current):
+        path[pos] = current
+        current = parent[current]
+        keep = current >= 0
+        pos, current = pos[keep] + 1, current[keep]
+
+    return indptr, np.asarray(anc['hydroseq'])[path]
+
+
+def ancestor(anc, nodes, k):
+    """Finds the segments k steps downstream of segments (-1 past the outlet).
+
+    Uses the binary lifting table, one lookup per bit of k.
+    """
+    lift = anc['lift']
+    nodes = np.atleast_1d(nodes).astype(np.int64)
+    k = np.broadcast_to(np.asarray(k, dtype=np.int64), nodes.shape)
+    nodes = np.where(k > anc['depth'][nodes], -1, nodes)
+    for bit in range(len(lift)):
+        step = ((k >> bit) & 1).astype(bool) & (nodes >= 0)
+        nodes[step] = lift[bit][nodes[step]]
+
+    return nodes
+
+
+def confluence(anc, a, b):
+    """Finds the first segment downstream of both of two segments (-1 if none).
+
+    The deeper segment is lifted to the depth of the other and both are then
+    lifted together, largest steps first, while they differ.
+
+    Parameters:
+        anc (dict):
+            Ancestry index.
+        a, b (numpy.ndarray):
+            Dense IDs of the pairs of segments.
+
+    Returns:
+        nodes (numpy.ndarray): Dense IDs of the confluences. If one segment is
+            upstream of the other, the downstream one.
+    """
+    lift, depth = anc['lift'], anc['depth']
+    a, b = np.atleast_1d(a).astype(np.int64), np.atleast_1d(b).astype(np.int64)
+    deeper = depth[a] < depth[b]
+    a, b = np.where(deeper, b, a), np.where(deeper, a, b)
+    a = ancestor(anc, a, depth[a] - depth[b])
+
+    for bit in range(len(lift)-1, -1, -1):
+        differ = (a != b) & (lift[bit][a] != lift[bit][b])
+        a[differ], b[differ] = lift[bit][a[differ]], lift[bit][b[differ]]
+    same = a == b
+    return np.where(same, a, np.where(lift[0][a] == lift[0][b], lift[0][a], -1))
+
+
+def downstream_km(anc, up, down):
+    """River distance (km) from the downstream end of up to the downstream
+    end of down, NaN where up is not upstream of down."""
+    dist = anc['outlet_km'][up] - anc['outlet_km'][down]
+    return np.where(is_upstream(anc, up, down), dist, np.nan)
@@ -1,7 +1,8 @@
-import numpy as np
+import numpy as np, pandas as pd
 import datetime
 
-def make_fragments(segments, exit_id=999000, verbose=False, subwatershed=True):
+def make_fragments(segments, exit_id=999000, verbose=False, subwatershed=True,
+                   progress=None, resume=None):
     """Create stream fragments from stream segments based on dam locations.
 
     This function traverses through a stream network using NHD stream segment
@@ -34,36 +35,55 @@ def make_fragments(segments, exit_id=999000, verbose=False, subwatershed=True):
 
              If this is set to False it  will select all subwatersheds with an UpHydroseq == 0 
 
+        progress (function, optional):
+            Function called before every starting point with the segments, the
+            IDs of the segments in the queue and the next exit ID, used to save
+            checkpoints of long runs (see checkpoint.traversal_saver()).
+
+        resume (tuple, optional):
+            (columns, queue IDs, exit ID) saved by progress to resume a traversal
+            from, where columns holds the Frag, Headwater, FragEnd and step 
+            columns indexed by segment ID.
     
     Returns:
         segments (pandas.DataFrame): An updated dataframe with a fragments column.
     """
     
-    # Add a column for Fragment #'s and initialize with the DamIDs
-    segments['Frag'] = segments['DamID']
-    #print(segments['Frag'])
-
-
-    # If the subwatershed option is True, any segment which is not the
-    # downstream neigbhor of another segment is identified as a headwater
-    # If False, only grabs segments with an upstream hydroseq = 0
-    if subwatershed:
-        intersect = np.intersect1d(segments.index, segments.DnHydroseq.values)
-        queue = segments[~segments.index.isin(intersect)]
-    else: 
-        #initialize queue with all segments with upstream ID of 0
-        queue = segments.loc[segments.UpHydroseq == 0]
-
-    #record these segments as headwaters
-    segments['Headwater']=np.zeros(len(segments))
-    segments.loc[queue.index,'Headwater'] = 1
-
-    # Setup a column to note segments that are fragment ends
-    segments['FragEnd'] = np.zeros(len(segments))
-    segments.FragEnd[segments['DamID']>0] = 2 #all segments with a dam are a fragment outlet
+    if resume is not None:
+        # Pick up the fragment columns and the queue where the traversal stopped
+        columns, queue_ids, exit_id = resume
+        for col in columns.columns:
+            segments[col] = columns[col].reindex(segments.index).values
+        queue = segments.loc[queue_ids]
+    else:
+        # Add a column for Fragment #'s and initialize with the DamIDs
+        segments['Frag'] = segments['DamID']
+        #print(segments['Frag'])
+
+
+        # If the subwatershed option is True, any segment which is not the
+        # downstream neigbhor of another segment is identified as a headwater
+        # If False, only grabs segments with an upstream hydroseq = 0
+        if subwatershed:
+            intersect = np.intersect1d(segments.index, segments.DnHydroseq.values)
+            queue = segments[~segments.index.isin(intersect)]
+        else: 
+            #initialize queue with all segments with upstream ID of 0
+            queue = segments.loc[segments.UpHydroseq == 0]
+
+        #record these segments as headwaters
+        segments['Headwater']=np.zeros(len(segments))
+        segments.loc[queue.index,'Headwater'] = 1
+
+        # Setup a column to note segments that are fragment ends
+        segments['FragEnd'] = np.zeros(len(segments))
+        segments.FragEnd[segments['DamID']>0] = 2 #all segments with a dam are a fragment outlet
 
     snum = 0  # Counter for the segment starting points -- just for print purposes
     while len(queue) > 0:
+        if progress is not None:
+            progress(segments, queue.index.values, exit_id)
+
         # Initialization for starting segment:
         step = 0  # start a counter for steps down the fragment
         snum = snum + 1
@@ -156,6 +176,7 @@ def agg_by_frag(segments):
                     no dams should have a value of 0. 
                 (4) Frag: Fragment ID assigned to every segment
                 (5) FragEnd: Flag indicating if a segment is a fragment end point (1= domain exit, 2=dam)
+                (6) LongPathKM, MainstemKM (optional): Path lengths from longest_path()
         
         exit_id (int, optional): 
             Initial ID number to use for labeling terminal fragments.
@@ -182,6 +203,10 @@ def agg_by_frag(segments):
                                             'HUC4', 'HUC8', 'Norm_stor_up', 'DamCount_up',
                                             'LENGTHKM_up', 'DOR', 'FragEnd']])
 
+    # Join in the fragment path lengths if longest_path() has been run
+    path_cols = [i for i in ['LongPathKM', 'MainstemKM'] if i in FragEnds.columns]
+    fragments0 = fragments0.join(FragEnds[path_cols])
+
     # Use the downstream segment for each fragment to get its
     # downstream fragment IDs 
     fragments0['DnHydroseq'] = fragments0['DnHydroseq'].replace(0, np.nan)
@@ -399,3 +424,331 @@ def upstream_ag(data, downIDs, agg_value):
     #print("Aggregating: ", (t2-t1))
 
     return up_agg
+
+
+def topo_levels(data, downIDs):
+    """Orders a stream network into levels for vectorized traversal.
+
+    This function sorts segments or fragments into topological levels so that
+    network sweeps can be done with array operations instead of a queue. Every
+    member of a level has all of its upstream neighbors in earlier levels, so 
+    walking the levels in order moves from the headwaters to the outlets and 
+    walking them in reverse moves from the outlets to the headwaters. 
+
+    Parameters:
+        data (pandas.DataFrame): 
+            Data frame of segments or fragments where the index is the segment or fragment
+            ID. It must contain a 'downIDs' column with downstream segment or fragment IDS.
+        
+        downIDs (string): 
+            Column name that contains the downstream IDs within the dataframe
+    
+    Returns:
+        dn_pos (numpy.ndarray): Row position of the downstream neighbor for every row 
+            in data (-1 if the downstream neighbor is not in data)
+        levels (list): List of arrays of row positions, ordered from headwaters to outlets
+    """
+    # Positions of the downstream neighbors, -1 for exits (0, NaN or outside the basin)
+    dn_pos = data.index.get_indexer(data[downIDs].values)
+
+    # Figure out how many segments are directly upstream from each segment
+    # i.e. how many parents it has
+    remaining = np.bincount(dn_pos[dn_pos >= 0], minlength=len(data))
+
+    # Start from the segments with no parents and release each downstream
+    # neighbor once all of its parents have been visited
+    levels = []
+    frontier = np.flatnonzero(remaining == 0)
+    while len(frontier) > 0:
+        levels.append(frontier)
+        dtemp = dn_pos[frontier]
+        dtemp = dtemp[dtemp >= 0]
+        np.subtract.at(remaining, dtemp, 1)
+        dtemp = np.unique(dtemp)
+        frontier = dtemp[remaining[dtemp] == 0]
+
+    return dn_pos, levels
+
+
+def upstream_sum(data, dn_pos, levels, agg_value):
+    """Aggregates values by upstream area with the topological levels.
+
+    This gives the same '_up' sums and upstream_count as upstream_ag(), but
+    every level from topo_levels() is pushed to its downstream neighbors with
+    one array operation instead of a queue of segments.
+
+    Parameters:
+        data (pandas.DataFrame): 
+            Data frame of segments or fragments in the same row order used for
+            topo_levels(), with the columns to be aggregated (agg_value).
+
+        dn_pos (numpy.ndarray): 
+            Row position of the downstream neighbor from topo_levels()
+
+        levels (list): 
+            List of arrays of row positions from topo_levels()
+
+        agg_value (list):
+            List of columns in the data frame to be aggregated. 
+    
+    Returns:
+        up_agg (pandas.DataFrame): Dataframe with the '_up' sums of the columns
+            in agg_value (in their dtypes) and the upstream_count of every row
+            of data
+    """
+    values = data[list(agg_value)].values.astype(float)
+    count = np.ones(len(data))
+    for lvl in levels:
+        dtemp = dn_pos[lvl]
+        keep = dtemp >= 0
+        src, dtemp = lvl[keep], dtemp[keep]
+        np.add.at(values, dtemp, values[src])
+        np.add.at(count, dtemp, count[src])
+
+    # The sums keep the dtypes of their columns, like upstream_ag()
+    up_agg = pd.DataFrame({s + '_up': values[:, i].astype(data[s].dtype) for i, s in enumerate(agg_value)},
+                          index=data.index)
+    up_agg['upstream_count'] = count
+
+    return up_agg
+
+
+def label_fragments(segments, dn_pos, levels, exit_id=999000):
+    """Assigns segments to fragments with the topological levels.
+
+    This gives the same columns as make_fragments() without a queue of 
+    dataframe rows. Every segment takes the DamID of the nearest dam at
+    or downstream of it, found in one sweep from the outlets to the headwaters,
+    and segments without a dam downstream take the ID of their outlet, numbered
+    from exit_id in the order make_fragments() reaches the outlets. That order
+    is replayed one generation of its queue at a time: the headwaters in row
+    order, then the segments below the dams they reach, and so on, so the loop
+    is over the depth of the dams and not over the segments. Only the step
+    column is found by walking the queue once more over numpy arrays.
+
+    Parameters:
+        segments (pandas.DataFrame): 
+            Dataframe providing segment information in the same row order used for
+            topo_levels(). It must have a DamID column (0 for segments with no dams).
+
+        dn_pos (numpy.ndarray): 
+            Row position of the downstream neighbor from topo_levels()
+
+        levels (list): 
+            List of arrays of row positions from topo_levels()
+
+        exit_id (int, optional): 
+            Initial ID number to use for labeling terminal fragments.
+    
+    Returns:
+        segments (pandas.DataFrame): An updated dataframe with the Frag, 
+            Headwater, FragEnd, step and Frag_Index columns of make_fragments().
+    """
+    n = len(segments)
+    damid = segments['DamID'].values
+    has_dam = damid > 0
+    outlet = (dn_pos < 0) & ~has_dam
+
+    # Row position of the end of the fragment of every segment without a dam:
+    # the nearest dam downstream or the outlet
+    end = np.where(outlet, np.arange(n), -1)
+    for lvl in reversed(levels):
+        dtemp = dn_pos[lvl]
+        pull = (dtemp >= 0) & ~has_dam[lvl]
+        src, dtemp = lvl[pull], dtemp[pull]
+        end[src] = np.where(has_dam[dtemp], dtemp, end[dtemp])
+
+    # Replay the queue of make_fragments() one generation at a time. The first
+    # item of a fragment walks to its end, a dam reached that way or taken from
+    # the queue sends the segment below it to the next generation
+    headwater = np.zeros(n, dtype=bool)
+    if levels:
+        headwater[levels[0]] = True
+    reached = np.full(n, -1, dtype=np.int64)
+    released = np.zeros(n, dtype=bool)
+    queue = np.flatnonzero(headwater)
+    queues = []
+    order = 0
+    while len(queue) > 0:
+        queues.append(queue)
+        # Fragments reached for the first time, in queue order
+        walk = queue[~has_dam[queue]]
+        ends, first = np.unique(end[walk], return_index=True)
+        new = reached[ends] < 0
+        ends, first = ends[new], first[new]
+        by_first = np.argsort(first, kind='stable')
+        ends, first = ends[by_first], first[by_first]
+        reached[ends] = order + np.arange(len(ends))
+        order += len(ends)
+
+        # Dams released by a walk or taken from the queue, in queue order
+        at = np.r_[np.flatnonzero(~has_dam[queue])[first], np.flatnonzero(has_dam[queue])]
+        dams = np.r_[ends, queue[has_dam[queue]]]
+        dams, at = dams[has_dam[dams]], at[has_dam[dams]]
+        dams = dams[np.argsort(at, kind='stable')]
+        dams = dams[~released[dams]]
+        dams = dams[np.sort(np.unique(dams, return_index=True)[1])]
+        released[dams] = True
+        queue = dn_pos[dams]
+        queue = queue[queue >= 0]
+
+    # Number the outlets in the order they were reached
+    exits = np.flatnonzero(outlet)
+    exits = exits[np.argsort(reached[exits], kind='stable')]
+    frag_id = np.where(has_dam, damid, 0).astype(np.float64)
+    frag_id[exits] = exit_id + 1 + np.arange(len(exits))
+
+    # Dams start their own fragment, other segments take the ID of their end
+    frag = np.where(has_dam, damid, frag_id[np.maximum(end, 0)])
+
+    # Steps down the fragment from the start of the walk that last reached
+    # every segment, walking the queue in order once more. Every segment is
+    # walked through once, so this loop is over the segments but does no
+    # dataframe lookups
+    step = segments['step'].values.astype(float) if 'step' in segments else np.full(n, np.nan)
+    labeled = has_dam.copy()
+    for start in np.concatenate(queues + [np.zeros(0, dtype=np.int64)]).tolist():
+        if labeled[start]:
+            continue
+        labeled[start] = True
+        temploc, k = start, 0
+        while dn_pos[temploc] >= 0:
+            temploc, k = dn_pos[temploc], k + 1
+            step[temploc] = k
+            if labeled[temploc]:
+                break
+            labeled[temploc] = True
+
+    segments['Frag'] = frag.astype(damid.dtype)
+    segments['Headwater'] = headwater.astype(float)
+    segments['FragEnd'] = np.where(has_dam, 2.0, np.where(outlet, 1.0, 0.0))
+    segments['step'] = step
+    segments['Frag_Index'] = segments.Frag.rank(method='dense')
+
+    return segments
+
+
+def dam_distance(segments, dn_pos, levels):
+    """Finds the distance to the nearest dam upstream and downstream of every segment.
+
+    Using the topological levels from topo_levels(), this function makes one
+    sweep from the outlets to the headwaters to find the nearest dam downstream and 
+    the number of dams between each segment and the outlet, and one sweep from the
+    headwaters to the outlets to find the nearest dam upstream. Dams are assumed to 
+    be at the downstream end of the segment they are located on. 
+
+    Parameters:
+        segments (pandas.DataFrame): 
+            Dataframe providing segment information in the same row order used for
+            topo_levels(). It must have the following columns
+                - DamID: Unique ID of a Dam located on the segment. Segments with 
+                    no dams should have a value of 0. 
+                - DamCount: Number of dams located on the segment
+                - LENGTHKM: Length of segment in km
+
+        dn_pos (numpy.ndarray): 
+            Row position of the downstream neighbor from topo_levels()
+
+        levels (list): 
+            List of arrays of row positions from topo_levels()
+    
+    Returns:
+        segments (pandas.DataFrame): An updated dataframe with the columns
+            - DnDamDist: Channel distance in km from the segment outlet to the 
+                nearest dam downstream (0 if the segment has a dam, NaN if none)
+            - DnDamID: DamID of the nearest dam downstream (0 if none)
+            - DnDamCount: Number of dams between the segment and the basin outlet,
+                including dams on the segment itself
+            - UpDamDist: Channel distance in km from the top of the segment to the 
+                nearest dam upstream (NaN if none)
+    """
+    has_dam = segments['DamID'].values > 0
+    length = segments['LENGTHKM'].values
+    damid = segments['DamID'].values
+    dn_dist = np.where(has_dam, 0.0, np.nan)
+    dn_dam = np.where(has_dam, damid, 0)
+    dn_count = segments['DamCount'].values.astype(float)
+
+    # Sweep from the outlets to the headwaters pulling values from the downstream neighbor
+    for lvl in reversed(levels):
+        dtemp = dn_pos[lvl]
+        keep = dtemp >= 0
+        src, dtemp = lvl[keep], dtemp[keep]
+        dn_count[src] += dn_count[dtemp]
+        pull = ~has_dam[src]
+        src, dtemp = src[pull], dtemp[pull]
+        dn_dist[src] = length[dtemp] + dn_dist[dtemp]
+        dn_dam[src] = dn_dam[dtemp]
+
+    # Sweep from the headwaters to the outlets pushing values to the downstream neighbor
+    up_dist = np.full(len(segments), np.inf)
+    for lvl in levels:
+        dtemp = dn_pos[lvl]
+        keep = dtemp >= 0
+        src, dtemp = lvl[keep], dtemp[keep]
+        np.minimum.at(up_dist, dtemp, np.where(has_dam[src], 0.0, length[src] + up_dist[src]))
+
+    segments['DnDamDist'] = dn_dist
+    segments['DnDamID'] = dn_dam
+    segments['DnDamCount'] = dn_count
+    segments['UpDamDist'] = np.where(np.isinf(up_dist), np.nan, up_dist)
+
+    return segments
+
+
+def longest_path(segments, dn_pos, levels):
+    """Finds the longest free-flowing path and mainstem length within every fragment.
+
+    This function walks the topological levels from topo_levels() from the 
+    headwaters to the outlets once, extending paths only between segments in the
+    same fragment. For every segment it records the longest path of connected 
+    segments in its fragment that ends at the segment outlet, and the length of
+    the NHD mainstem (following UpHydroseq) within the fragment. At the fragment
+    outlet these are the longest free-flowing path and the mainstem length of the
+    fragment. This requires the Frag column from make_fragments().
+
+    Parameters:
+        segments (pandas.DataFrame): 
+            Dataframe providing segment information in the same row order used for
+            topo_levels(). It must have the following columns
+                - UpHydroseq: Unique segment ID for the upstream mainstem segment
+                - LENGTHKM: Length of segment in km
+                - Frag: Fragment ID assigned to every segment
+
+        dn_pos (numpy.ndarray): 
+            Row position of the downstream neighbor from topo_levels()
+
+        levels (list): 
+            List of arrays of row positions from topo_levels()
+    
+    Returns:
+        segments (pandas.DataFrame): An updated dataframe with the columns
+            - LongPathKM: Longest path within the fragment ending at the segment
+            - MainstemKM: Mainstem length within the fragment ending at the segment
+    """
+    length = segments['LENGTHKM'].values
+    frag = segments['Frag'].values
+    up_pos = segments.index.get_indexer(segments['UpHydroseq'].values)
+    long_up = np.zeros(len(segments))
+    main_up = np.zeros(len(segments))
+    long_path = length.copy()
+    main_path = length.copy()
+
+    for lvl in levels:
+        # Every parent has been visited so the paths for this level are final
+        long_path[lvl] = length[lvl] + long_up[lvl]
+        main_path[lvl] = length[lvl] + main_up[lvl]
+
+        # Pass the paths to downstream neighbors in the same fragment
+        dtemp = dn_pos[lvl]
+        keep = dtemp >= 0
+        keep[keep] = frag[lvl[keep]] == frag[dtemp[keep]]
+        src, dtemp = lvl[keep], dtemp[keep]
+        np.maximum.at(long_up, dtemp, long_path[src])
+        mainstem = up_pos[dtemp] == src
+        main_up[dtemp[mainstem]] = main_path[src[mainstem]]
+
+    segments['LongPathKM'] = long_path
+    segments['MainstemKM'] = main_path
+
+    return segments
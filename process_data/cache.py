@@ -0,0 +1,122 @@
+import hashlib, json, os, sys, types
+
+# Folder (inside a results folder) where the stage manifests are kept
+cache_dir = '.stage_cache/'
+
+
+def fingerprint(path):
+    """Fingerprints a source file by its path, size and modification time.
+
+    File contents are not hashed so that fingerprinting the multi-GB NHD
+    flowlines takes no time. Any rewrite of a file changes its fingerprint.
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def code_version(modules):
+    """Hashes the source code of modules in the process_data folder.
+
+    Parameters:
+        modules (list):
+            Module names (e.g. ['read', 'extract']).
+
+    Returns:
+        version (string): Hash of the source of the modules.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256()
+    for name in modules:
+        with open(os.path.join(folder, name+'.py'), 'rb') as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def imported_modules(name):
+    """Lists a process_data module and every process_data module it imports,
+    directly or through other modules, for the code of a stage.
+
+    Parameters:
+        name (string):
+            Module name (e.g. 'workflow'), imported if it is not yet.
+
+    Returns:
+        modules (list): Sorted module names.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    __import__(name)
+    found, todo = set(), [name]
+    while todo:
+        module = sys.modules[todo.pop()]
+        found.add(module.__name__)
+        for value in vars(module).values():
+            path = getattr(value, '__file__', None)
+            if isinstance(value, types.ModuleType) and path and os.path.dirname(os.path.abspath(path)) == folder \
+                    and value.__name__ not in found:
+                todo.append(value.__name__)
+
+    return sorted(found)
+
+
+def stage_key(params, files=(), code=()):
+    """Makes the cache key for a stage from everything that affects its outputs.
+
+    Parameters:
+        params (dict):
+            Stage parameters (year, dam set, keys of earlier stages, ...). Values
+            must be JSON serializable.
+        files (list, optional):
+            Source files read by the stage, fingerprinted with fingerprint().
+        code (list, optional):
+            Modules whose source code the stage depends on.
+
+    Returns:
+        key (string): Hash of the parameters, file fingerprints and code version.
+    """
+    content = {'params': params,
+               'files': [fingerprint(f) for f in files],
+               'code': code_version(code)}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def is_current(results_folder, stage, key, outputs):
+    """Checks if a stage has already been run with the same key.
+
+    A stage is current if its manifest has the same key and all of its outputs
+    still exist.
+
+    Parameters:
+        results_folder (string):
+            Folder where the stage outputs and manifests are saved.
+        stage (string):
+            Unique name of the stage (e.g. 'Red_extract').
+        key (string):
+            Key from stage_key().
+        outputs (list):
+            Paths of the stage outputs.
+
+    Returns:
+        current (boolean): True if the stage can be skipped.
+    """
+    manifest = os.path.join(results_folder, cache_dir, stage+'.json')
+    if not os.path.isfile(manifest):
+        return False
+    with open(manifest) as f:
+        recorded = json.load(f)
+
+    return recorded['key'] == key and all(os.path.exists(p) for p in outputs)
+
+
+def record(results_folder, stage, key, outputs):
+    """Records that a stage finished with a key, after its outputs are written.
+
+    The manifest is written to a temporary file and moved into place so an
+    interrupted run never leaves a manifest for incomplete outputs.
+    """
+    folder = os.path.join(results_folder, cache_dir)
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(folder, stage+'.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({'key': key, 'outputs': outputs}, f)
+    os.replace(tmp, os.path.join(folder, stage+'.json'))
@@ -0,0 +1,89 @@
+import numpy as np, pandas as pd, os, time
+
+# Folder (inside a results folder) where the checkpoints are kept
+checkpoint_dir = '.checkpoints/'
+
+
+def save(path, columns, key, **extra):
+    """Saves a checkpoint of segment columns atomically.
+
+    The checkpoint is written to a temporary file, flushed to disk and moved
+    into place, so a crash leaves either the previous checkpoint or the new
+    one and never a partial file.
+
+    Parameters:
+        path (string):
+            Path of the checkpoint (.npz).
+        columns (pandas.DataFrame):
+            Numeric columns to save, indexed by Hydroseq.
+        key (string):
+            Key the checkpoint is only valid for (e.g. from cache.stage_key()).
+        extra (numpy.ndarray, optional):
+            Other arrays saved with the checkpoint (e.g. the traversal queue).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {'col_'+col: columns[col].values for col in columns.columns}
+    arrays.update({'extra_'+name: np.asarray(value) for name, value in extra.items()})
+
+    tmp = path+'.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, key=np.array(key), Hydroseq=columns.index.values, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load(path, key):
+    """Loads a checkpoint saved by save() if it was saved with the same key.
+
+    Returns:
+        columns (pandas.DataFrame): Saved columns indexed by Hydroseq, or None
+            if there is no checkpoint for the key.
+        extra (dict): Other saved arrays by name, or None.
+    """
+    if not os.path.isfile(path):
+        return None, None
+    with np.load(path) as data:
+        if str(data['key']) != key:
+            return None, None
+        columns = pd.DataFrame({k[4:]: data[k] for k in data.files if k.startswith('col_')},
+                               index=pd.Index(data['Hydroseq'], name='Hydroseq'))
+        extra = {k[6:]: data[k] for k in data.files if k.startswith('extra_')}
+
+    return columns, extra
+
+
+def remove(path):
+    """Removes a checkpoint that is no longer needed."""
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def traversal_saver(path, key, columns, interval=600):
+    """Makes a progress function for make_fragments() that saves checkpoints.
+
+    Parameters:
+        path (string):
+            Path of the partial traversal checkpoint.
+        key (string):
+            Key the checkpoint is only valid for.
+        columns (list):
+            Fragment columns saved from the segments.
+        interval (float, optional):
+            Seconds between checkpoints, so small basins are never checkpointed.
+
+    Returns:
+        progress (function): Function called by make_fragments() with the
+            segments, the IDs in the queue and the next exit ID.
+    """
+    last = [time.time()]
+
+    def progress(segments, queue_ids, exit_id):
+        if time.time() - last[0] < interval:
+            return
+        cols = [col for col in columns if col in segments.columns]
+        save(path, segments[cols], key, queue=queue_ids, exit_id=exit_id)
+        last[0] = time.time()
+        print('Saved fragment checkpoint,', len(queue_ids), 'segments in the queue')
+
+    return progress
@@ -1,20 +1,37 @@
 
 import pandas as pd, numpy as np, geopandas as gp, os
-import datetime, read, extract as ex
+import datetime, read, extract as ex, cache
 from pathlib import Path
 
-def create_basin_csvs(basin_ls, main_directory, results_folder, year):
-    """Determines if a basin csv exists and create it if needed.
+def extract_key(main_directory, basin, year, dam_set='nabd'):
+    """Makes the stage cache key for extracting a basin csv.
 
-        This function passes in a list of basins and determines if a csv with each
-        basin name exists. If the csv does not exist, it is created with read.py.
-        The read_flag ensures that read.py is only executed once.
+    The key changes if any of the input files, the year, the dam set or the
+    code in read.py and extract.py changes.
+    """
+    return cache.stage_key({'stage': 'extract', 'basin': basin, 'year': str(year), 'dam_set': dam_set},
+                           files=read.input_paths(main_directory), code=['read', 'extract'])
+
+def create_basin_csvs(basin_ls, main_directory, results_folder, year, dam_set='nabd'):
+    """Determines if a basin csv is up to date and create it if needed.
+
+        This function passes in a list of basins and checks the stage cache for
+        each basin csv. A csv is only reused if it was created from the same 
+        input files, year, dam set and code (see cache.py). Otherwise it is 
+        created with read.py and extract.py. The read_flag ensures that read.py
+        is only executed once.
 
         Parameters:
             basin_ls (List):
                 List of basins to be analyzed.
-            folder (string):
+            main_directory (string):
+                Folder containing the input data.
+            results_folder (string):
                 Folder where csvs will be saved.
+            year (string):
+                Scenario year.
+            dam_set (string, optional):
+                'nabd' for all dams or 'grand' for the large dams in GRanD.
             read_flag (boolean): 
                 If False, flowlines and dams will be read in with read.py.
                 If True, flowlines and dams will not be read in because they
@@ -28,19 +45,19 @@ def create_basin_csvs(basin_ls, main_directory, results_folder, year):
         Returns:
             Csvs for each of the basins listed in basin_ls in a specified folder.
     """   
-    ## If the specified basin csv does not exist, extract it
-    os.chdir(results_folder)
+    ## If the specified basin csv is not up to date, extract it
     read_flag = False
 
     for basin in basin_ls:
-        if os.path.isfile(basin+'.csv'):  #does it exist?
-            #Read specified basin 
-            print(basin + ': Exists')
+        key = extract_key(main_directory, basin, year, dam_set)
+        outputs = [results_folder+basin+'.csv']
+        if cache.is_current(results_folder, basin+'_extract', key, outputs):  #is it up to date?
+            print(basin + ': Up to date')
 
         else:
             if read_flag == False:
-                flowlines, dams = read.read_lines_dams(main_directory, year)
+                flowlines, dams = read.read_lines_dams(main_directory, year, dam_set)
                 read_flag = True
-            print('\n', basin +  ': Does not exist')
-            ex.join_dams_flowlines(basin, flowlines, dams)
-            
\ No newline at end of file
+            print('\n', basin +  ': Needs extracting')
+            ex.join_dams_flowlines(basin, flowlines, dams, results_folder)
+            cache.record(results_folder, basin+'_extract', key, outputs)
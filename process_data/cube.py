@@ -0,0 +1,181 @@
+import numpy as np, pandas as pd
+import regulate as reg
+
+# Dam size classes, GRanD dams first and the rest split by normal storage (MCM)
+dam_classes = ['none', 'small', 'medium', 'grand']
+medium_dam_mcm = 1.0
+
+# Fragment length histogram bin edges (km), the last bin holds everything longer
+length_bins = [0, 10, 100, 1000, 10000, np.inf]
+
+# Dimensions of a basin cube, scenario cubes add DamSet and Year
+cube_dims = ['HUC8', 'StreamOrde', 'DamClass']
+
+
+def dam_class(segments):
+    """Dam size class of every segment as an index into dam_classes.
+
+    Segments without a dam are 'none', dams in GRanD are 'grand' and the
+    other dams are 'medium' if their normal storage is at least medium_dam_mcm
+    and 'small' otherwise.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments with DamID, Grand_flag and Norm_stor (MCM).
+
+    Returns:
+        classes (numpy.ndarray): Dam size class of every segment.
+    """
+    classes = np.where(segments['Norm_stor'].fillna(0).values >= medium_dam_mcm, 2, 1)
+    classes = np.where(segments['Grand_flag'].fillna(0).values == 1, 3, classes)
+    classes = np.where(segments['DamID'].values > 0, classes, 0)
+    return classes.astype(np.int8)
+
+
+def hist_labels():
+    """Column names of the fragment length histogram bins."""
+    return ['FragHist_'+('%g' % edge) for edge in length_bins[1:]]
+
+
+def basin_cube(segments, fragments, dor_thresholds=(0.02, 0.1, 1.0)):
+    """Pre-aggregates a basin by HUC8, stream order and dam size class.
+
+    Segments are counted in the cell of their own HUC8, stream order and dam
+    class. Fragments are counted in the cell of their outlet segment, so a
+    fragment ending at a dam is in the class of that dam and a fragment ending
+    at the basin exit is in the 'none' class. Every measure is a count or a sum
+    so cells can be added together for any slice or roll up (see query()).
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments indexed by Hydroseq with HUC8, StreamOrde,
+            DamID, Grand_flag, Norm_stor (MCM), DamCount, LENGTHKM and DOR.
+        fragments (pandas.DataFrame):
+            Fragments from bifurcate.agg_by_frag() with the Hydroseq of their
+            outlet segment and LENGTHKM.
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+
+    Returns:
+        cube (pandas.DataFrame): One row per occupied cell with the columns in
+            cube_dims and
+            - Seg_n, LENGTHKM, DamCount, Norm_stor: Segment count and sums
+            - RegLen_*: Regulated length for every DOR threshold
+            - Frag_n, FragLen: Number of fragments and their summed length
+            - FragHist_*: Number of fragments by length bin (upper edge in km)
+    """
+    labels = reg.reg_labels(dor_thresholds)
+    dor = segments['DOR'].values[:, None]
+    seg = pd.DataFrame((dor >= np.asarray(dor_thresholds)[None, :]) * segments['LENGTHKM'].values[:, None],
+                       columns=labels)
+    seg['HUC8'] = segments['HUC8'].values.astype(np.int64)
+    seg['StreamOrde'] = segments['StreamOrde'].values.astype(np.int8)
+    seg['DamClass'] = dam_class(segments)
+    seg['Seg_n'] = 1
+    for col in ['LENGTHKM', 'DamCount', 'Norm_stor']:
+        seg[col] = segments[col].fillna(0).values
+    seg_cube = seg.groupby(cube_dims)[['Seg_n', 'LENGTHKM', 'DamCount', 'Norm_stor']+labels].sum()
+
+    # Fragments take the cell of their outlet segment
+    outlet = seg.set_index(segments.index).reindex(fragments['Hydroseq'].values)
+    frag = outlet[cube_dims].reset_index(drop=True)
+    frag['Frag_n'] = 1
+    frag['FragLen'] = fragments['LENGTHKM'].values
+    bins = np.digitize(frag['FragLen'].values, length_bins[1:-1], right=True)
+    for i, label in enumerate(hist_labels()):
+        frag[label] = (bins == i).astype(np.int64)
+    frag_cube = frag.groupby(cube_dims)[['Frag_n', 'FragLen']+hist_labels()].sum()
+
+    cube = seg_cube.join(frag_cube, how='outer').fillna(0).reset_index()
+    count_cols = ['Seg_n', 'DamCount', 'Frag_n']+hist_labels()
+    cube[count_cols] = cube[count_cols].astype(np.int64)
+
+    return cube
+
+
+def write_cube(cube, path):
+    """Saves a cube column by column in a compressed numpy file (.npz)."""
+    arrays = {}
+    for col in cube.columns:
+        values = cube[col].values
+        arrays[col] = values.astype(str) if values.dtype == object else values
+    np.savez_compressed(path, **arrays)
+
+
+def read_cube(path, columns=None):
+    """Reads a cube saved by write_cube(), only loading the columns asked for."""
+    with np.load(path) as data:
+        cube = pd.DataFrame({k: data[k] for k in (columns or data.files)})
+
+    return cube
+
+
+def combine_cubes(scenarios, path=None):
+    """Stacks the basin cubes of many scenarios into one cube.
+
+    Parameters:
+        scenarios (List):
+            List of (dam set, year, path of a basin cube) tuples.
+        path (string, optional):
+            Output path for the combined cube (.npz).
+
+    Returns:
+        cube (pandas.DataFrame): Basin cubes with DamSet and Year dimensions.
+            Cells of basins sharing a HUC8 are added together.
+    """
+    cubes = []
+    for dam_set, year, cube_path in scenarios:
+        cube = read_cube(cube_path)
+        cube.insert(0, 'Year', str(year))
+        cube.insert(0, 'DamSet', dam_set)
+        cubes.append(cube)
+    cube = pd.concat(cubes, ignore_index=True)
+    cube = cube.groupby(['DamSet', 'Year']+cube_dims, as_index=False, sort=False).sum()
+
+    if path is not None:
+        write_cube(cube, path)
+
+    return cube
+
+
+def query(cube, by, where=None, measures=None):
+    """Slices and rolls up a cube.
+
+    Parameters:
+        cube (pandas.DataFrame):
+            Cube from basin_cube(), combine_cubes() or read_cube().
+        by (list):
+            Dimensions to group by. HUC2, HUC4 and HUC6 are rolled up from HUC8
+            and DamClass can be given by name with 'DamClassName'.
+        where (dict, optional):
+            Values to keep by dimension, a single value or a list of values.
+            Dam classes can be given by name (e.g. {'DamClass': ['small', 'medium']}).
+            All rows are kept if None.
+        measures (list, optional):
+            Measures to sum, all of them if None.
+
+    Returns:
+        summary (pandas.DataFrame): Summed measures indexed by the by dimensions.
+    """
+    measures = measures or [c for c in cube.columns if c not in ['DamSet', 'Year']+cube_dims]
+    keep = np.ones(len(cube), dtype=bool)
+    for dim, values in (where or {}).items():
+        values = values if isinstance(values, (list, tuple)) else [values]
+        if dim == 'DamClass':
+            values = [dam_classes.index(v) if isinstance(v, str) else v for v in values]
+        keep &= _dimension(cube, dim).isin(values).values
+
+    keys = [_dimension(cube, dim)[keep] for dim in by]
+    summary = cube.loc[keep, measures].groupby(keys).sum()
+    summary.index.names = by
+
+    return summary
+
+
+def _dimension(cube, dim):
+    # Values of a stored or rolled up dimension
+    if dim in ['HUC2', 'HUC4', 'HUC6']:
+        return (cube['HUC8'] // 10**(8-int(dim[3:]))).rename(dim)
+    if dim == 'DamClassName':
+        return pd.Series(np.asarray(dam_classes)[cube['DamClass'].values], index=cube.index, name=dim)
+    return cube[dim]
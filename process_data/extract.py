@@ -2,8 +2,36 @@
 import numpy as np, pandas as pd
 from time import time
 
+# HUC 2 values of the major U.S. river basins
+major_basins = {'California' : [18],
+                'Colorado' : [14, 15],
+                'Columbia' : [17],
+                'Great_Basin' : [16], 
+                'Great_Lakes' : [4],
+                'Gulf_Coast' : [12],
+                'Mississippi' : [5, 6, 7, 8, 10, 11],
+                'North_Atlantic' : [1, 2],
+                'Red' : [9],
+                'Rio_Grande' : [13],
+                'South_Atlantic' : [3]}
 
-def join_dams_flowlines(basin, flowlines, nabd):
+
+def basin_flowlines(basin, flowlines):
+    """Selects the flowlines of a major river basin by their HUC 2.
+
+    Parameters:
+        basin (string):
+            Name of the basin (a key of major_basins).
+        flowlines (pandas.DataFrame):
+            Dataframe containing NHD flowline attributes with a HUC2 column.
+
+    Returns:
+        basin_lines (pandas.DataFrame): Flowlines within the basin.
+    """
+    return flowlines.loc[flowlines['HUC2'].isin(major_basins[basin])]
+
+
+def join_dams_flowlines(basin, flowlines, nabd, results_folder=''):
     """Creates a new filtered dataset from the dams and flowlines.
 
     This function obtains and filters NHDPlus V2 and NABD for analysis in 
@@ -179,75 +207,19 @@ def join_dams_flowlines(basin, flowlines, nabd):
                 - DamID: Unique integer ID for each dam to use for fragments
                 - Dam_Count: Indicates the number of dams along a segment 
         
+        results_folder (string, optional):
+            Folder where the basin csv is written. Defaults to the working directory,
+            the csv is not written if None.
+
     Returns:
         segments_df (geopandas.geodataframe.GeoDataFrame): A dataframe with filtered dam and 
         flowline attributes.
         'basin'+.csv (csv): csv file to be read into the main script
     
     """
-    major_basins = {'California' : [18],
-                    'Colorado' : [14, 15],
-                    'Columbia' : [17],
-                    'Great_Basin' : [16], 
-                    'Great_Lakes' : [4],
-                    'Gulf_Coast' : [12],
-                    'Mississippi' : [5, 6, 7, 8, 10, 11],
-                    'North_Atlantic' : [1, 2],
-                    'Red' : [9],
-                    'Rio_Grande' : [13],
-                    'South_Atlantic' : [3]}
-    
     t1 = time()
-    if basin == 'California':
-        california = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])] 
-        nabd_nhd_join = nabd.merge(california, how= 'right', on='COMID') 
-    
-    if basin == 'Colorado':
-        colorado = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])| 
-        (flowlines['HUC2'] == major_basins[basin][1])]
-        nabd_nhd_join = nabd.merge(colorado, how= 'right', on='COMID') 
-    
-    if basin == 'Columbia':
-        columbia = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(columbia, how= 'right', on='COMID')
-    
-    if basin == 'Great_Basin':
-        great_basin = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(great_basin, how= 'right', on='COMID')
-    
-    if basin == 'Great_Lakes':
-        great_lakes = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(great_lakes, how= 'right', on='COMID')
-    
-    if basin == 'Gulf_Coast':
-        gulf_coast = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(gulf_coast, how= 'right', on='COMID') 
-        
-    if basin == 'Mississippi':
-        mississippi = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])|
-        (flowlines['HUC2'] == major_basins[basin][1]) |
-        (flowlines['HUC2'] == major_basins[basin][2]) |
-        (flowlines['HUC2'] == major_basins[basin][3]) | 
-        (flowlines['HUC2'] == major_basins[basin][4]) |
-        (flowlines['HUC2'] == major_basins[basin][5])]
-        nabd_nhd_join = nabd.merge(mississippi, how= 'right', on='COMID')
-        
-    if basin == 'North_Atlantic':
-        north_atlantic = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])|
-        (flowlines['HUC2'] == major_basins[basin][1])]
-        nabd_nhd_join = nabd.merge(north_atlantic, how= 'right', on='COMID')
-    
-    if basin == 'Red':
-        red = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(red, how= 'right', on='COMID')
-    
-    if basin == 'Rio_Grande':
-        rio_grande = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(rio_grande, how= 'right', on='COMID')
-    
-    if basin == 'South_Atlantic':
-        south_atlantic = flowlines.loc[(flowlines['HUC2'] == major_basins[basin][0])]
-        nabd_nhd_join = nabd.merge(south_atlantic, how= 'right', on='COMID') 
+    basin_lines = basin_flowlines(basin, flowlines)
+    nabd_nhd_join = nabd.merge(basin_lines, how= 'right', on='COMID') 
     
     t2 = time()
     
@@ -269,8 +241,9 @@ def join_dams_flowlines(basin, flowlines, nabd):
     t3 = time()
   
     segments_df = nabd_nhd_df.copy()
-    segments_df.to_csv(basin+'.csv')  
-    print('Finished writing segments_df to csv..........')
+    if results_folder is not None:
+        segments_df.to_csv(results_folder+basin+'.csv')  
+        print('Finished writing segments_df to csv..........')
     
     t4 = time() 
     print("---- "+basin+" TIMING SUMMARY -----")
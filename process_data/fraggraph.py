@@ -0,0 +1,131 @@
+import numpy as np, os, json
+
+
+def write_frag_graph(fragments, folder, dstr_col='Frag_dstr'):
+    """Writes the fragment network to a compact binary graph.
+
+    This function takes the fragments dataframe from bifurcate.agg_by_frag() and
+    writes the fragment network as a folder of numpy arrays that can be memory
+    mapped. Fragments are given dense IDs (0 to n-1) in order of their Frag ID.
+    The upstream neighbors of every fragment are stored in CSR format, so the
+    direct upstream neighbors of fragment i are
+    up_indices[up_indptr[i]:up_indptr[i+1]].
+
+    Parameters:
+        fragments (pandas.DataFrame):
+            Fragments dataframe created by the agg_by_frag function. The index
+            must be the fragment ID.
+        folder (string):
+            Folder where the graph arrays are saved. It is created if needed.
+        dstr_col (string, optional):
+            Column that contains the downstream fragment IDs.
+
+    Returns:
+        Arrays written to folder
+            - frag_id.npy: Original fragment ID of every dense ID
+            - dnstr.npy: Dense ID of the downstream fragment (-1 at exits)
+            - up_indptr.npy, up_indices.npy: CSR upstream adjacency
+            - attr_<column>.npy: One array for every numeric fragment column
+            - graph.json: Number of fragments and list of attributes
+    """
+    os.makedirs(folder, exist_ok=True)
+    fragments = fragments.sort_index()
+    frag_id = fragments.index.values.astype(np.int64)
+
+    # Dense IDs of the downstream fragments, -1 for exits
+    dnstr = np.full(len(frag_id), -1, dtype=np.int64)
+    has_dn = fragments[dstr_col].notna().values
+    dnstr[has_dn] = frag_index({'frag_id': frag_id}, fragments[dstr_col].values[has_dn])
+    has_dn = dnstr >= 0
+
+    # Group the fragments by their downstream neighbor for the upstream adjacency
+    up_indices = np.argsort(np.where(has_dn, dnstr, len(frag_id)), kind='stable')
+    up_indices = up_indices[:has_dn.sum()]
+    up_indptr = np.zeros(len(frag_id)+1, dtype=np.int64)
+    np.cumsum(np.bincount(dnstr[has_dn], minlength=len(frag_id)), out=up_indptr[1:])
+
+    np.save(os.path.join(folder, 'frag_id.npy'), frag_id)
+    np.save(os.path.join(folder, 'dnstr.npy'), dnstr)
+    np.save(os.path.join(folder, 'up_indptr.npy'), up_indptr)
+    np.save(os.path.join(folder, 'up_indices.npy'), up_indices.astype(np.int64))
+
+    attrs = []
+    for col in fragments.columns:
+        if col != dstr_col and fragments[col].dtype.kind in 'biuf':
+            np.save(os.path.join(folder, 'attr_'+col+'.npy'), fragments[col].values)
+            attrs.append(col)
+
+    with open(os.path.join(folder, 'graph.json'), 'w') as f:
+        json.dump({'n_frags': len(frag_id), 'attrs': attrs}, f)
+
+
+def load_frag_graph(folder, mmap=True):
+    """Loads a fragment graph written by write_frag_graph().
+
+    Parameters:
+        folder (string):
+            Folder where the graph arrays are saved.
+        mmap (boolean, optional):
+            If True the arrays are memory mapped instead of read into memory.
+
+    Returns:
+        graph (dict): Dictionary with the frag_id, dnstr, up_indptr and up_indices
+            arrays and an 'attrs' dictionary of attribute arrays.
+    """
+    mode = 'r' if mmap else None
+    with open(os.path.join(folder, 'graph.json')) as f:
+        meta = json.load(f)
+
+    graph = {}
+    for name in ['frag_id', 'dnstr', 'up_indptr', 'up_indices']:
+        graph[name] = np.load(os.path.join(folder, name+'.npy'), mmap_mode=mode)
+    graph['attrs'] = {col: np.load(os.path.join(folder, 'attr_'+col+'.npy'), mmap_mode=mode)
+                      for col in meta['attrs']}
+
+    return graph
+
+
+def frag_index(graph, frag_ids):
+    """Converts original fragment IDs to dense IDs (-1 if not in the graph)."""
+    frag_ids = np.atleast_1d(frag_ids).astype(np.int64)
+    if len(graph['frag_id']) == 0:
+        return np.full(len(frag_ids), -1, dtype=np.int64)
+    pos = np.searchsorted(graph['frag_id'], frag_ids)
+    pos = np.clip(pos, 0, len(graph['frag_id'])-1)
+    return np.where(graph['frag_id'][pos] == frag_ids, pos, -1)
+
+
+def direct_upstream(graph, node):
+    """Returns the dense IDs of the fragments directly upstream of a fragment."""
+    return np.asarray(graph['up_indices'][graph['up_indptr'][node]:graph['up_indptr'][node+1]])
+
+
+def upstream(graph, node):
+    """Returns the dense IDs of every fragment upstream of a fragment.
+
+    The upstream network is visited one generation at a time using the CSR
+    adjacency. The starting fragment is not included.
+    """
+    indptr, indices = graph['up_indptr'], graph['up_indices']
+    found = []
+    frontier = np.array([node])
+    while len(frontier) > 0:
+        frontier = np.concatenate([indices[indptr[i]:indptr[i+1]] for i in frontier])
+        found.append(frontier)
+
+    return np.concatenate(found).astype(np.int64)
+
+
+def downstream(graph, node):
+    """Returns the dense IDs of the fragments from a fragment to its exit, in order.
+
+    The starting fragment is not included.
+    """
+    dnstr = graph['dnstr']
+    path = []
+    node = dnstr[node]
+    while node >= 0:
+        path.append(node)
+        node = dnstr[node]
+
+    return np.array(path, dtype=np.int64)
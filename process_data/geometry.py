@@ -0,0 +1,181 @@
+import numpy as np, pandas as pd, geopandas as gp, shapely, json, os
+from concurrent.futures import ProcessPoolExecutor
+
+# Output formats of the segment geometry and the file extension of each
+geometry_exts = {'gpkg': '.gpkg', 'parquet': '.parquet', 'shp': '.shp'}
+
+
+def _wkb_chunk(strings):
+    # Decodes WKT in a worker and returns WKB, which is much faster to send
+    # back and decode than pickled geometries
+    return shapely.to_wkb(shapely.from_wkt(strings))
+
+
+def decode_wkt(strings, n_workers=1, chunk_size=250000):
+    """Decodes WKT line strings into shapely geometries.
+
+    The strings are decoded in C by shapely.from_wkt(). With more than one
+    worker the strings are split into chunks that are decoded by a process
+    pool, which pays off for the largest basins on many cores. Callers that
+    run in worker processes of a pool (e.g. the basin jobs of
+    scheduler.run_jobs()) pass n_workers=1.
+
+    Parameters:
+        strings (array like):
+            WKT strings (e.g. the Coordinates column of the segments).
+        n_workers (int, optional):
+            Number of worker processes, 1 decodes in this process.
+        chunk_size (int, optional):
+            Number of strings decoded by a worker at a time.
+
+    Returns:
+        geometries (numpy.ndarray): Array of shapely geometries.
+    """
+    strings = np.asarray(strings, dtype=object).astype(str).astype(object)
+    if n_workers <= 1 or len(strings) <= chunk_size:
+        return shapely.from_wkt(strings)
+
+    chunks = [strings[i:i+chunk_size] for i in range(0, len(strings), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        decoded = np.concatenate(list(pool.map(_wkb_chunk, chunks)))
+
+    return shapely.from_wkb(decoded)
+
+
+def segment_geometry(segments, n_workers=1):
+    """Makes a geodataframe of segments from their WKT Coordinates column."""
+    geometries = decode_wkt(segments['Coordinates'].values, n_workers)
+    segmentsGeo = segments.drop(columns=['Coordinates'])
+
+    return gp.GeoDataFrame(segmentsGeo, geometry=gp.GeoSeries(geometries, index=segments.index))
+
+
+def write_geometry(segmentsGeo, path_prefix, formats=('gpkg',)):
+    """Writes a geodataframe in one or more formats.
+
+    GeoPackage and GeoParquet keep the full column names and have no file size
+    limit. GeoParquet needs pyarrow. Shapefiles truncate column names to 10
+    characters and are limited to 2 GB, they are only written if asked for.
+
+    Parameters:
+        segmentsGeo (geopandas.GeoDataFrame):
+            Geodataframe to write.
+        path_prefix (string):
+            Output path without the file extension.
+        formats (list, optional):
+            Formats to write, keys of geometry_exts.
+    """
+    for fmt in formats:
+        path = path_prefix+geometry_exts[fmt]
+        if fmt == 'parquet':
+            segmentsGeo.to_parquet(path)
+        elif fmt == 'gpkg':
+            segmentsGeo.to_file(path, driver='GPKG')
+        else:
+            segmentsGeo.to_file(path)
+
+
+def _dissolve_chunk(strings, frag):
+    # Line merges the segments of a chunk of fragments (sorted by fragment)
+    # and returns one multi line string per fragment as WKB
+    lines = shapely.from_wkt(strings)
+    first = np.flatnonzero(np.r_[True, frag[1:] != frag[:-1]])
+    group = np.repeat(np.arange(len(first)), np.diff(np.append(first, len(frag))))
+    parts, part_of = shapely.get_parts(lines, return_index=True)
+    merged = shapely.line_merge(shapely.multilinestrings(parts, indices=group[part_of]))
+    parts, part_of = shapely.get_parts(merged, return_index=True)
+    return shapely.to_wkb(shapely.multilinestrings(parts, indices=part_of))
+
+
+def _chunks(frag, chunk_size):
+    # Splits segments sorted by fragment into chunks of about chunk_size
+    # segments without splitting a fragment
+    first = np.flatnonzero(np.r_[True, frag[1:] != frag[:-1]])
+    cuts = np.searchsorted(first, np.arange(chunk_size, len(frag), chunk_size))
+    return np.split(np.arange(len(frag)), np.unique(first[cuts[cuts < len(first)]]))
+
+
+def write_fragment_geometry(segments, fragments, path_prefix, formats=('gpkg',), n_workers=1, chunk_size=100000):
+    """Dissolves the segment lines of every fragment and writes them chunk by chunk.
+
+    The segments are sorted by fragment and split into chunks of whole
+    fragments. Each chunk is decoded from WKT, grouped by fragment and line
+    merged (see shapely.line_merge()), so a fragment is one multi line string
+    of its longest unbroken lines. The fragment attributes are attached and
+    the chunk is appended to the output before the next one is read, so only
+    a few chunks of geometry are in memory at a time. With more than one
+    worker the chunks are dissolved by a process pool (callers in worker
+    processes of a pool pass n_workers=1).
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Segments with their Frag ID and WKT Coordinates.
+        fragments (pandas.DataFrame):
+            Fragments from bifurcate.agg_by_frag() indexed by Frag ID.
+        path_prefix (string):
+            Output path without the file extension.
+        formats (list, optional):
+            Formats to write, keys of geometry_exts. GeoPackages and shapefiles
+            are appended to and GeoParquet gets one row group per chunk.
+        n_workers (int, optional):
+            Number of worker processes, 1 dissolves in this process.
+        chunk_size (int, optional):
+            Number of segments dissolved at a time.
+    """
+    frag = segments['Frag'].values.astype(np.int64)
+    order = np.argsort(frag, kind='stable')
+    frag = frag[order]
+    strings = segments['Coordinates'].values[order].astype(str).astype(object)
+    chunks = _chunks(frag, chunk_size)
+    attrs = fragments.sort_index()
+    attrs = attrs[[col for col in attrs.columns if attrs[col].dtype.kind in 'biuf']]
+
+    paths = {fmt: path_prefix+geometry_exts[fmt] for fmt in formats}
+    for path in paths.values():
+        if os.path.exists(path):
+            os.remove(path)
+    writers = {}
+
+    def append(rows, wkb):
+        ids = np.unique(frag[rows])
+        chunk = gp.GeoDataFrame(attrs.reindex(ids).reset_index(), geometry=shapely.from_wkb(wkb))
+        for fmt, path in paths.items():
+            if fmt == 'parquet':
+                _write_row_group(writers, path, chunk)
+            else:
+                chunk.to_file(path, driver='GPKG' if fmt == 'gpkg' else None, append=os.path.exists(path))
+
+    try:
+        if n_workers <= 1 or len(chunks) == 1:
+            for rows in chunks:
+                append(rows, _dissolve_chunk(strings[rows], frag[rows]))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                # Keep a few chunks in flight so finished chunks do not pile up
+                pending = []
+                for rows in chunks:
+                    pending.append((rows, pool.submit(_dissolve_chunk, strings[rows], frag[rows])))
+                    if len(pending) >= 2*n_workers:
+                        rows, future = pending.pop(0)
+                        append(rows, future.result())
+                for rows, future in pending:
+                    append(rows, future.result())
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def _write_row_group(writers, path, chunk):
+    # Writes a chunk as a row group of a GeoParquet file, opening the writer
+    # with the schema of the first chunk. The geometry is stored as WKB and
+    # its types are left open as the chunks hold lines and multi lines.
+    import pyarrow as pa, pyarrow.parquet as pq
+    table = pa.Table.from_pandas(pd.DataFrame(chunk.to_wkb()), preserve_index=False)
+    if path not in writers:
+        crs = chunk.crs.to_json_dict() if chunk.crs is not None else None
+        geo = {'version': '1.0.0', 'primary_column': 'geometry',
+               'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': [], 'crs': crs}}}
+        schema = table.schema.with_metadata({b'geo': json.dumps(geo).encode()})
+        writers[path] = pq.ParquetWriter(path, schema)
+    writer = writers[path]
+    writer.write_table(table.cast(writer.schema))
@@ -0,0 +1,131 @@
+import numpy as np, pandas as pd, os
+
+
+def write_seg_frags(segments, path):
+    """Saves the segment to fragment assignments for a scenario.
+
+    Only the columns needed to build fragment lineage are kept, so the file is
+    a small fraction of the size of the segment shapefile.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments from make_fragments() indexed by Hydroseq with
+            the columns LENGTHKM, DamID and Frag.
+        path (string):
+            Output path for the compressed numpy file (.npz).
+    """
+    np.savez_compressed(path,
+                        Hydroseq=segments.index.values.astype(np.int64),
+                        LENGTHKM=segments['LENGTHKM'].values.astype(np.float64),
+                        DamID=segments['DamID'].values.astype(np.int64),
+                        Frag=segments['Frag'].values.astype(np.int64))
+
+
+def read_seg_frags(path):
+    """Reads segment to fragment assignments saved by write_seg_frags().
+
+    Returns:
+        seg_frags (pandas.DataFrame): Dataframe indexed by Hydroseq with the
+            columns LENGTHKM, DamID and Frag.
+    """
+    with np.load(path) as data:
+        seg_frags = pd.DataFrame({k: data[k] for k in ['LENGTHKM', 'DamID', 'Frag']},
+                                 index=pd.Index(data['Hydroseq'], name='Hydroseq'))
+
+    return seg_frags
+
+
+def frag_lineage(seg_early, seg_late):
+    """Maps the fragments of an earlier scenario to the fragments they split into.
+
+    The segment to fragment assignments of two scenarios are joined on Hydroseq
+    and the shared river length is summed for every pair of earlier and later
+    fragments. A later fragment whose outlet segment had no dam in the earlier
+    scenario was split off by its dam, which is recorded in Split_dam. Only one
+    dam is kept per segment (see extract.join_dams_flowlines()), so a new dam
+    on a segment that already had one changes the fragment ID without cutting
+    the river and is not a split. Fragment IDs of dam fragments are the DamIDs
+    of the dams at their outlet segments, which are the same in every
+    scenario, while exit fragment IDs are only unique within a scenario.
+
+    Parameters:
+        seg_early (pandas.DataFrame):
+            Segment to fragment assignments for the earlier scenario from
+            read_seg_frags().
+        seg_late (pandas.DataFrame):
+            Segment to fragment assignments for the later scenario.
+
+    Returns:
+        lineage (pandas.DataFrame): One row for every pair of fragments that share
+            river length with the columns
+            - Frag_early: Fragment ID in the earlier scenario
+            - Frag_late: Fragment ID in the later scenario
+            - LENGTHKM: River length shared by the two fragments
+            - Len_share: Fraction of the earlier fragment in the later fragment
+            - Split_dam: DamID of the dam that ends the later fragment if its
+                outlet segment had no dam in the earlier scenario (0 otherwise)
+    """
+    joined = seg_early[['Frag', 'LENGTHKM']].join(seg_late[['Frag']], how='inner',
+                                                   lsuffix='_early', rsuffix='_late')
+    lineage = joined.groupby(['Frag_early', 'Frag_late'], as_index=False)['LENGTHKM'].sum()
+
+    early_len = lineage.groupby('Frag_early')['LENGTHKM'].transform('sum')
+    lineage['Len_share'] = lineage['LENGTHKM'] / early_len
+
+    # Later dam fragments whose outlet segment had no dam in the earlier scenario
+    dams = seg_late.loc[seg_late['DamID'] > 0, 'DamID']
+    early_dam = seg_early['DamID'].reindex(dams.index).fillna(0).values > 0
+    new_dams = dams.values[~early_dam]
+    lineage['Split_dam'] = np.where(lineage['Frag_late'].isin(new_dams), lineage['Frag_late'], 0)
+
+    return lineage
+
+
+def write_lineage(lineage, path):
+    """Saves a lineage table from frag_lineage() as a compressed numpy file."""
+    np.savez_compressed(path, **{col: lineage[col].values for col in lineage.columns})
+
+
+def read_lineage(path):
+    """Reads a lineage table saved by write_lineage()."""
+    with np.load(path) as data:
+        lineage = pd.DataFrame({k: data[k] for k in data.files})
+
+    return lineage
+
+
+def year_lineage(basin_ls, scenarios, changed=None):
+    """Builds the fragment lineage between consecutive scenario years.
+
+    For every basin the segment to fragment assignments of each pair of 
+    consecutive scenarios are read and the lineage table is written to the
+    folder of the later scenario as <basin>_lineage_<early>_<late>.npz.
+    Pairs whose lineage exists and whose scenarios did not change are
+    skipped, and so are pairs missing a segment to fragment file (e.g. of a
+    basin that failed).
+
+    Parameters:
+        basin_ls (List):
+            List of basins to be analyzed.
+        scenarios (List):
+            List of (year, results_folder) tuples in chronological order.
+        changed (set, optional):
+            (basin, year) of the scenarios that were run, every pair is
+            rebuilt if None.
+    """
+    for basin in basin_ls:
+        for (year0, folder0), (year1, folder1) in zip(scenarios[:-1], scenarios[1:]):
+            path = folder1+basin+'_lineage_'+year0+'_'+year1+'.npz'
+            if changed is not None and os.path.isfile(path) and \
+                    (basin, year0) not in changed and (basin, year1) not in changed:
+                continue
+            inputs = [folder0+basin+'_segfrags_'+year0+'.npz', folder1+basin+'_segfrags_'+year1+'.npz']
+            missing = [f for f in inputs if not os.path.isfile(f)]
+            if missing:
+                print(basin, year0, '->', year1, ': skipped, missing', ', '.join(missing))
+                continue
+            seg_early = read_seg_frags(inputs[0])
+            seg_late = read_seg_frags(inputs[1])
+            lineage = frag_lineage(seg_early, seg_late)
+            write_lineage(lineage, path)
+            print(basin, year0, '->', year1, ':', int((lineage.Split_dam > 0).sum()), 'split fragments')
@@ -0,0 +1,144 @@
+import os, sys, subprocess, time, datetime
+import pandas as pd, cache
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_script(script, *args):
+    """Runs a python script in a new interpreter, used for the figure stages.
+
+    The script is run from the current folder with args as its command line
+    arguments, so its relative input paths resolve the same way as when it is
+    run by hand.
+    """
+    subprocess.run([sys.executable, script, *[str(arg) for arg in args]], check=True)
+
+
+def stage_links(stages):
+    """Finds the stages each stage depends on.
+
+    A stage depends on the stages listed in its 'deps' and on every stage that
+    lists one of its inputs as an output.
+
+    Returns:
+        links (dict): Set of upstream stage names by stage name.
+    """
+    producer = {}
+    for stage in stages:
+        for path in stage.get('outputs', []):
+            producer[os.path.normpath(path)] = stage['name']
+
+    links = {}
+    for stage in stages:
+        up = set(stage.get('deps', []))
+        for path in stage.get('inputs', []):
+            if os.path.normpath(path) in producer:
+                up.add(producer[os.path.normpath(path)])
+        links[stage['name']] = up
+
+    return links
+
+
+def _stage_key(stage, up_keys):
+    # Key from the stage parameters, the keys of the upstream stages, the input
+    # file fingerprints and the code version
+    inputs = [p for p in stage.get('inputs', []) if os.path.exists(p)]
+    params = {'stage': stage['name'], 'args': repr(stage.get('args', ())), 'upstream': up_keys}
+    return cache.stage_key(params, files=inputs, code=stage.get('code', []))
+
+
+def run_pipeline(stages, state_folder, max_workers=None, force=()):
+    """Runs a pipeline of stages, independent branches at the same time.
+
+    Every stage declares its inputs and outputs and is run once all of the
+    stages it depends on (see stage_links()) have finished. A stage is skipped
+    if its key (see cache.stage_key()) is unchanged since it last ran and all
+    of its outputs exist. The key includes the keys of the upstream stages, so
+    a change only rebuilds the stages downstream of it. If a stage fails every
+    stage downstream of it is left out and the rest of the pipeline finishes.
+
+    Parameters:
+        stages (List):
+            List of dictionaries, one per stage, with the keys
+                - name: Unique name of the stage
+                - func: Function run for the stage, defined at the top level of
+                    a module so it can be run by a worker process
+                - args: Tuple of arguments passed to func (optional)
+                - inputs: Paths of the files the stage reads (optional)
+                - outputs: Paths of the files the stage writes (optional)
+                - deps: Names of stages that must run first (optional)
+                - code: process_data modules the stage depends on (optional)
+        state_folder (string):
+            Folder where the stage manifests are kept.
+        max_workers (int, optional):
+            Number of stages run at the same time, defaults to the number of cores.
+        force (List, optional):
+            Names of stages to run even if they are up to date.
+
+    Returns:
+        status (pandas.DataFrame): Status ('ran', 'skipped', 'failed' or 'blocked')
+            and run time (s) of every stage.
+    """
+    by_name = {stage['name']: stage for stage in stages}
+    links = stage_links(stages)
+    unknown = set().union(*links.values()) - set(by_name)
+    if unknown:
+        raise ValueError('Unknown stages in deps: '+', '.join(sorted(unknown)))
+
+    status, keys, started, run_time = {}, {}, {}, {}
+    running = {}
+    t_start = time.time()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while len(status) < len(stages):
+            # Skip, start or leave out stages until nothing else can be done
+            # without waiting for a running stage
+            changed = True
+            while changed:
+                changed = False
+                for name, stage in by_name.items():
+                    if name in status or name in running.values():
+                        continue
+                    if not all(up in status for up in links[name]):
+                        continue
+                    changed = True
+                    if any(status[up] in ['failed', 'blocked'] for up in links[name]):
+                        # Leave out stages downstream of a failure
+                        status[name] = 'blocked'
+                        continue
+                    keys[name] = _stage_key(stage, sorted(keys[up] for up in links[name]))
+                    if name not in force and cache.is_current(state_folder, name, keys[name],
+                                                              stage.get('outputs', [])):
+                        status[name] = 'skipped'
+                        continue
+                    future = pool.submit(stage['func'], *stage.get('args', ()))
+                    running[future] = name
+                    started[name] = time.time()
+
+            if not running:
+                if len(status) < len(stages):
+                    missing = [n for n in by_name if n not in status]
+                    raise ValueError('Stages with circular dependencies: '+', '.join(missing))
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = by_name[name]
+                run_time[name] = time.time() - started[name]
+                try:
+                    future.result()
+                except Exception as err:
+                    print('Stage', name, 'failed:', repr(err))
+                    status[name] = 'failed'
+                    continue
+                cache.record(state_folder, name, keys[name], stage.get('outputs', []))
+                status[name] = 'ran'
+                print('Finished', name, 'in', round(run_time[name], 1), 's')
+
+    status = pd.DataFrame({'status': pd.Series(status), 'run_time': pd.Series(run_time, dtype=float)})
+    status['run_time'] = status['run_time'].fillna(0)
+    status.index.name = 'stage'
+    print('Pipeline finished in', datetime.timedelta(seconds=round(time.time()-t_start)))
+    print(status['status'].value_counts().to_string())
+
+    return status
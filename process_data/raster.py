@@ -0,0 +1,214 @@
+import numpy as np, shapely, pyproj, datetime
+from concurrent.futures import ProcessPoolExecutor
+import spatial
+
+# Grid of the rasters: CRS, (x, y) of the upper left corner, cell size and
+# (rows, columns). The default is a 1 km CONUS grid in the Albers equal area
+# projection, so every cell has the same area
+conus_grid = {'crs': 'EPSG:5070', 'origin': (-2400000.0, 3200000.0), 'cell_size': 1000.0,
+              'shape': (2950, 4700)}
+
+# CRS of the segment geometry (NHDPlus V2)
+source_crs = 'EPSG:4269'
+
+# Samples taken along the lines for every cell length, the error of the cell
+# lengths is about 1 / (2 * samples_per_cell) of a cell length at every cell edge
+samples_per_cell = 16
+
+# Segments decoded and sampled at a time
+chunk_size = 200000
+
+
+def sample_lines(geometries, spacing):
+    """Takes evenly spaced samples along lines.
+
+    Every part of a line gets ceil(length / spacing) samples at the middle of
+    equal steps along it, found by a binary search of the cumulative distance
+    along all of the vertices, so there is no loop over the lines.
+
+    Parameters:
+        geometries (numpy.ndarray):
+            Lines or multi lines in the (projected) coordinates of the grid.
+        spacing (float):
+            Largest distance between the samples.
+
+    Returns:
+        x, y (numpy.ndarray): Coordinates of the samples.
+        line (numpy.ndarray): Position in geometries of every sample.
+        share (numpy.ndarray): Share of the length of its line every sample
+            stands for (the shares of a line add up to 1).
+    """
+    parts, part_of = shapely.get_parts(geometries, return_index=True)
+    coords, vertex_of = shapely.get_coordinates(parts, return_index=True)
+    n_parts = len(parts)
+
+    # Cumulative distance along the vertices, steps between parts are zero
+    step = np.hypot(np.diff(coords[:, 0]), np.diff(coords[:, 1]))
+    step[vertex_of[1:] != vertex_of[:-1]] = 0
+    distance = np.r_[0, np.cumsum(step)]
+    first = np.searchsorted(vertex_of, np.arange(n_parts))
+    last = np.searchsorted(vertex_of, np.arange(n_parts), side='right') - 1
+    start = distance[np.minimum(first, len(distance)-1)] if len(distance) else np.zeros(n_parts)
+    length = np.where(last >= first, distance[np.maximum(last, 0)] - start, 0) if len(distance) else start
+
+    # Share of the length of its line of every part
+    line_length = np.bincount(part_of, length, minlength=len(geometries))
+    part_count = np.bincount(part_of, minlength=len(geometries))
+    share = np.where(line_length[part_of] > 0, length / np.maximum(line_length[part_of], 1e-300),
+                     1 / np.maximum(part_count[part_of], 1))
+
+    # Samples at the middle of equal steps along every part
+    n = np.where(last >= first, np.maximum(np.ceil(length / spacing), 1), 0).astype(np.int64)
+    sample_part = np.repeat(np.arange(n_parts), n)
+    k = np.arange(len(sample_part)) - np.repeat(np.cumsum(n) - n, n)
+    at = start[sample_part] + (k + 0.5) / n[sample_part] * length[sample_part]
+
+    # Interpolate between the vertices around every sample
+    v = np.clip(np.searchsorted(distance, at, side='right') - 1, first[sample_part], last[sample_part])
+    w = np.clip(v + 1, None, last[sample_part])
+    span = distance[w] - distance[v]
+    t = np.where(span > 0, (at - distance[v]) / np.where(span > 0, span, 1), 0)
+    x = coords[v, 0] + t * (coords[w, 0] - coords[v, 0])
+    y = coords[v, 1] + t * (coords[w, 1] - coords[v, 1])
+
+    return x, y, part_of[sample_part], share[sample_part] / n[sample_part]
+
+
+def grid_cells(x, y, grid):
+    """Flat index (row * columns + column) of the grid cell of every point,
+    -1 outside of the grid."""
+    rows, cols = grid['shape']
+    col = np.floor((x - grid['origin'][0]) / grid['cell_size']).astype(np.int64)
+    row = np.floor((grid['origin'][1] - y) / grid['cell_size']).astype(np.int64)
+    inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+
+    return np.where(inside, row * cols + col, -1)
+
+
+def rasterize_basin(folder, grid=conus_grid):
+    """Accumulates the segments of a basin into the cells of a grid.
+
+    The segment lines are read from the spatial index of the basin (see
+    spatial.py), projected to the grid and sampled every
+    cell_size / samples_per_cell (see sample_lines()). Every sample carries its
+    share of the NHD length of its segment, so the cell lengths of a basin add
+    up to its river length. Dams are counted at the middle of their segment.
+
+    Parameters:
+        folder (string):
+            Folder of the spatial index of the basin.
+        grid (dict, optional):
+            Grid of the rasters (see conus_grid).
+
+    Returns:
+        cells (dict): Sparse grids as flat cell indices and values, 'cell'
+            with 'length_km' and 'dor_km' (length times DOR), 'frag_cell'
+            with 'fragments' (distinct fragments) and 'dam_cell' with 'dams'.
+    """
+    index = spatial.load_index(folder)
+    meta = index['layers']['segments']
+    transformer = pyproj.Transformer.from_crs(source_crs, grid['crs'], always_xy=True)
+    spacing = grid['cell_size'] / samples_per_cell
+
+    cells, length, dor, frag_cells, dam_cells, dams = [], [], [], [], [], []
+    for a in range(0, meta['n'], chunk_size):
+        rows = np.arange(a, min(a+chunk_size, meta['n']))
+        lines = shapely.transform(spatial.read_geometry(meta, rows),
+                                  lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1])))
+        x, y, line, share = sample_lines(lines, spacing)
+        cell = grid_cells(x, y, grid)
+        keep = cell >= 0
+        cell, line, share = cell[keep], line[keep], share[keep]
+
+        # Length and length times DOR summed by cell
+        km = share * np.asarray(meta['attr']['LENGTHKM'][rows])[line]
+        dor_km = km * np.nan_to_num(np.asarray(meta['attr']['DOR'][rows])[line])
+        found, inverse = np.unique(cell, return_inverse=True)
+        cells.append(found)
+        length.append(np.bincount(inverse, km, minlength=len(found)))
+        dor.append(np.bincount(inverse, dor_km, minlength=len(found)))
+
+        # Distinct (cell, fragment) pairs as cell << 32 | Frag
+        frag = np.asarray(meta['attr']['Frag'][rows])[line].astype(np.int64)
+        frag_cells.append(np.unique(cell << 32 | frag))
+
+        # Dams at the middle of their segment
+        count = np.asarray(meta['attr']['DamCount'][rows])
+        has_dam = count > 0
+        if has_dam.any():
+            middle = shapely.line_interpolate_point(lines[has_dam], 0.5, normalized=True)
+            dam_cell = grid_cells(shapely.get_x(middle), shapely.get_y(middle), grid)
+            dam_cells.append(dam_cell[dam_cell >= 0])
+            dams.append(count[has_dam][dam_cell >= 0])
+
+    if not cells:
+        return {'cell': np.zeros(0, dtype=np.int64), 'length_km': np.zeros(0), 'dor_km': np.zeros(0),
+                'frag_cell': np.zeros(0, dtype=np.int64), 'fragments': np.zeros(0, dtype=np.int64),
+                'dam_cell': np.zeros(0, dtype=np.int64), 'dams': np.zeros(0)}
+
+    # Combine the chunks, fragments are counted once per cell across chunks
+    cell, inverse = np.unique(np.concatenate(cells), return_inverse=True)
+    pairs = np.unique(np.concatenate(frag_cells))
+    frag_cell, fragments = np.unique(pairs >> 32, return_counts=True)
+    dam_cell, dam_inverse = np.unique(np.concatenate(dam_cells or [np.zeros(0, dtype=np.int64)]),
+                                      return_inverse=True)
+
+    return {'cell': cell, 'length_km': np.bincount(inverse, np.concatenate(length), minlength=len(cell)),
+            'dor_km': np.bincount(inverse, np.concatenate(dor), minlength=len(cell)),
+            'frag_cell': frag_cell, 'fragments': fragments, 'dam_cell': dam_cell,
+            'dams': np.bincount(dam_inverse, np.concatenate(dams or [np.zeros(0)]), minlength=len(dam_cell))}
+
+
+def rasterize_scenario(basin_ls, results_folder, year, path, grid=conus_grid, n_workers=1):
+    """Writes fragment, dam and DOR grids of a scenario to a compressed numpy file.
+
+    The basins are rasterized by rasterize_basin(), by a process pool with
+    more than one worker, and added into full grids. The file holds
+        - length_km: River length (km) in every cell
+        - dor: Length weighted mean DOR, NaN in cells without rivers
+        - fragments: Number of distinct fragments in every cell
+        - dams: Number of dams in every cell
+    with row 0 at the north edge, and the crs, origin and cell_size of the
+    grid. Densities are the counts divided by the cell area
+    (cell_size**2 in the units of the grid CRS).
+
+    Parameters:
+        basin_ls (List):
+            Basins of the scenario.
+        results_folder (string):
+            Folder with the basin_spatial_year/ indices of the scenario.
+        year (string):
+            Scenario year.
+        path (string):
+            Output .npz file.
+        grid (dict, optional):
+            Grid of the rasters (see conus_grid).
+        n_workers (int, optional):
+            Number of worker processes, 1 from worker processes of a pool
+            (e.g. the stages of pipeline.run_pipeline()).
+    """
+    t0 = datetime.datetime.now()
+    folders = [results_folder+basin+'_spatial_'+year for basin in basin_ls]
+    if n_workers > 1 and len(folders) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            basins = list(pool.map(rasterize_basin, folders, [grid]*len(folders)))
+    else:
+        basins = [rasterize_basin(folder, grid) for folder in folders]
+
+    size = grid['shape'][0] * grid['shape'][1]
+    length, dor_km = np.zeros(size), np.zeros(size)
+    fragments, dams = np.zeros(size, dtype=np.int32), np.zeros(size, dtype=np.int32)
+    for cells in basins:
+        np.add.at(length, cells['cell'], cells['length_km'])
+        np.add.at(dor_km, cells['cell'], cells['dor_km'])
+        np.add.at(fragments, cells['frag_cell'], cells['fragments'].astype(np.int32))
+        np.add.at(dams, cells['dam_cell'], cells['dams'].astype(np.int32))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dor = np.where(length > 0, dor_km / length, np.nan)
+
+    np.savez_compressed(path, length_km=length.astype(np.float32).reshape(grid['shape']),
+                        dor=dor.astype(np.float32).reshape(grid['shape']),
+                        fragments=fragments.reshape(grid['shape']), dams=dams.reshape(grid['shape']),
+                        crs=np.array(grid['crs']), origin=np.array(grid['origin']),
+                        cell_size=np.array(grid['cell_size']))
+    print('Time to rasterize', len(basin_ls), 'basins:', datetime.datetime.now()-t0)
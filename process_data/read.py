@@ -1,7 +1,15 @@
 import pandas as pd, numpy as np, geopandas as gp
 from time import time
 
-def read_lines_dams(main_directory, year):
+def input_paths(main_directory):
+    """Lists the input files read by read_dams() and read_flowlines()."""
+    return [main_directory+"dam_data/nabd_fish_barriers_2012.shp",
+            main_directory+'dam_data/dams_to_add.shp',
+            main_directory+'dam_data/large_dams_wrongID.csv',
+            main_directory+"dam_data/grand_dams.csv",
+            main_directory+"nhd/NHDFlowlines.csv"]
+
+def read_lines_dams(main_directory, year, dam_set='nabd'):
     """Reads in dams and NHD flowlines for extraction by basin.
 
     This function is executed if the read_flag in create_csvs.py is False. It reads
@@ -122,7 +130,33 @@ def read_lines_dams(main_directory, year):
     """ 
  
     t0 = time()
+    nabd = read_dams(main_directory)
+    nabd = select_dams(nabd, year, dam_set)
+    
+    print("Length of nabd going to extract.py", len(nabd))
+   
+    t1 = time()
+    flowlines = read_flowlines(main_directory)
+    t2 = time()
+
+    print("Time to read in dams:", (t1-t0))
+    print("Time to read in flowlines:", (t2-t1))
 
+    return flowlines, nabd
+
+
+def read_dams(main_directory):
+    """Reads in the full dam catalog for every scenario.
+
+    NABD is read in and combined with the missing dams and the corrected
+    NIDIDs, then GRanD is read in to create the GRanD flag. No filtering by 
+    year or dam set is done here so the catalog only needs to be read once 
+    for all scenarios (see select_dams()). The variables are described in 
+    read_lines_dams().
+
+    Returns:
+        nabd (pandas.DataFrame): Dataframe of all dams with the Grand_flag.
+    """
     nabd_dams = gp.read_file(main_directory+"dam_data/nabd_fish_barriers_2012.shp")
     nabd_dams = nabd_dams[['COMID', 'NIDID', 'Norm_stor', 'Max_stor', 'Year_compl', 'Purposes', 'geometry']]
     nabd_dams = nabd_dams.drop_duplicates(subset='NIDID', keep="first")
@@ -154,26 +188,49 @@ def read_lines_dams(main_directory, year):
     nabd.loc[nabd.GRAND_ID != 0, 'Grand_flag'] = 1 
     nabd = nabd[nabd['NIDID']!='MI00650']
 
+    return nabd
+
+
+def select_dams(nabd, year, dam_set='nabd'):
+    """Selects the dams for a scenario from the full dam catalog.
+
+    Parameters:
+        nabd (pandas.DataFrame):
+            Dam catalog from read_dams().
+        year (string):
+            Scenario year ('no_dams', '1920', '1950', '1980', '2012'). Only dams 
+            completed before the year are kept. For 'no_dams' every dam 
+            attribute except COMID and geometry is set to 0.
+        dam_set (string, optional):
+            'nabd' for all dams or 'grand' for the large dams in GRanD.
+
+    Returns:
+        nabd (pandas.DataFrame): Dams for the scenario.
+    """
     #Select GRanD dams
-    # nabd = nabd[nabd["GRand_flag"]==1]
-    # print('Length of filtered NABD (GRanD)', len(nabd))
+    if dam_set == 'grand':
+        nabd = nabd[nabd["Grand_flag"]==1]
+        print('Length of filtered NABD (GRanD)', len(nabd))
 
     #Filter dams by year_compl (for our case: no_dams, 1920, 1950, 1980, 2012)
     if year == 'no_dams':
-        nabd = nabd.drop(columns=['COMID', 'geometry'])
-        for col in nabd.columns:
-            nabd[col].values[:] = 0
-        nabd['COMID'] = nabd_dams['COMID']
-        nabd['geometry'] = nabd_dams['geometry']
-    elif year != 'no_dams' and int(year) < 2012:
+        nabd = nabd.copy()
+        for col in nabd.columns.drop(['COMID', 'geometry'], errors='ignore'):
+            nabd[col] = 0
+    elif int(year) < 2012:
         nabd = nabd[nabd['Year_compl'] < int(year)]
-    else:
-        nabd = nabd
-    
-    print("Length of nabd going to extract.py", len(nabd))
-   
-    t1 = time()
 
+    return nabd
+
+
+def read_flowlines(main_directory):
+    """Reads in the NHD flowlines used for every scenario.
+
+    The columns are described in read_lines_dams().
+
+    Returns:
+        flowlines (pandas.DataFrame): NHD flowlines without coastlines.
+    """
     flowlines = pd.read_csv(main_directory+"nhd/NHDFlowlines.csv",
                                 usecols=['Hydroseq', 'UpHydroseq', 'DnHydroseq',
                                         'REACHCODE','LENGTHKM', 'StartFlag', 
@@ -188,10 +245,5 @@ def read_lines_dams(main_directory, year):
                                                                         'Hydroseq']].round(decimals=0)
     flowlines_nocoast = flowlines.copy()
     flowlines = flowlines_nocoast[flowlines_nocoast["FTYPE"]!="Coastline"]
-    
-    t2 = time()
-
-    print("Time to read in dams:", (t1-t0))
-    print("Time to read in flowlines:", (t2-t1))
 
-    return flowlines, nabd
\ No newline at end of file
+    return flowlines
@@ -0,0 +1,188 @@
+import numpy as np, pandas as pd
+
+
+def reg_labels(thresholds, prefix='RegLen_'):
+    """Makes column names for a list of DOR thresholds.
+
+    Thresholds are given as fractions (0.02 = 2%) and labeled by their
+    percentage so that a threshold of 0.02 becomes 'RegLen_2'.
+
+    Parameters:
+        thresholds (list):
+            DOR thresholds as fractions.
+        prefix (string, optional):
+            Prefix for the column names.
+
+    Returns:
+        labels (list): Column names in the same order as thresholds.
+    """
+    return [prefix + '%g' % (t*100) for t in thresholds]
+
+
+def dam_influence(segments, dn_pos, levels):
+    """Propagates the largest upstream dam down the stream network.
+
+    This function walks the topological levels from bifurcate.topo_levels()
+    from the headwaters to the outlets and carries along the dam with the
+    largest normal storage upstream of every segment. Because every dam upstream
+    of a segment is divided by the same flow, that dam is also the one with the
+    largest individual DOR, so each segment is attributed to the single dam
+    that regulates it the most. The distance downstream from that dam is carried
+    along as well. Dams are assumed to be at the downstream end of their segment.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe providing segment information in the same row order used for
+            topo_levels(). It must have the following columns
+                - DamID: Unique ID of a Dam located on the segment. Segments with
+                    no dams should have a value of 0.
+                - Norm_stor: Normal storage of the dams on the segment
+                - LENGTHKM: Length of segment in km
+
+        dn_pos (numpy.ndarray):
+            Row position of the downstream neighbor from topo_levels()
+
+        levels (list):
+            List of arrays of row positions from topo_levels()
+
+    Returns:
+        segments (pandas.DataFrame): An updated dataframe with the columns
+            - DomDamID: DamID of the largest dam upstream (0 if there is none)
+            - DomDamStor: Normal storage of that dam
+            - DomDamDist: Distance in km from that dam to the segment outlet
+    """
+    has_dam = segments['DamID'].values > 0
+    length = segments['LENGTHKM'].values
+    dam_stor = np.where(has_dam, np.nan_to_num(segments['Norm_stor'].values), 0.0)
+    dam_id = np.where(has_dam, segments['DamID'].values, 0)
+    dam_dist = np.where(has_dam, 0.0, np.nan)
+
+    # Work downstream one level at a time passing each dam to the downstream
+    # neighbor if it is larger than what the neighbor already has
+    for lvl in levels:
+        dtemp = dn_pos[lvl]
+        keep = (dtemp >= 0) & (dam_id[lvl] > 0)
+        src, dtemp = lvl[keep], dtemp[keep]
+        if len(src) == 0:
+            continue
+
+        # Several parents can share a downstream neighbor, keep the largest one
+        order = np.lexsort((dam_stor[src], dtemp))
+        src, dtemp = src[order], dtemp[order]
+        last = np.append(dtemp[1:] != dtemp[:-1], True)
+        src, dtemp = src[last], dtemp[last]
+
+        better = dam_stor[src] > dam_stor[dtemp]
+        src, dtemp = src[better], dtemp[better]
+        dam_stor[dtemp] = dam_stor[src]
+        dam_id[dtemp] = dam_id[src]
+        dam_dist[dtemp] = dam_dist[src] + length[dtemp]
+
+    segments['DomDamID'] = dam_id
+    segments['DomDamStor'] = dam_stor
+    segments['DomDamDist'] = dam_dist
+
+    return segments
+
+
+def dor_ratio(storage, flow):
+    """Calculates the degree of regulation with the workflow conventions.
+
+    Segments with storage and no flow are set to -1 and segments without
+    storage are set to 0.
+
+    Parameters:
+        storage (pandas.Series):
+            Storage in MCM.
+        flow (pandas.Series):
+            Mean annual flow in MCM/yr.
+
+    Returns:
+        dor (pandas.Series): Degree of regulation.
+    """
+    dor = storage / flow
+    dor[(flow == 0) & (storage > 0)] = -1
+    dor[storage == 0] = 0
+
+    return dor
+
+
+def regulated_length(segments, by, thresholds, dor_col='DOR'):
+    """Sums the regulated river length by group for a set of DOR thresholds.
+
+    A segment counts as regulated at a threshold when its DOR is greater than
+    or equal to the threshold. Segments with a DOR of -1 (storage but no flow)
+    are not counted.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe providing segment information with LENGTHKM, the DOR
+            column and the grouping column.
+        by (string):
+            Column to group by (e.g. 'Frag' or 'HUC8').
+        thresholds (list):
+            DOR thresholds as fractions (0.02 = 2%).
+        dor_col (string, optional):
+            Column holding the DOR values.
+
+    Returns:
+        reg_len (pandas.DataFrame): Regulated length in km for every threshold
+            indexed by the grouping column.
+    """
+    labels = reg_labels(thresholds)
+    dor = segments[dor_col].values[:, None]
+    reg = (dor >= np.asarray(thresholds)[None, :]) * segments['LENGTHKM'].values[:, None]
+    reg_len = pd.DataFrame(reg, index=segments.index, columns=labels)
+    reg_len[by] = segments[by].values
+
+    return reg_len.groupby(by)[labels].sum()
+
+
+def dam_reach(segments, thresholds):
+    """Summarizes how far downstream each dam regulates the river.
+
+    Uses the dominant dam columns from dam_influence() and the DomDamDOR column
+    (the storage of the dominant dam divided by the segment flow) to total the
+    length each dam regulates above every threshold and the distance downstream
+    of the dam where its influence falls below the threshold. The dam segment
+    itself is included in the regulated length.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe providing segment information with the columns DamID,
+            Norm_stor, LENGTHKM, HUC8, DomDamID, DomDamDist and DomDamDOR.
+        thresholds (list):
+            DOR thresholds as fractions (0.02 = 2%).
+
+    Returns:
+        dams (pandas.DataFrame): Dam summary indexed by DamID with the columns
+            - Hydroseq: Segment the dam is located on
+            - Norm_stor: Normal storage of the dam segment
+            - HUC8: 8-digit HUC of the dam segment
+            - RegLen_#: Length regulated by the dam above each threshold
+            - FadeKM_#: Distance downstream of the dam to the last segment above
+                each threshold (NaN if the dam never reaches the threshold)
+            - Fade_Hydroseq: Last segment above the lowest threshold
+    """
+    damsegs = segments[segments['DamID'] > 0]
+    dams = pd.DataFrame({'Hydroseq': damsegs.index,
+                         'Norm_stor': damsegs['Norm_stor'].values,
+                         'HUC8': damsegs['HUC8'].values},
+                        index=damsegs['DamID'].values)
+    dams.index.name = 'DamID'
+
+    dominated = segments[segments['DomDamID'] > 0]
+    reg = regulated_length(dominated, 'DomDamID', thresholds, dor_col='DomDamDOR')
+    dams = dams.join(reg)
+    dams[reg.columns] = dams[reg.columns].fillna(0)
+
+    # The furthest regulated segment from every dam for each threshold
+    for t, label in zip(thresholds, reg_labels(thresholds, prefix='FadeKM_')):
+        above = dominated[dominated['DomDamDOR'] >= t]
+        dams[label] = above.groupby('DomDamID')['DomDamDist'].max()
+
+    above = dominated[dominated['DomDamDOR'] >= min(thresholds)]
+    fade = above.groupby('DomDamID')['DomDamDist'].idxmax()
+    dams['Fade_Hydroseq'] = fade
+
+    return dams
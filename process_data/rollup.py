@@ -0,0 +1,135 @@
+import numpy as np, pandas as pd
+import regulate as reg
+
+# Segment columns reported at the outlet (longest upstream length) of every HUC
+outlet_cols = ['Frag', 'LENGTHKM_up', 'DOR', 'Norm_stor_up', 'QC_MA']
+
+
+def huc_digits(huc):
+    """Number of digits of a HUC level name (e.g. 'HUC8' -> 8)."""
+    return int(huc[3:])
+
+
+def huc_codes(reachcode, digits):
+    """Integer HUC codes with a number of digits from the 14 digit REACHCODEs."""
+    return np.asarray(reachcode, dtype=np.int64) // 10**(14-digits)
+
+
+def _outlet(values, positions, starts):
+    # Largest value in every run of a sorted array and the smallest position
+    # holding it, so ties go to the first segment like idxmax()
+    top = np.fmax.reduceat(values, starts)
+    counts = np.diff(np.append(starts, len(values)))
+    hit = values == np.repeat(top, counts)
+    first = np.minimum.reduceat(np.where(hit, positions, np.iinfo(np.int64).max), starts)
+    return top, first
+
+
+def huc_rollup(segments, fragments, hucs=('HUC2', 'HUC4', 'HUC8'), dor_thresholds=(0.02, 0.1, 1.0)):
+    """Summarizes segments and fragments by any set of HUC levels in one pass.
+
+    The segments are sorted once by their HUC code at the finest level and
+    every measure is reduced over the runs of equal codes. Coarser levels are
+    rolled up from the finest level: sums and counts are added, maximums are
+    the maximum of the finer maximums, means are the rolled up sum divided by
+    the rolled up count and the outlet of a HUC is the finer outlet with the
+    longest upstream length. Fragments are assigned to the HUC of their outlet
+    segment.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Dataframe of segments indexed by Hydroseq with REACHCODE, LENGTHKM,
+            Norm_stor, DamCount, DOR and the columns in outlet_cols.
+        fragments (pandas.DataFrame):
+            Fragments from bifurcate.agg_by_frag() with the Hydroseq of their
+            outlet segment, LENGTHKM, LongPathKM and MainstemKM.
+        hucs (list, optional):
+            HUC levels to summarize (e.g. 'HUC2', 'HUC6', 'HUC12').
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+
+    Returns:
+        summaries (dict): Summary by HUC level with the columns
+            - DamCount_sum, LENGTHKM_sum, Norm_stor_max, Norm_stor_sum: Segment totals
+            - LENGTHKM_len, LENGTHKM_max, LENGTHKM_mean: Number of fragments and
+                their largest and mean length
+            - LongPathKM_max, LongPathKM_mean, MainstemKM_mean: Fragment path lengths
+            - RegLen_*: Regulated length for every DOR threshold
+            - seg_outlet: Hydroseq of the segment with the longest upstream length
+            - *_outlet: Values of the outlet segment for the columns in outlet_cols
+    """
+    if not hucs:
+        return {}
+    digits = sorted(set(huc_digits(huc) for huc in hucs))
+    finest = digits[-1]
+
+    # Sort the segments by HUC code at the finest level
+    codes = huc_codes(segments['REACHCODE'].values, finest)
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    groups = sorted_codes[starts]
+
+    # Additive segment measures and maximums at the finest level
+    labels = reg.reg_labels(dor_thresholds)
+    dor = segments['DOR'].values[:, None]
+    reg_len = (dor >= np.asarray(dor_thresholds)[None, :]) * segments['LENGTHKM'].values[:, None]
+    sums = {col: np.add.reduceat(np.nan_to_num(segments[col].values[order]), starts)
+            for col in ['DamCount', 'LENGTHKM', 'Norm_stor']}
+    sums.update({label: np.add.reduceat(reg_len[order, i], starts) for i, label in enumerate(labels)})
+    maxs = {'Norm_stor': np.fmax.reduceat(segments['Norm_stor'].values[order].astype(float), starts)}
+    top, first = _outlet(segments['LENGTHKM_up'].values[order].astype(float), order, starts)
+
+    # Fragment measures by the finest HUC of their outlet segment
+    frag_codes = huc_codes(segments['REACHCODE'].reindex(fragments['Hydroseq']).values, finest)
+    frag_group = np.searchsorted(groups, frag_codes)
+    frag_sums, frag_counts, frag_maxs = {}, {}, {}
+    for col in ['LENGTHKM', 'LongPathKM', 'MainstemKM']:
+        values = fragments[col].values.astype(float)
+        frag_sums[col] = np.zeros(len(groups))
+        frag_counts[col] = np.zeros(len(groups))
+        frag_maxs[col] = np.full(len(groups), np.nan)
+        np.add.at(frag_sums[col], frag_group, np.nan_to_num(values))
+        np.add.at(frag_counts[col], frag_group, ~np.isnan(values))
+        np.fmax.at(frag_maxs[col], frag_group, values)
+    n_frags = np.bincount(frag_group, minlength=len(groups))
+
+    summaries = {}
+    for huc in hucs:
+        # Roll the finest level up to this level, HUC codes stay sorted
+        parent = groups // 10**(finest-huc_digits(huc))
+        pstarts = np.flatnonzero(np.r_[True, parent[1:] != parent[:-1]])
+        index = pd.Index(parent[pstarts].astype(float), name=huc)
+
+        summary = pd.DataFrame({'DamCount_sum': np.add.reduceat(sums['DamCount'], pstarts),
+                                'LENGTHKM_sum': np.add.reduceat(sums['LENGTHKM'], pstarts),
+                                'Norm_stor_max': np.fmax.reduceat(maxs['Norm_stor'], pstarts),
+                                'Norm_stor_sum': np.add.reduceat(sums['Norm_stor'], pstarts)},
+                               index=index)
+
+        # Fragment columns are missing for HUCs without a fragment outlet
+        has_frags = np.add.reduceat(n_frags, pstarts) > 0
+        fsum = {col: np.add.reduceat(frag_sums[col], pstarts) for col in frag_sums}
+        fcount = {col: np.add.reduceat(frag_counts[col], pstarts) for col in frag_counts}
+        fmax = {col: np.fmax.reduceat(frag_maxs[col], pstarts) for col in frag_maxs}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frag_summary = pd.DataFrame({'LENGTHKM_len': np.add.reduceat(n_frags, pstarts),
+                                         'LENGTHKM_max': fmax['LENGTHKM'],
+                                         'LENGTHKM_mean': fsum['LENGTHKM'] / fcount['LENGTHKM'],
+                                         'LongPathKM_max': fmax['LongPathKM'],
+                                         'LongPathKM_mean': fsum['LongPathKM'] / fcount['LongPathKM'],
+                                         'MainstemKM_mean': fsum['MainstemKM'] / fcount['MainstemKM']},
+                                        index=index)
+        summary = pd.concat([summary, frag_summary[has_frags]], axis=1)
+
+        for label in labels:
+            summary[label] = np.add.reduceat(sums[label], pstarts)
+
+        _, outlet = _outlet(top, first, pstarts)
+        summary['seg_outlet'] = segments.index.values[outlet]
+        for col in outlet_cols:
+            summary[col+'_outlet'] = segments[col].values[outlet]
+
+        summaries[huc] = summary
+
+    return summaries
@@ -0,0 +1,133 @@
+import pandas as pd, os, time, traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# Rough peak memory of one basin run per million segments (WKT geometry included)
+gb_per_million_segments = 8.0
+
+
+def estimate_mem_gb(n_segments):
+    """Estimates the peak memory of a basin run from its number of segments."""
+    return max(n_segments / 10**6 * gb_per_million_segments, 0.1)
+
+
+class JobsFailed(RuntimeError):
+    """Raised by run_jobs() after every job has finished if some of them failed.
+
+    The results of the jobs that finished and the timings of every job (with
+    the error of the failed ones) are kept as the results and timings
+    attributes.
+    """
+    def __init__(self, results, timings):
+        failed = timings[timings['status'] == 'failed']
+        super().__init__(str(len(failed))+' of '+str(len(timings))+' jobs failed:\n'
+                         + '\n'.join(name+': '+error for name, error in failed['error'].items()))
+        self.results, self.timings = results, timings
+
+
+def _timed_job(func, args):
+    # Runs a job in a worker and records when and where it ran, an exception
+    # is returned with its traceback so the other jobs keep running
+    t0 = time.time()
+    try:
+        result, error = func(*args), None
+    except Exception as err:
+        result, error = None, repr(err)+'\n'+traceback.format_exc()
+    return result, error, t0, time.time(), os.getpid()
+
+
+def run_jobs(jobs, func, max_workers=None, mem_limit_gb=None):
+    """Runs jobs in a process pool, largest first and within a memory budget.
+
+    Jobs are started in order of decreasing estimated memory so that the
+    longest jobs (e.g. Mississippi) start first and the small ones fill in the
+    gaps at the end. A job is only started if the estimated memory of the
+    running jobs plus the new job stays below mem_limit_gb, smaller jobs that
+    fit are started ahead of a large job that does not. A job is always started
+    when nothing else is running, even if it is larger than the limit. A job
+    that fails does not stop the others, the failures are raised together
+    once every job has finished. If a worker process dies (e.g. out of memory)
+    the pool is broken and every job running in it fails, the pending jobs are
+    run in a new pool.
+
+    Parameters:
+        jobs (List):
+            List of dictionaries, one per job, with the keys
+                - name: Unique name of the job
+                - args: Tuple of arguments passed to func
+                - mem_gb: Estimated peak memory of the job in GB
+        func (function):
+            Function run for every job. It must be importable by the worker
+            processes (defined at the top level of a module).
+        max_workers (int, optional):
+            Number of worker processes, defaults to the number of cores.
+        mem_limit_gb (float, optional):
+            Memory budget for all running jobs. No limit if None.
+
+    Returns:
+        results (dict): Result of every job by name.
+        timings (pandas.DataFrame): Start, end and run time (s) of every job
+            with the estimated memory, worker process ID, status ('ran' or
+            'failed') and error.
+
+    Raises:
+        JobsFailed: If any job failed, with the results and timings.
+    """
+    max_workers = max_workers or os.cpu_count()
+    mem_limit_gb = mem_limit_gb or float('inf')
+    pending = sorted(jobs, key=lambda j: j['mem_gb'], reverse=True)
+    running = {}
+    results, timings = {}, []
+    t_start = time.time()
+
+    pool, broken = ProcessPoolExecutor(max_workers=max_workers), False
+    try:
+        while pending or running:
+            # Start as many pending jobs as the workers and memory budget allow
+            mem_used = sum(job['mem_gb'] for job in running.values())
+            for job in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if running and mem_used + job['mem_gb'] > mem_limit_gb:
+                    continue
+                try:
+                    future = pool.submit(_timed_job, func, job['args'])
+                except BrokenProcessPool:
+                    # A worker died, the running jobs fail and the job waits for a new pool
+                    broken = True
+                    break
+                running[future] = job
+                mem_used += job['mem_gb']
+                pending.remove(job)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result, error, t0, t1, pid = future.result()
+                except Exception as err:
+                    # The worker itself died (e.g. out of memory)
+                    result, error, t0, t1, pid = None, repr(err), time.time(), time.time(), None
+                    broken = broken or isinstance(err, BrokenProcessPool)
+                timings.append({'name': job['name'], 'mem_gb': job['mem_gb'], 'pid': pid,
+                                'start': t0 - t_start, 'end': t1 - t_start, 'run_time': t1 - t0,
+                                'status': 'failed' if error else 'ran', 'error': error})
+                if error:
+                    print('Failed', job['name'], 'after', round(t1 - t0, 1), 's:', error.split('\n')[0])
+                    continue
+                results[job['name']] = result
+                print('Finished', job['name'], 'in', round(t1 - t0, 1), 's')
+
+            if broken and not running:
+                pool.shutdown()
+                pool, broken = ProcessPoolExecutor(max_workers=max_workers), False
+    finally:
+        pool.shutdown()
+
+    timings = pd.DataFrame(timings).set_index('name')
+    print('Wall time =', round(time.time() - t_start, 1), 's, longest job =',
+          round(timings['run_time'].max(), 1), 's')
+    if (timings['status'] == 'failed').any():
+        raise JobsFailed(results, timings)
+
+    return results, timings
@@ -0,0 +1,327 @@
+"""
+A local analysis service that keeps the NHD network, the dam catalog and the
+topology of every basin in memory, so interactive queries and what-if
+scenarios do not reload the inputs.
+
+Start it with
+    python service.py <main_directory> [basin ...]
+and query it from another process with request(), e.g.
+    request('fragments', basin='Red', year='1950', remove=[12, 40])
+
+Created by: Laura Condon and Rachel Spinti
+"""
+import numpy as np, pandas as pd, json, threading, datetime, sys, io
+import urllib.request, urllib.parse
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import read, extract as ex, workflow as wf, rollup, ancestry as anc, bifurcate as bfc, regulate as reg
+
+# Address of the service (localhost only) and the number of scenarios kept in memory
+host = '127.0.0.1'
+port = 8765
+max_scenarios = 32
+
+# Segment columns returned by the segments query if none are asked for
+default_segment_cols = ['Frag', 'DOR', 'Norm_stor_up', 'QC_MA', 'DamID', 'DnDamID', 'DnDamDist']
+
+
+def load_network(main_directory, basin_ls):
+    """Reads the inputs once and builds the topology of every basin.
+
+    Parameters:
+        main_directory (string):
+            Folder containing the input data.
+        basin_ls (List):
+            Basins the service answers for.
+
+    Returns:
+        network (dict): Flowlines, topological levels (see
+            bifurcate.topo_levels()) and ancestry index (see ancestry.py) by
+            basin, the dam catalog and the scenario cache.
+    """
+    t0 = datetime.datetime.now()
+    flowlines = read.read_flowlines(main_directory)
+    catalog = read.read_dams(main_directory)
+    network = {'catalog': catalog, 'lines': {}, 'levels': {}, 'ancestry': {}, 'scenarios': OrderedDict(),
+               'pending': {}, 'lock': threading.Lock()}
+    for basin in basin_ls:
+        lines = ex.basin_flowlines(basin, flowlines)
+        network['lines'][basin] = lines
+        topology = lines.set_index('Hydroseq')[['DnHydroseq', 'LENGTHKM']].assign(DamID=0)
+        network['levels'][basin] = (topology.index.values,) + bfc.topo_levels(topology, 'DnHydroseq')
+        network['ancestry'][basin] = anc.build_ancestry(topology[~topology.index.duplicated()])
+    print('Time to load the network:', datetime.datetime.now()-t0)
+
+    return network
+
+
+def _ids(values):
+    # Parses a list of integer IDs given as a list or a comma separated string
+    if values is None or values == '':
+        return []
+    if isinstance(values, str):
+        values = values.split(',')
+    return [int(float(v)) for v in np.atleast_1d(values)]
+
+
+def analyze(segments, dn_pos, levels, dor_thresholds=(0.02, 0.1, 1.0)):
+    """Runs steps 1 to 4 of workflow.process_basin() with the topological
+    levels of the network.
+
+    The upstream sums, dam distances, DOR, fragments and fragment paths are
+    each one sweep over the levels (see bifurcate.upstream_sum() and 
+    bifurcate.label_fragments()), so a scenario takes a fraction of a second
+    per basin instead of the queue traversals of a workflow run. The results
+    are the same as the workflow's, except for the step column of 
+    make_fragments() which is not made.
+
+    Parameters:
+        segments (pandas.DataFrame):
+            Segments of a basin indexed by Hydroseq with the columns in
+            workflow.segment_cols, in the row order of the levels.
+        dn_pos, levels:
+            Topological levels of the segments from bifurcate.topo_levels().
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+
+    Returns:
+        segments (pandas.DataFrame): Segments with the workflow columns.
+        fragments (pandas.DataFrame): Fragments from bifurcate.agg_by_frag().
+    """
+    segments = wf.convert_units(segments)
+    segments_up = bfc.upstream_sum(segments, dn_pos, levels, wf.upstream_cols)
+    segments[segments_up.columns] = segments_up
+    segments = reg.dam_influence(segments, dn_pos, levels)
+    segments = bfc.dam_distance(segments, dn_pos, levels)
+
+    segments['DOR'] = reg.dor_ratio(segments.Norm_stor_up, segments.QC_MA)
+    segments['DomDamDOR'] = reg.dor_ratio(segments.DomDamStor, segments.QC_MA)
+
+    segments = bfc.label_fragments(segments, dn_pos, levels, wf.frag_exit_id)
+    segments = bfc.longest_path(segments, dn_pos, levels)
+    fragments = bfc.agg_by_frag(segments)
+    fragments = fragments.join(reg.regulated_length(segments, 'Frag', dor_thresholds))
+
+    return segments, fragments
+
+
+def scenario(network, basin, year, dam_set='nabd', remove=(), add=(), dor_thresholds=(0.02, 0.1, 1.0)):
+    """Runs the workflow for a scenario in memory, or returns it from the cache.
+
+    The dams of the scenario are the dams of the dam set completed before the
+    year, without the dams in remove and with the dams in add (from the whole
+    catalog). The scenario is analyzed with the topological levels kept in
+    memory (see analyze()) and nothing is written to disk. The most recent
+    scenarios are kept, and requests for a scenario that is being run wait
+    for it instead of running it again.
+
+    Parameters:
+        network (dict):
+            Network from load_network().
+        basin (string):
+            Name of the basin.
+        year (string):
+            Scenario year, 'no_dams' or any year as the completion cutoff.
+        dam_set (string, optional):
+            'nabd' for all dams or 'grand' for the large dams in GRanD.
+        remove, add (list, optional):
+            DamIDs to take out of or add to the scenario.
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+
+    Returns:
+        results (dict): The segments, fragments and HUC indices (by level) of
+            the scenario.
+    """
+    key = (basin, str(year), dam_set, tuple(sorted(_ids(remove))), tuple(sorted(_ids(add))), tuple(dor_thresholds))
+    with network['lock']:
+        if key in network['scenarios']:
+            network['scenarios'].move_to_end(key)
+            return network['scenarios'][key]
+        event = network['pending'].get(key)
+        owner = event is None
+        if owner:
+            event = network['pending'][key] = threading.Event()
+    if not owner:
+        event.wait()
+        return scenario(network, basin, year, dam_set, remove, add, dor_thresholds)
+
+    try:
+        catalog = network['catalog']
+        dams = read.select_dams(catalog, str(year), dam_set)
+        dams = dams[~dams['DamID'].isin(key[3])]
+        if key[4]:
+            dams = pd.concat([dams, catalog[catalog['DamID'].isin(key[4]) & ~catalog['DamID'].isin(dams['DamID'])]])
+        segments = ex.join_dams_flowlines(basin, network['lines'][basin], dams, None)
+        segments = segments.reset_index()[wf.segment_cols].set_index('Hydroseq')
+        hydroseq, dn_pos, levels = network['levels'][basin]
+        if not np.array_equal(segments.index.values, hydroseq):
+            dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+        segments, fragments = analyze(segments, dn_pos, levels, dor_thresholds)
+        hucs = rollup.huc_rollup(segments, fragments, wf.huc_levels, dor_thresholds)
+        dam_segs = segments[segments['DamID'] > 0]
+        results = {'segments': segments.drop(columns=['Coordinates']), 'fragments': fragments, 'hucs': hucs,
+                   'ancestry': anc.set_dams(network['ancestry'][basin], dam_segs.index.values,
+                                            dam_segs['DamID'].values)}
+        with network['lock']:
+            network['scenarios'][key] = results
+            while len(network['scenarios']) > max_scenarios:
+                network['scenarios'].popitem(last=False)
+    finally:
+        with network['lock']:
+            network['pending'].pop(key)
+        event.set()
+
+    return results
+
+
+def answer(network, query, params):
+    """Answers a query of the service.
+
+    Queries
+        - status: Basins and the scenarios in memory
+        - fragments: Fragments of a scenario (all or those in frag=...)
+        - segments: Segment columns (columns=...) for the segments in hydroseq=...
+        - huc: HUC indices at a level (huc=HUC8) for all HUCs or those in code=...
+        - upstream_dams: DamIDs upstream of the segments in hydroseq=...
+    Every query but status takes the scenario parameters of scenario()
+    (basin, year, dam_set, remove, add and dor).
+
+    Parameters:
+        network (dict):
+            Network from load_network().
+        query (string):
+            Name of the query.
+        params (dict):
+            Query parameters as strings (comma separated lists).
+
+    Returns:
+        result (pandas.DataFrame or dict): Answer of the query.
+    """
+    if query == 'status':
+        with network['lock']:
+            return {'basins': list(network['lines']),
+                    'scenarios': [list(key[:3])+[list(key[3]), list(key[4])] for key in network['scenarios']]}
+
+    dor = [float(v) for v in params['dor'].split(',')] if params.get('dor') else [0.02, 0.1, 1.0]
+    results = scenario(network, params['basin'], params.get('year', '2012'), params.get('dam_set', 'nabd'),
+                       params.get('remove'), params.get('add'), dor)
+    columns = params['columns'].split(',') if params.get('columns') else None
+
+    if query == 'fragments':
+        found = results['fragments']
+        if params.get('frag'):
+            found = found.loc[found.index.isin(_ids(params['frag']))]
+    elif query == 'segments':
+        found = results['segments'].reindex(_ids(params.get('hydroseq')))[columns or default_segment_cols]
+        columns = None
+    elif query == 'huc':
+        found = results['hucs'][params.get('huc', 'HUC8')]
+        if params.get('code'):
+            found = found.loc[found.index.isin(_ids(params['code']))]
+    elif query == 'upstream_dams':
+        hydroseq = np.asarray(_ids(params.get('hydroseq')), dtype=np.int64)
+        index = results['ancestry']
+        nodes = anc.node_index(index, hydroseq)
+        indptr, dam_id, dam_hydroseq = anc.upstream_dams(index, np.maximum(nodes, 0))
+        counts = np.where(nodes >= 0, np.diff(indptr), 0)
+        keep = np.repeat(nodes >= 0, np.diff(indptr))
+        found = pd.DataFrame({'Hydroseq': np.repeat(hydroseq, counts), 'DamID': dam_id[keep],
+                              'DamHydroseq': dam_hydroseq[keep]})
+    else:
+        raise KeyError('Unknown query: '+query)
+
+    return found[columns] if columns else found
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Answers GET /<query>?<params> with JSON, tables in pandas 'split' format
+    network = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        try:
+            result = answer(self.network, url.path.strip('/'), params)
+            if isinstance(result, pd.DataFrame):
+                body = json.dumps({'table': json.loads(result.to_json(orient='split')),
+                                   'index': result.index.name})
+            else:
+                body = json.dumps(result)
+            status = 200
+        except Exception as err:
+            body, status = json.dumps({'error': type(err).__name__+': '+str(err)}), 400
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(main_directory, basin_ls, address=(host, port)):
+    """Loads the network and answers queries until interrupted.
+
+    Requests are answered by a thread each, so queries of scenarios in
+    memory are answered while other scenarios run.
+
+    Parameters:
+        main_directory (string):
+            Folder containing the input data.
+        basin_ls (List):
+            Basins the service answers for.
+        address (tuple, optional):
+            (host, port) the service listens on.
+    """
+    _Handler.network = load_network(main_directory, basin_ls)
+    server = ThreadingHTTPServer(address, _Handler)
+    server.daemon_threads = True
+    print('Serving on http://%s:%d/' % address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request(query, address=(host, port), timeout=None, **params):
+    """Sends a query to a running service.
+
+    Parameters:
+        query (string):
+            Name of the query (see answer()).
+        address (tuple, optional):
+            (host, port) of the service.
+        timeout (float, optional):
+            Seconds to wait for the answer, scenarios that are not in memory
+            are analyzed first (see analyze()).
+        params:
+            Query parameters, lists are sent comma separated.
+
+    Returns:
+        result (pandas.DataFrame or dict): Answer of the query.
+    """
+    params = {k: ','.join(str(x) for x in v) if isinstance(v, (list, tuple, np.ndarray)) else str(v)
+              for k, v in params.items()}
+    url = 'http://%s:%d/%s?%s' % (address[0], address[1], query, urllib.parse.urlencode(params))
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            result = json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        result = json.loads(err.read())
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    if 'table' in result:
+        table = pd.read_json(io.StringIO(json.dumps(result['table'])), orient='split')
+        table.index.name = result['index']
+        return table
+
+    return result
+
+
+if __name__ == '__main__':
+    main_directory = sys.argv[1] if len(sys.argv) > 1 else 'Spinti_river_fragmentation_data_2022/'
+    basin_ls = sys.argv[2:] or list(ex.major_basins)
+    serve(main_directory, basin_ls)
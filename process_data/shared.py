@@ -0,0 +1,171 @@
+import numpy as np, pandas as pd, geopandas as gp, shapely, pickle
+from multiprocessing import shared_memory
+
+# Shared memory blocks attached in this process, kept open while the arrays are used
+_attached = {}
+
+
+def publish_arrays(arrays, prefix):
+    """Copies numpy arrays into named shared memory blocks.
+
+    Parameters:
+        arrays (dict):
+            Numpy arrays by name. Arrays must not be object arrays.
+        prefix (string):
+            Prefix for the shared memory block names, unique to this run.
+
+    Returns:
+        manifest (dict): Block name, dtype and shape of every array by name. This
+            is all a worker needs to attach to the arrays.
+        blocks (list): Shared memory blocks, which must be closed and unlinked
+            by the publishing process with release().
+    """
+    manifest, blocks = {}, []
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1),
+                                         name=prefix+'_'+name)
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        manifest[name] = (shm.name, arr.dtype.str, arr.shape)
+        blocks.append(shm)
+
+    return manifest, blocks
+
+
+def attach_arrays(manifest):
+    """Attaches to arrays published with publish_arrays() without copying them.
+
+    Returns:
+        arrays (dict): Read only numpy arrays backed by the shared memory blocks.
+    """
+    arrays = {}
+    for name, (shm_name, dtype, shape) in manifest.items():
+        if shm_name not in _attached:
+            _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[shm_name].buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+
+    return arrays
+
+
+def release(blocks):
+    """Closes and removes shared memory blocks created by publish_arrays()."""
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _encode_frame(frame, name, arrays):
+    # Adds the index and every column of a frame to arrays and returns the
+    # layout needed to rebuild it. Numeric columns keep their dtype, strings
+    # are utf-8 bytes, geometry columns are WKB (empty for missing geometry)
+    # and other object columns (e.g. strings with NaN) are pickled, all as one
+    # byte array with the start of every value in an offsets array
+    arrays[name+'_index'] = frame.index.values
+    layout = []
+    for i, col in enumerate(frame.columns):
+        key = name+'_'+str(i)
+        values = frame[col]
+        crs = None
+        if isinstance(values.dtype, gp.array.GeometryDtype):
+            encoded, kind = [w or b'' for w in shapely.to_wkb(values.values)], 'wkb'
+            crs = values.values.crs
+        elif isinstance(values.dtype, np.dtype) and values.dtype != object:
+            arrays[key] = values.values
+            layout.append((col, key, 'array', crs))
+            continue
+        elif values.map(type).eq(str).all():
+            encoded, kind = values.str.encode('utf-8').tolist(), 'str'
+        else:
+            encoded, kind = [pickle.dumps(v) for v in values], 'pickle'
+        arrays[key] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        arrays[key+'_offsets'] = np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+        layout.append((col, key, kind, crs))
+
+    return layout
+
+
+def _decode_frame(arrays, name, layout, rows=None):
+    # Rebuilds the rows of a frame encoded by _encode_frame(), all rows if None
+    index = arrays[name+'_index']
+    rows = np.arange(len(index)) if rows is None else rows
+    columns = {}
+    for col, key, kind, crs in layout:
+        if kind == 'array':
+            columns[col] = arrays[key][rows]
+            continue
+        data, offsets = arrays[key], arrays[key+'_offsets']
+        values = [data[offsets[i]:offsets[i+1]].tobytes() for i in rows]
+        if kind == 'wkb':
+            columns[col] = gp.array.from_wkb(np.array([v or None for v in values], dtype=object), crs=crs)
+            continue
+        values = [v.decode('utf-8') for v in values] if kind == 'str' else [pickle.loads(v) for v in values]
+        columns[col] = np.array(values, dtype=object) if len(values) else np.zeros(0, dtype=object)
+
+    return pd.DataFrame(columns, index=index[rows])
+
+
+def publish_network(flowlines, dams, prefix):
+    """Publishes the compiled flowline network and the dam catalog to shared memory.
+
+    Every flowline and dam column is published with its own dtype, so the
+    frames rebuilt by basin_network() are the same as the frames of a run in
+    one process and the outputs do not depend on the number of workers.
+    Text, geometry and other object columns (the WKT geometry of the
+    flowlines, the NIDID and Purposes of the dams and their point geometry as
+    WKB) are published as one byte array with the start of every value in a
+    separate offsets array, so workers only decode the rows of their basin.
+
+    Parameters:
+        flowlines (pandas.DataFrame):
+            NHD flowlines from read.read_flowlines().
+        dams (pandas.DataFrame):
+            Dam catalog from read.read_dams().
+        prefix (string):
+            Prefix for the shared memory block names, unique to this run.
+
+    Returns:
+        manifest (dict): Manifest of the arrays from publish_arrays() and the
+            column layout of the flowlines and dams.
+        blocks (list): Shared memory blocks to release() when the run is done.
+    """
+    arrays = {}
+    layout = {'line': _encode_frame(flowlines, 'line', arrays), 'dam': _encode_frame(dams, 'dam', arrays)}
+    manifest, blocks = publish_arrays(arrays, prefix)
+
+    return {'arrays': manifest, 'layout': layout}, blocks
+
+
+def basin_network(manifest, huc2_list):
+    """Builds the flowlines and the dams of a basin from shared memory.
+
+    Only the flowlines of the basin and the dams on them (by COMID) are copied
+    out of shared memory and decoded, so a worker's memory grows with the size
+    of its basin and not the size of the network. The frames are the same as
+    extract.basin_flowlines() and the rows of read.read_dams() on the basin
+    flowlines in one process (columns, dtypes, index and a geometry column
+    with the CRS of the catalog). Joining them with
+    extract.join_dams_flowlines() gives the same segments as the full catalog,
+    since the dams are joined to the flowlines by COMID.
+
+    Parameters:
+        manifest (dict):
+            Manifest from publish_network().
+        huc2_list (list):
+            HUC 2 values of the basin (see extract.major_basins).
+
+    Returns:
+        basin_lines (pandas.DataFrame): Flowlines of the basin.
+        dams (pandas.DataFrame): Dams of the catalog on the basin flowlines.
+    """
+    arrays = attach_arrays(manifest['arrays'])
+    layout = manifest['layout']
+    huc2 = arrays[[key for col, key, _, _ in layout['line'] if col == 'HUC2'][0]]
+    rows = np.flatnonzero(np.isin(huc2, huc2_list))
+    basin_lines = _decode_frame(arrays, 'line', layout['line'], rows)
+    comid = arrays[[key for col, key, _, _ in layout['dam'] if col == 'COMID'][0]]
+    dam_rows = np.flatnonzero(np.isin(comid, basin_lines['COMID'].values))
+    dams = _decode_frame(arrays, 'dam', layout['dam'], dam_rows)
+
+    return basin_lines, dams
@@ -0,0 +1,152 @@
+import numpy as np
+
+# Relative accuracy of the quantiles of a sketch, and the smallest length (km)
+# kept in a bucket, shorter fragments are counted in the zero bucket
+relative_accuracy = 0.01
+min_length = 1e-4
+
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def make_sketch(values):
+    """Makes a quantile sketch of positive values (e.g. fragment lengths).
+
+    The sketch counts the values in logarithmic buckets, bucket k holding the
+    values in (gamma**(k-1), gamma**k], so every quantile read from it is
+    within relative_accuracy of the true value (see quantile()). Sketches are
+    merged by adding the counts of their buckets (see merge_sketches()), so
+    the sketch of many basins or years is exactly the sketch of all of their
+    values, and a sketch is a few hundred buckets whatever the number of
+    values.
+
+    Parameters:
+        values (array like):
+            Values to sketch, NaN values are dropped.
+
+    Returns:
+        sketch (dict): 'bucket' and 'count' arrays of the occupied buckets and
+            'zeros' (values below min_length), 'n', 'sum', 'min' and 'max'.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    small = values < min_length
+    bucket = np.ceil(np.log(values[~small]) / np.log(gamma)).astype(np.int64)
+    bucket, count = np.unique(bucket, return_counts=True)
+
+    return {'bucket': bucket, 'count': count.astype(np.int64), 'zeros': int(small.sum()),
+            'n': len(values), 'sum': float(values.sum()),
+            'min': float(values.min()) if len(values) else np.nan,
+            'max': float(values.max()) if len(values) else np.nan}
+
+
+def merge_sketches(sketches):
+    """Merges sketches into the sketch of all of their values."""
+    sketches = list(sketches)
+    if not sketches:
+        return make_sketch([])
+    bucket, inverse = np.unique(np.concatenate([s['bucket'] for s in sketches]), return_inverse=True)
+    count = np.bincount(inverse, np.concatenate([s['count'] for s in sketches]), minlength=len(bucket))
+
+    n = sum(s['n'] for s in sketches)
+    return {'bucket': bucket, 'count': count.astype(np.int64), 'zeros': sum(s['zeros'] for s in sketches),
+            'n': n, 'sum': sum(s['sum'] for s in sketches),
+            'min': float(np.nanmin([s['min'] for s in sketches])) if n else np.nan,
+            'max': float(np.nanmax([s['max'] for s in sketches])) if n else np.nan}
+
+
+def _values(sketch):
+    # Value standing for every bucket, within relative_accuracy of its values
+    return np.clip(2 * gamma**sketch['bucket'] / (gamma + 1), sketch['min'], sketch['max'])
+
+
+def quantile(sketch, q):
+    """Values at quantiles q (between 0 and 1) of a sketch.
+
+    The value of rank q * (n - 1) is found in the cumulative bucket counts, so
+    it is within relative_accuracy of the exact quantile.
+    """
+    q = np.asarray(q, dtype=float)
+    if sketch['n'] == 0:
+        return np.full(q.shape, np.nan)
+    rank = q * (sketch['n'] - 1)
+    below = np.cumsum(sketch['count']) + sketch['zeros']
+    found = np.searchsorted(below, rank, side='right')
+    values = _values(sketch)[np.minimum(found, len(below)-1)] if len(below) else np.zeros(q.shape)
+
+    return np.where(rank < sketch['zeros'], min(sketch['min'], min_length), values)
+
+
+def histogram(sketch, bins):
+    """Counts of a sketch between bin edges (like numpy.histogram()), with the
+    buckets placed at their values."""
+    counts, _ = np.histogram(np.r_[_values(sketch), [0.0]], bins, weights=np.r_[sketch['count'], [sketch['zeros']]])
+    return counts.astype(np.int64)
+
+
+def exceedance(sketch, n_points=200):
+    """Exceedance probability curve of a sketch (as in weibull_plots.py).
+
+    Returns:
+        probability (numpy.ndarray): Weibull plotting positions rank / (n + 1),
+            the rank counted from the largest value.
+        values (numpy.ndarray): Values exceeded with those probabilities.
+    """
+    probability = np.geomspace(1 / (sketch['n'] + 1), sketch['n'] / (sketch['n'] + 1), n_points)
+    return probability, quantile(sketch, 1 - probability)
+
+
+def write_sketch(sketch, path):
+    """Saves a sketch in a numpy file (.npz)."""
+    np.savez(path, **sketch)
+
+
+def read_sketch(path):
+    """Reads a sketch saved by write_sketch()."""
+    with np.load(path) as data:
+        return {k: data[k] if k in ['bucket', 'count'] else data[k].item() for k in data.files}
+
+
+def combine_sketches(scenarios, path):
+    """Saves the sketches of many scenarios and basins in one file.
+
+    Parameters:
+        scenarios (List):
+            List of (dam set, year, basin, path of a basin sketch) tuples.
+        path (string):
+            Output path (.npz), read with read_sketches().
+    """
+    sketches = [read_sketch(sketch_path) for _, _, _, sketch_path in scenarios]
+    labels = np.array([s[:3] for s in scenarios], dtype=str).reshape(-1, 3)
+    np.savez(path, dam_set=labels[:, 0], year=labels[:, 1], basin=labels[:, 2],
+             indptr=np.cumsum([0]+[len(s['bucket']) for s in sketches]),
+             bucket=np.concatenate([s['bucket'] for s in sketches] + [np.zeros(0, dtype=np.int64)]),
+             count=np.concatenate([s['count'] for s in sketches] + [np.zeros(0, dtype=np.int64)]),
+             **{k: np.array([s[k] for s in sketches]) for k in ['zeros', 'n', 'sum', 'min', 'max']})
+
+
+def read_sketches(path, dam_set=None, year=None, basin=None):
+    """Merges the sketches of the scenarios and basins asked for.
+
+    Example: CONUS fragment lengths of all dams in the 2012 scenario
+        quantile(read_sketches(path, dam_set='nabd', year='2012'), [0.5, 0.9])
+
+    Parameters:
+        path (string):
+            File written by combine_sketches().
+        dam_set, year, basin (string or list, optional):
+            Values to keep, all values if None.
+
+    Returns:
+        sketch (dict): Merged sketch (see make_sketch()).
+    """
+    with np.load(path) as data:
+        keep = np.ones(len(data['n']), dtype=bool)
+        for key, values in [('dam_set', dam_set), ('year', year), ('basin', basin)]:
+            if values is not None:
+                keep &= np.isin(data[key], [str(v) for v in np.atleast_1d(values)])
+        indptr = data['indptr']
+        sketches = [{'bucket': data['bucket'][indptr[i]:indptr[i+1]], 'count': data['count'][indptr[i]:indptr[i+1]],
+                     **{k: data[k][i].item() for k in ['zeros', 'n', 'sum', 'min', 'max']}}
+                    for i in np.flatnonzero(keep)]
+
+    return merge_sketches(sketches)
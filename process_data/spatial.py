@@ -0,0 +1,300 @@
+import numpy as np, pandas as pd, geopandas as gp, shapely, os, json
+
+# Number of children of every node of the packed R-tree
+node_size = 16
+
+
+def hilbert_order(bounds, extent, bits=16):
+    """Orders boxes along a Hilbert curve through their centers.
+
+    Parameters:
+        bounds (numpy.ndarray):
+            Boxes as rows of (minx, miny, maxx, maxy).
+        extent (tuple):
+            (minx, miny, maxx, maxy) of all of the boxes.
+        bits (int, optional):
+            Bits of the grid the centers are snapped to along each axis.
+
+    Returns:
+        order (numpy.ndarray): Positions of the boxes in Hilbert order.
+    """
+    side = 2**bits - 1
+    size = np.maximum([extent[2]-extent[0], extent[3]-extent[1]], 1e-12)
+    x = (((bounds[:, 0]+bounds[:, 2])/2 - extent[0]) / size[0] * side).astype(np.int64)
+    y = (((bounds[:, 1]+bounds[:, 3])/2 - extent[1]) / size[1] * side).astype(np.int64)
+
+    # Distance along the curve, rotating the quadrants one bit at a time
+    d = np.zeros(len(bounds), dtype=np.int64)
+    s = 2**(bits-1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        flip = ~ry & rx
+        x = np.where(flip, side - x, x)
+        y = np.where(flip, side - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s //= 2
+
+    return np.argsort(d, kind='stable')
+
+
+def _pack(bounds):
+    # Boxes of every level of a packed R-tree, leaves first. Node j of a level
+    # holds the boxes j*node_size to (j+1)*node_size-1 of the level below it
+    levels = [bounds]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        starts = np.arange(0, len(below), node_size)
+        levels.append(np.column_stack([np.minimum.reduceat(below[:, 0], starts),
+                                       np.minimum.reduceat(below[:, 1], starts),
+                                       np.maximum.reduceat(below[:, 2], starts),
+                                       np.maximum.reduceat(below[:, 3], starts)]))
+    return levels
+
+
+def write_layer(folder, layer, geometries, attrs):
+    """Writes a layer of geometries and attributes with a packed R-tree.
+
+    The rows are sorted along a Hilbert curve, so features that are close
+    together are stored together, and the R-tree is packed bottom up from
+    their bounding boxes. Attribute columns are saved as numpy arrays and the
+    geometries as WKB in one binary file, so a query only reads the rows
+    inside its window from disk.
+
+    Parameters:
+        folder (string):
+            Folder of the spatial index.
+        layer (string):
+            Name of the layer (e.g. 'segments').
+        geometries (numpy.ndarray):
+            Shapely geometries of the rows.
+        attrs (pandas.DataFrame):
+            Attributes of the rows, only the numeric columns are saved.
+
+    Returns:
+        meta (dict): Number of rows, level offsets in the tree, attribute
+            columns and bounds of the layer (None if it is empty).
+    """
+    bounds = shapely.bounds(geometries).reshape(-1, 4)
+    if len(bounds):
+        bounds = np.where(np.isnan(bounds), np.nan_to_num(np.nanmean(bounds, axis=0)), bounds)
+        extent = (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+        order = hilbert_order(bounds, extent)
+    else:
+        # An empty layer has no extent and an empty tree
+        extent, order = None, np.zeros(0, dtype=np.int64)
+
+    levels = _pack(bounds[order])
+    np.save(os.path.join(folder, layer+'_tree.npy'), np.concatenate(levels))
+
+    wkb = shapely.to_wkb(geometries[order])
+    offsets = np.zeros(len(wkb)+1, dtype=np.int64)
+    np.cumsum([len(w) for w in wkb], out=offsets[1:])
+    with open(os.path.join(folder, layer+'_wkb.bin'), 'wb') as f:
+        f.write(b''.join(wkb))
+    np.save(os.path.join(folder, layer+'_wkb_offsets.npy'), offsets)
+
+    columns = []
+    for col in attrs.columns:
+        if attrs[col].dtype.kind in 'biuf':
+            np.save(os.path.join(folder, layer+'_attr_'+col+'.npy'), attrs[col].values[order])
+            columns.append(col)
+
+    return {'n': len(order), 'levels': np.cumsum([0]+[len(l) for l in levels]).tolist(),
+            'attrs': columns, 'bounds': [float(b) for b in extent] if extent else None}
+
+
+def fragment_geometry(segmentsGeo, frag_ids):
+    """Collects the segment lines of every fragment into a multi line string.
+
+    Parameters:
+        segmentsGeo (geopandas.GeoDataFrame):
+            Segments with their Frag ID and line geometry.
+        frag_ids (numpy.ndarray):
+            Sorted IDs of the fragments.
+
+    Returns:
+        geometries (numpy.ndarray): Geometry of every fragment in frag_ids.
+    """
+    parts, part_of = shapely.get_parts(segmentsGeo.geometry.values, return_index=True)
+    frag = np.searchsorted(frag_ids, segmentsGeo['Frag'].values[part_of])
+    order = np.argsort(frag, kind='stable')
+    geometries = np.full(len(frag_ids), None, dtype=object)
+    lines = shapely.multilinestrings(parts[order], indices=frag[order])
+    geometries[:len(lines)] = lines
+
+    return geometries
+
+
+def write_index(segmentsGeo, fragments, folder):
+    """Writes the spatial index of the segments and fragments of a basin.
+
+    The folder is written like the fragment graph (see fraggraph.py), with a
+    segments and a fragments layer (see write_layer()) and an index.json
+    describing them. The geometry of a fragment is the multi line string of
+    its segments.
+
+    Parameters:
+        segmentsGeo (geopandas.GeoDataFrame):
+            Segments indexed by Hydroseq with their Frag ID and line geometry.
+        fragments (pandas.DataFrame):
+            Fragments from bifurcate.agg_by_frag() indexed by Frag ID.
+        folder (string):
+            Folder where the index is saved. It is created if needed.
+    """
+    os.makedirs(folder, exist_ok=True)
+    fragments = fragments.sort_index()
+    layers = {'segments': write_layer(folder, 'segments', segmentsGeo.geometry.values,
+                                      pd.DataFrame(segmentsGeo.drop(columns='geometry')).reset_index()),
+              'fragments': write_layer(folder, 'fragments',
+                                       fragment_geometry(segmentsGeo, fragments.index.values),
+                                       fragments.reset_index())}
+
+    with open(os.path.join(folder, 'index.json'), 'w') as f:
+        json.dump({'node_size': node_size, 'layers': layers}, f)
+
+
+def load_index(folder):
+    """Opens a spatial index written by write_index().
+
+    The arrays are memory mapped, so opening an index reads almost nothing
+    and a query only pages in the nodes and rows it visits.
+
+    Returns:
+        index (dict): The index.json metadata with the memory mapped tree,
+            attribute and WKB arrays of every layer.
+    """
+    with open(os.path.join(folder, 'index.json')) as f:
+        index = json.load(f)
+    for layer, meta in index['layers'].items():
+        meta['tree'] = np.load(os.path.join(folder, layer+'_tree.npy'), mmap_mode='r')
+        meta['offsets'] = np.load(os.path.join(folder, layer+'_wkb_offsets.npy'), mmap_mode='r')
+        meta['wkb'] = np.memmap(os.path.join(folder, layer+'_wkb.bin'), dtype=np.uint8, mode='r') \
+            if meta['offsets'][-1] > 0 else np.zeros(0, dtype=np.uint8)
+        meta['attr'] = {col: np.load(os.path.join(folder, layer+'_attr_'+col+'.npy'), mmap_mode='r')
+                        for col in meta['attrs']}
+
+    return index
+
+
+def _window(window):
+    # Bounding box and exact geometry (None for a box) of a query window
+    if isinstance(window, (gp.GeoDataFrame, gp.GeoSeries)):
+        window = window.union_all()
+    if isinstance(window, shapely.Geometry):
+        shapely.prepare(window)
+        return shapely.bounds(window), window
+    return np.asarray(window, dtype=float), None
+
+
+def _overlaps(boxes, box):
+    return (boxes[:, 0] <= box[2]) & (boxes[:, 2] >= box[0]) & (boxes[:, 1] <= box[3]) & (boxes[:, 3] >= box[1])
+
+
+def search(meta, box, size=node_size):
+    """Finds the rows of a layer whose bounding box overlaps a box.
+
+    The tree is searched one level at a time from the root, keeping the
+    children of the nodes that overlap the box.
+
+    Returns:
+        rows (numpy.ndarray): Sorted row positions of the layer.
+    """
+    levels, tree = meta['levels'], meta['tree']
+    if meta['n'] == 0:
+        return np.zeros(0, dtype=np.int64)
+    nodes = np.arange(levels[-1]-levels[-2])
+    for level in range(len(levels)-2, -1, -1):
+        nodes = nodes[_overlaps(tree[levels[level]+nodes], box)]
+        if level == 0 or len(nodes) == 0:
+            break
+        children = (nodes[:, None]*size + np.arange(size)[None, :]).ravel()
+        nodes = children[children < levels[level]-levels[level-1]]
+
+    return np.sort(nodes)
+
+
+def read_geometry(meta, rows):
+    """Reads and decodes the WKB geometry of rows of a layer."""
+    offsets = np.asarray(meta['offsets'][np.append(rows, rows+1)]).reshape(2, -1)
+    wkb = meta['wkb']
+    return shapely.from_wkb(np.array([wkb[a:b].tobytes() for a, b in zip(offsets[0], offsets[1])], dtype=object))
+
+
+def query(index, window, layer='segments', columns=None, geometry=False):
+    """Finds the segments or fragments of a basin inside a query window.
+
+    Only the tree nodes and rows inside the window are read from disk. A
+    shapely geometry (e.g. a state or HUC8 polygon) is first searched by its
+    bounding box and the rows are then tested against the geometry itself.
+    Dams are the segments with DamID > 0.
+
+    Parameters:
+        index (dict):
+            Spatial index from load_index().
+        window (tuple or shapely geometry):
+            (minx, miny, maxx, maxy) box or geometry in the coordinates of the
+            segment geometry. A GeoDataFrame or GeoSeries is unioned.
+        layer (string, optional):
+            'segments' or 'fragments'.
+        columns (list, optional):
+            Attribute columns to read, all of them if None.
+        geometry (boolean, optional):
+            If True the geometries are read and a GeoDataFrame is returned.
+
+    Returns:
+        rows (pandas.DataFrame or geopandas.GeoDataFrame): Attributes (and
+            geometry) of the rows inside the window.
+    """
+    box, shape = _window(window)
+    meta = index['layers'][layer]
+    rows = search(meta, box, index['node_size'])
+
+    geoms = None
+    if shape is not None or geometry:
+        geoms = read_geometry(meta, rows)
+    if shape is not None:
+        keep = shapely.intersects(geoms, shape)
+        rows, geoms = rows[keep], geoms[keep]
+
+    found = pd.DataFrame({col: meta['attr'][col][rows] for col in (columns or meta['attrs'])})
+    if geometry:
+        found = gp.GeoDataFrame(found, geometry=geoms)
+
+    return found
+
+
+def query_basins(results_folder, basin_ls, year, window, layer='segments', columns=None, geometry=False):
+    """Queries the spatial indices of many basins of a scenario.
+
+    Basins whose bounds do not overlap the window are not searched.
+
+    Parameters:
+        results_folder (string):
+            Folder with the basin_spatial_year/ indices of the scenario.
+        basin_ls (List):
+            Basins to query.
+        year (string):
+            Scenario year.
+        window, layer, columns, geometry:
+            See query().
+
+    Returns:
+        rows (pandas.DataFrame or geopandas.GeoDataFrame): Rows of every
+            basin inside the window with a basin column.
+    """
+    box, _ = _window(window)
+    found = []
+    for basin in basin_ls:
+        index = load_index(results_folder+basin+'_spatial_'+year)
+        extent = index['layers'][layer]['bounds']
+        if extent is None or not _overlaps(np.array([extent]), box)[0]:
+            continue
+        rows = query(index, window, layer, columns, geometry)
+        rows.insert(0, 'basin', basin)
+        found.append(rows)
+    if not found:
+        return pd.DataFrame(columns=['basin']+list(columns or []))
+
+    return pd.concat(found, ignore_index=True)
@@ -0,0 +1,137 @@
+import numpy as np, pandas as pd, os
+
+# Tables kept in the store, the HUC index tables are named by their HUC level
+tables = ['segments', 'fragments', 'dams']
+
+
+def store_root(main_directory):
+    """Returns the folder of the results store, analyzed_data/store/."""
+    return main_directory+'analyzed_data/store/'
+
+
+def partition_path(root, table, dataset, year, basin):
+    """Path of a partition, <root>/<table>/dataset=<dataset>/year=<year>/basin=<basin>.npz"""
+    return os.path.join(root, table, 'dataset='+dataset, 'year='+str(year), 'basin='+basin+'.npz')
+
+
+def write_partition(frame, root, table, dataset, year, basin):
+    """Writes one partition of a table to the store.
+
+    Every column is saved as its own typed array in a compressed numpy file,
+    so a read only decompresses the columns it asks for. A named index is
+    saved as a column. Object columns are saved as strings. The partition is
+    written to a temporary file and moved into place.
+
+    Parameters:
+        frame (pandas.DataFrame):
+            Table of a single dataset, year and basin.
+        root (string):
+            Folder of the store (see store_root()).
+        table (string):
+            Name of the table (e.g. 'fragments' or 'HUC8').
+        dataset (string):
+            Dam set, 'nabd' or 'grand'.
+        year (string):
+            Scenario year.
+        basin (string):
+            Name of the basin.
+    """
+    if frame.index.name is not None:
+        frame = frame.reset_index()
+    arrays = {}
+    for col in frame.columns:
+        values = frame[col].values
+        arrays[str(col)] = values.astype(str) if values.dtype == object else values
+
+    path = partition_path(root, table, dataset, year, basin)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path+'.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _matches(name, key, values):
+    # Checks a partition folder or file name (key=value) against a filter
+    value = name[len(key)+1:].replace('.npz', '')
+    return values is None or value in values
+
+
+def partitions(root, table, dataset=None, year=None, basin=None):
+    """Lists the partitions of a table that match the filters.
+
+    Only the folders of the datasets and years asked for are listed, so
+    partitions that are filtered out are never opened.
+
+    Parameters:
+        root (string):
+            Folder of the store.
+        table (string):
+            Name of the table.
+        dataset, year, basin (string or list, optional):
+            Values to keep, all values if None.
+
+    Returns:
+        found (list): (dataset, year, basin, path) of every matching partition.
+    """
+    filters = [None if f is None else [str(v) for v in np.atleast_1d(f)] for f in [dataset, year, basin]]
+    found = []
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return found
+    for ds_dir in sorted(os.listdir(table_dir)):
+        if not _matches(ds_dir, 'dataset', filters[0]):
+            continue
+        for year_dir in sorted(os.listdir(os.path.join(table_dir, ds_dir))):
+            if not _matches(year_dir, 'year', filters[1]):
+                continue
+            folder = os.path.join(table_dir, ds_dir, year_dir)
+            for name in sorted(os.listdir(folder)):
+                if name.endswith('.npz') and _matches(name, 'basin', filters[2]):
+                    found.append((ds_dir[8:], year_dir[5:], name[6:-4], os.path.join(folder, name)))
+
+    return found
+
+
+def columns(root, table):
+    """Lists the columns of a table (from its first partition)."""
+    found = partitions(root, table)
+    if not found:
+        return []
+    with np.load(found[0][3]) as data:
+        return list(data.files)
+
+
+def read_table(root, table, columns=None, dataset=None, year=None, basin=None):
+    """Reads a table from the store, only the partitions and columns asked for.
+
+    Example: HUC8 indices for 1950 and 2012 in the Colorado basin
+        read_table(root, 'HUC8', ['HUC8', 'LENGTHKM_len', 'DOR_outlet'],
+                   dataset='nabd', year=['1950', '2012'], basin='Colorado')
+
+    Parameters:
+        root (string):
+            Folder of the store (see store_root()).
+        table (string):
+            Name of the table ('segments', 'fragments', 'dams' or a HUC level).
+        columns (list, optional):
+            Columns to read, all columns if None.
+        dataset, year, basin (string or list, optional):
+            Partitions to read, all partitions if None.
+
+    Returns:
+        frame (pandas.DataFrame): The rows of the partitions with the columns
+            asked for and dataset, year and basin columns.
+    """
+    frames = []
+    for ds, yr, bs, path in partitions(root, table, dataset, year, basin):
+        with np.load(path) as data:
+            frame = pd.DataFrame({col: data[col] for col in (columns or data.files)})
+        frame.insert(0, 'basin', bs)
+        frame.insert(0, 'year', yr)
+        frame.insert(0, 'dataset', ds)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['dataset', 'year', 'basin']+list(columns or []))
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,33 @@
+import os, sys
+import numpy as np, pandas as pd, pytest
+
+# The modules of process_data import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def random_network(rng, n, dam_share=0.25):
+    """Makes a random basin of n segments indexed by Hydroseq.
+
+    Every segment drains to a segment later in the list or leaves the basin
+    (DnHydroseq 0 or an ID outside of the basin), and about dam_share of the
+    segments have a dam with a unique DamID. Like the basin csvs of extract.py
+    it has a step column of zeros.
+    """
+    ids = rng.permutation(np.arange(1, n+1)) * 10
+    dn = np.zeros(n)
+    for i in range(n-1):
+        if rng.random() < 0.9:
+            dn[i] = ids[rng.integers(i+1, n)]
+        elif rng.random() < 0.5:
+            dn[i] = 99999
+    dam = np.where(rng.random(n) < dam_share, np.arange(1, n+1) * 7 + 1, 0)
+
+    return pd.DataFrame({'DnHydroseq': dn, 'UpHydroseq': 0, 'DamID': dam,
+                         'LENGTHKM': rng.random(n), 'QC_MA': rng.random(n) + 0.1,
+                         'Norm_stor': np.where(dam > 0, rng.random(n) * 100, 0.0),
+                         'DamCount': (dam > 0).astype(float), 'step': 0.0}, index=pd.Index(ids, name='Hydroseq'))
+
+
+@pytest.fixture
+def make_network():
+    return random_network
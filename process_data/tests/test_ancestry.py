@@ -0,0 +1,49 @@
+import numpy as np, pytest
+import ancestry as anc_mod
+
+
+def walk(segments, hydroseq):
+    # Brute force path from a segment to its outlet, one DnHydroseq at a time
+    path = [hydroseq]
+    while segments['DnHydroseq'].get(path[-1], 0) in segments.index:
+        path.append(int(segments['DnHydroseq'][path[-1]]))
+    return path
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_queries_match_path_walks(make_network, seed):
+    rng = np.random.default_rng(seed)
+    segments = make_network(rng, int(rng.integers(1, 50)))
+    anc = anc_mod.build_ancestry(segments)
+    ids = segments.index.values
+    nodes = anc_mod.node_index(anc, ids)
+    paths = {h: walk(segments, h) for h in ids}
+
+    up, down = np.repeat(nodes, len(ids)), np.tile(nodes, len(ids))
+    expected = [d in paths[u][1:] for u in ids for d in ids]
+    np.testing.assert_array_equal(anc_mod.is_upstream(anc, up, down), expected)
+
+    indptr, dam_id, _ = anc_mod.upstream_dams(anc, nodes)
+    for i, h in enumerate(ids):
+        dams = segments.loc[[u for u in ids if h in paths[u]], 'DamID']
+        assert sorted(dam_id[indptr[i]:indptr[i+1]]) == sorted(dams[dams > 0])
+
+    indptr, path = anc_mod.downstream_path(anc, nodes)
+    for i, h in enumerate(ids):
+        assert list(path[indptr[i]:indptr[i+1]]) == paths[h]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_confluence_matches_path_walks(make_network, seed):
+    rng = np.random.default_rng(seed)
+    segments = make_network(rng, int(rng.integers(1, 50)))
+    anc = anc_mod.build_ancestry(segments)
+    ids = segments.index.values
+    a, b = rng.choice(ids, 30), rng.choice(ids, 30)
+
+    expected = []
+    for u, v in zip(a, b):
+        shared = [h for h in walk(segments, u) if h in walk(segments, v)]
+        expected.append(anc_mod.node_index(anc, shared[0])[0] if shared else -1)
+    found = anc_mod.confluence(anc, anc_mod.node_index(anc, a), anc_mod.node_index(anc, b))
+    np.testing.assert_array_equal(found, expected)
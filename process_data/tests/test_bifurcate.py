@@ -0,0 +1,40 @@
+import numpy as np, pytest
+import bifurcate as bfc
+
+# make_fragments() and upstream_ag() use DataFrame.append and chained assignment
+pytestmark = pytest.mark.filterwarnings('ignore')
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_upstream_sum_matches_upstream_ag(make_network, seed):
+    rng = np.random.default_rng(seed)
+    segments = make_network(rng, int(rng.integers(1, 60)))
+    segments['DamCount'] = segments['DamCount'].astype(np.int64)
+    dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+
+    expected = bfc.upstream_ag(segments, 'DnHydroseq', ['LENGTHKM', 'DamCount'])
+    found = bfc.upstream_sum(segments, dn_pos, levels, ['LENGTHKM', 'DamCount'])
+    for col in ['LENGTHKM_up', 'DamCount_up', 'upstream_count']:
+        np.testing.assert_allclose(found[col].values, expected[col].values)
+        assert found[col].dtype == expected[col].dtype
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_label_fragments_matches_make_fragments(make_network, seed):
+    rng = np.random.default_rng(seed)
+    segments = make_network(rng, int(rng.integers(1, 60)))
+    dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+
+    expected = bfc.make_fragments(segments.copy())
+    found = bfc.label_fragments(segments.copy(), dn_pos, levels)
+    for col in ['Frag', 'Headwater', 'FragEnd', 'step', 'Frag_Index']:
+        np.testing.assert_array_equal(found[col].values.astype(float), expected[col].values.astype(float))
+
+
+def test_label_fragments_numbers_exits_from_exit_id(make_network):
+    segments = make_network(np.random.default_rng(0), 30, dam_share=0)
+    dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+    found = bfc.label_fragments(segments.copy(), dn_pos, levels, exit_id=52000)
+
+    exits = found.loc[found['FragEnd'] == 1, 'Frag']
+    assert sorted(exits) == list(range(52001, 52001 + len(exits)))
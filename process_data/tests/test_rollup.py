@@ -0,0 +1,62 @@
+import numpy as np, pandas as pd, pytest
+import bifurcate as bfc, regulate as reg, rollup
+
+# make_fragments() and agg_by_frag() use DataFrame.append and chained assignment
+pytestmark = pytest.mark.filterwarnings('ignore')
+
+dor_thresholds = (0.02, 0.1, 1.0)
+
+
+def basin(make_network, rng, n):
+    # Random basin with REACHCODEs in a few HUCs, run through the workflow steps
+    segments = make_network(rng, n)
+    segments['REACHCODE'] = (rng.choice([10, 11, 17], n) * 10**12 + rng.integers(1, 3, n) * 10**10
+                             + rng.integers(1, 3, n) * 10**6 + rng.integers(0, 999999, n))
+    for huc in ['HUC2', 'HUC4', 'HUC8']:
+        segments[huc] = np.floor(segments['REACHCODE'] / 10**(14-rollup.huc_digits(huc)))
+    up = bfc.upstream_ag(segments, 'DnHydroseq', ['LENGTHKM', 'Norm_stor', 'DamCount'])
+    for col in ['LENGTHKM_up', 'Norm_stor_up', 'DamCount_up']:
+        segments[col] = up[col]
+    segments['DOR'] = segments['Norm_stor_up'] / segments['QC_MA']
+    segments = bfc.make_fragments(segments)
+    dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+    segments = bfc.longest_path(segments, dn_pos, levels)
+
+    return segments, bfc.agg_by_frag(segments)
+
+
+def pivot_summary(segments, fragments, huc):
+    # HUC summary built with the pivot tables the workflow used before rollup.py
+    summary = segments.pivot_table(values=['Norm_stor', 'DamCount', 'LENGTHKM'], index=huc,
+                                   aggfunc={'Norm_stor': (np.sum, np.max), 'DamCount': np.sum,
+                                            'LENGTHKM': np.sum})
+    summary.columns = ["_".join((i, j)) for i, j in summary.columns]
+    summaryf = fragments.pivot_table(values=['LENGTHKM', 'LongPathKM', 'MainstemKM'], index=huc,
+                                     aggfunc={'LENGTHKM': (np.mean, len, np.max),
+                                              'LongPathKM': (np.mean, np.max), 'MainstemKM': np.mean})
+    summaryf.columns = ["_".join((i, j)) for i, j in summaryf.columns]
+    summary = pd.concat([summary, summaryf], axis=1)
+    summary = summary.join(reg.regulated_length(segments, huc, dor_thresholds))
+
+    summary['seg_outlet'] = segments.groupby(huc).LENGTHKM_up.idxmax()
+    outlet_vals = segments.loc[summary.seg_outlet, rollup.outlet_cols]
+    summary = summary.join(outlet_vals, on='seg_outlet', rsuffix='_outlet')
+    summary = summary.rename(columns={col: col+'_outlet' for col in rollup.outlet_cols})
+
+    return summary
+
+
+@pytest.mark.parametrize('seed', range(15))
+def test_rollup_matches_pivot_tables(make_network, seed):
+    rng = np.random.default_rng(seed)
+    segments, fragments = basin(make_network, rng, int(rng.integers(2, 80)))
+    summaries = rollup.huc_rollup(segments, fragments, ('HUC2', 'HUC4', 'HUC8'), dor_thresholds)
+
+    for huc in ['HUC2', 'HUC4', 'HUC8']:
+        expected = pivot_summary(segments, fragments, huc)
+        found = summaries[huc]
+        assert list(found.index) == list(expected.index)
+        assert set(found.columns) == set(expected.columns)
+        for col in expected.columns:
+            np.testing.assert_allclose(found[col].values.astype(float), expected[col].values.astype(float),
+                                       err_msg=huc+' '+col)
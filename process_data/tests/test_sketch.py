@@ -0,0 +1,37 @@
+import numpy as np, pytest
+import sketch as sk
+
+
+def random_lengths(rng, n):
+    # Fragment-like lengths (km) spanning several orders of magnitude
+    return rng.lognormal(2, 2, n)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_quantiles_within_relative_accuracy(seed):
+    rng = np.random.default_rng(seed)
+    values = random_lengths(rng, int(rng.integers(1, 5000)))
+    q = np.linspace(0, 1, 101)
+
+    expected = np.quantile(values, q, method='lower')
+    found = sk.quantile(sk.make_sketch(values), q)
+    np.testing.assert_allclose(found, expected, rtol=sk.relative_accuracy)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_merge_is_sketch_of_all_values(seed):
+    rng = np.random.default_rng(seed)
+    parts = [random_lengths(rng, int(rng.integers(0, 1000))) for _ in range(4)]
+    parts[0][:3] = [0.0, sk.min_length / 2, np.nan]
+
+    merged = sk.merge_sketches([sk.make_sketch(part) for part in parts])
+    expected = sk.make_sketch(np.concatenate(parts))
+    for key in ['bucket', 'count', 'zeros', 'n', 'min', 'max']:
+        np.testing.assert_array_equal(merged[key], expected[key])
+    np.testing.assert_allclose(merged['sum'], expected['sum'])
+
+
+def test_empty_sketch():
+    sketch = sk.merge_sketches([sk.make_sketch([]), sk.make_sketch([np.nan])])
+    assert sketch['n'] == 0
+    assert np.isnan(sk.quantile(sketch, 0.5))
@@ -0,0 +1,60 @@
+import numpy as np, pandas as pd, geopandas as gp, shapely, pytest
+import spatial as sp
+
+
+def random_lines(rng, n):
+    # Short random lines with a Frag ID, indexed by Hydroseq like segmentsGeo
+    start = rng.random((n, 2)) * 100
+    end = start + rng.normal(0, 2, (n, 2))
+    lines = shapely.linestrings(np.stack([start, end], axis=1))
+    return gp.GeoDataFrame({'Frag': rng.integers(1, n//10 + 2, n), 'LENGTHKM': rng.random(n)},
+                           geometry=lines, index=pd.Index(np.arange(1, n+1) * 10, name='Hydroseq'))
+
+
+def write_random_index(rng, folder, n):
+    segmentsGeo = random_lines(rng, n)
+    fragments = segmentsGeo.groupby('Frag')[['LENGTHKM']].sum()
+    sp.write_index(segmentsGeo, fragments, str(folder))
+    return segmentsGeo, sp.load_index(str(folder))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_box_query_matches_brute_force(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    segmentsGeo, index = write_random_index(rng, tmp_path, 600)
+    bounds = shapely.bounds(segmentsGeo.geometry.values)
+
+    for _ in range(20):
+        x, y = rng.random(2) * 100
+        box = (x, y, x + rng.random() * 30, y + rng.random() * 30)
+        expected = segmentsGeo.index.values[sp._overlaps(bounds, box)]
+        found = sp.query(index, box, columns=['Hydroseq'])['Hydroseq'].values
+        np.testing.assert_array_equal(np.sort(found), expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_geometry_query_matches_brute_force(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    segmentsGeo, index = write_random_index(rng, tmp_path, 600)
+    frag_geoms = segmentsGeo.dissolve('Frag').geometry
+
+    for _ in range(10):
+        window = shapely.Point(rng.random(2) * 100).buffer(rng.random() * 20)
+        expected = segmentsGeo.index.values[shapely.intersects(segmentsGeo.geometry.values, window)]
+        found = sp.query(index, window, columns=['Hydroseq'])['Hydroseq'].values
+        np.testing.assert_array_equal(np.sort(found), expected)
+
+        expected = frag_geoms.index.values[shapely.intersects(frag_geoms.values, window)]
+        found = sp.query(index, window, layer='fragments', columns=['Frag'])['Frag'].values
+        np.testing.assert_array_equal(np.sort(found), expected)
+
+
+def test_empty_layer_is_skipped(tmp_path):
+    segmentsGeo = random_lines(np.random.default_rng(0), 0)
+    sp.write_index(segmentsGeo, pd.DataFrame({'LENGTHKM': []}, index=pd.Index([], name='Frag')),
+                   str(tmp_path / 'Red_spatial_2012'))
+    index = sp.load_index(str(tmp_path / 'Red_spatial_2012'))
+
+    assert index['layers']['segments']['bounds'] is None
+    assert len(sp.query(index, (0, 0, 100, 100))) == 0
+    assert len(sp.query_basins(str(tmp_path) + '/', ['Red'], '2012', (0, 0, 100, 100))) == 0
@@ -0,0 +1,415 @@
+import numpy as np, shapely, sqlite3, gzip, json, os
+from concurrent.futures import ProcessPoolExecutor
+import spatial, cache
+
+# Zoom levels of the tile pyramid and the smallest stream order drawn at each zoom
+zoom_stream_order = {3: 7, 4: 6, 5: 6, 6: 5, 7: 4, 8: 3, 9: 2, 10: 1}
+
+# Tile size (in tile units) and the buffer drawn around every tile
+extent = 4096
+tile_buffer = 64
+
+# Attributes embedded in the segment and fragment layers
+segment_attrs = ['Hydroseq', 'Frag', 'DOR', 'HUC8', 'StreamOrde', 'DamID']
+fragment_attrs = ['Frag', 'LENGTHKM', 'DOR', 'HUC8', 'FragEnd']
+
+# Folder (inside a results folder) where the tiles of every basin are kept
+tile_dir = '.tiles/'
+
+
+def world_xy(lon, lat):
+    """Projects longitude and latitude to web mercator, scaled to [0, 1]
+    with y increasing to the south like the tile rows."""
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    return (np.asarray(lon) + 180) / 360, (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2
+
+
+def _project(geometries):
+    return shapely.transform(geometries, lambda c: np.column_stack(world_xy(c[:, 0], c[:, 1])))
+
+
+def _zigzag(values):
+    return ((values << 1) ^ (values >> 63)).astype(np.uint32)
+
+
+def tile_features(geometries, zoom):
+    """Cuts projected lines into the tiles of a zoom level and encodes them.
+
+    Every line is repeated for the tiles its bounding box (with the tile
+    buffer) covers, moved to the tile's coordinates and clipped to the
+    buffered tile in one vectorized call. The clipped lines are snapped to
+    the tile grid and encoded as vector tile geometry commands (a MoveTo and
+    a LineTo for every part, with zigzag encoded steps).
+
+    Parameters:
+        geometries (numpy.ndarray):
+            Lines projected with world_xy().
+        zoom (int):
+            Zoom level.
+
+    Returns:
+        tile (numpy.ndarray): Tile code of every feature (see tile_code()).
+        feature (numpy.ndarray): Position in geometries of every feature.
+        indptr, commands (numpy.ndarray): The geometry commands of feature i are
+            commands[indptr[i]:indptr[i+1]] (CSR format).
+    """
+    n = 2**zoom
+    buffer = tile_buffer / extent
+    bounds = shapely.bounds(geometries)
+    valid = ~np.isnan(bounds[:, 0])
+    x0 = np.clip(np.floor((bounds[:, 0] - buffer/n) * n), 0, n-1).astype(np.int64)
+    x1 = np.clip(np.floor((bounds[:, 2] + buffer/n) * n), 0, n-1).astype(np.int64)
+    y0 = np.clip(np.floor((bounds[:, 1] - buffer/n) * n), 0, n-1).astype(np.int64)
+    y1 = np.clip(np.floor((bounds[:, 3] + buffer/n) * n), 0, n-1).astype(np.int64)
+
+    # One (feature, tile) pair for every tile a bounding box covers
+    ny = np.where(valid, y1 - y0 + 1, 0)
+    counts = np.where(valid, (x1 - x0 + 1) * ny, 0)
+    feature = np.repeat(np.arange(len(geometries)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tx = x0[feature] + k // ny[feature]
+    ty = y0[feature] + k % ny[feature]
+
+    # Tile coordinates of every pair and clipping to the buffered tile
+    pairs = geometries[feature]
+    shift = np.repeat(np.column_stack([tx, ty]), shapely.get_num_coordinates(pairs), axis=0)
+    local = shapely.transform(pairs, lambda c: (c * n - shift) * extent)
+    clipped = shapely.clip_by_rect(local, -tile_buffer, -tile_buffer, extent+tile_buffer, extent+tile_buffer)
+
+    # Snap to the grid, dropping repeated points and parts of a single point
+    parts, part_pair = shapely.get_parts(clipped, return_index=True)
+    is_line = shapely.get_type_id(parts) == 1
+    parts, part_pair = parts[is_line], part_pair[is_line]
+    coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+    coords = np.rint(coords).astype(np.int64)
+    new_part = np.r_[True, coord_part[1:] != coord_part[:-1]][:len(coords)]
+    keep = new_part | np.r_[True, (coords[1:] != coords[:-1]).any(axis=1)][:len(coords)]
+    coords, coord_part = coords[keep], coord_part[keep]
+    part_len = np.bincount(coord_part, minlength=len(parts))
+    keep = part_len[coord_part] >= 2
+    coords, coord_part = coords[keep], coord_part[keep]
+    used = np.flatnonzero(part_len >= 2)
+    part_len = part_len[used]
+    coord_pair = part_pair[coord_part]
+
+    # Steps from the previous point of the same feature (the cursor starts
+    # at 0 for every feature and carries over between its parts)
+    new_pair = np.r_[True, coord_pair[1:] != coord_pair[:-1]][:len(coords)]
+    steps = np.diff(np.vstack([[0, 0], coords]), axis=0)
+    steps[new_pair] = coords[new_pair]
+    zz = _zigzag(steps)
+
+    # Commands of every part: MoveTo(1), x, y, LineTo(len-1), x, y, ...
+    start = np.cumsum(2*part_len + 2) - (2*part_len + 2)
+    commands = np.zeros((2*part_len + 2).sum(), dtype=np.uint32)
+    commands[start] = 9
+    commands[start + 3] = 2 | ((part_len - 1) << 3)
+    k = np.arange(len(coords)) - np.repeat(np.cumsum(part_len) - part_len, part_len)
+    pos = np.repeat(start, part_len) + 1 + 2*k + (k >= 1)
+    commands[pos], commands[pos + 1] = zz[:, 0], zz[:, 1]
+
+    # Features are the pairs with at least one part left
+    pair_of_part = part_pair[used]
+    pairs_kept, first = np.unique(pair_of_part, return_index=True)
+    sizes = np.add.reduceat(2*part_len + 2, first) if len(first) else np.zeros(0, dtype=np.int64)
+    indptr = np.zeros(len(pairs_kept)+1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+
+    return tile_code(zoom, tx[pairs_kept], ty[pairs_kept]), feature[pairs_kept], indptr, commands
+
+
+def tile_code(zoom, x, y):
+    """Packs a zoom level and tile column and row into one integer."""
+    return (np.int64(zoom) << 58) | (np.asarray(x, dtype=np.int64) << 29) | np.asarray(y, dtype=np.int64)
+
+
+def tile_zxy(code):
+    """Unpacks tile codes into zoom levels, columns and rows."""
+    code = np.asarray(code, dtype=np.int64)
+    return code >> 58, (code >> 29) & (2**29-1), code & (2**29-1)
+
+
+def cut_basin(folder, zoom):
+    """Cuts the segments and fragments of a basin into the tiles of a zoom level.
+
+    The segments with a stream order below zoom_stream_order[zoom] are left
+    out and every segment is simplified to the size of a tile unit with
+    topology preserving Douglas-Peucker, which keeps the end points of every
+    segment so the network stays connected. A fragment is drawn as the line
+    merged segments of it that are drawn at the zoom level.
+
+    Parameters:
+        folder (string):
+            Spatial index of the basin (see spatial.py).
+        zoom (int):
+            Zoom level.
+
+    Returns:
+        layers (dict): Tile codes, geometry commands (CSR) and attributes of
+            the features of the 'segments' and 'fragments' layers.
+    """
+    index = spatial.load_index(folder)
+    seg, frag = index['layers']['segments'], index['layers']['fragments']
+    rows = np.flatnonzero(np.asarray(seg['attr']['StreamOrde']) >= zoom_stream_order[zoom])
+    lines = shapely.simplify(_project(spatial.read_geometry(seg, rows)), 1 / (extent * 2**zoom),
+                             preserve_topology=True)
+
+    # Fragments from the segments drawn at this zoom
+    frag_ids = np.asarray(seg['attr']['Frag'])[rows]
+    by_frag = np.argsort(frag_ids, kind='stable')
+    ids, group = np.unique(frag_ids[by_frag], return_inverse=True)
+    parts, part_of = shapely.get_parts(lines[by_frag], return_index=True)
+    frag_lines = np.full(len(ids), None, dtype=object)
+    if len(parts):
+        merged = shapely.line_merge(shapely.multilinestrings(parts, indices=group[part_of]))
+        frag_lines[:len(merged)] = merged
+    frag_pos = np.argsort(np.asarray(frag['attr']['Frag']))
+    frag_rows = frag_pos[np.searchsorted(np.asarray(frag['attr']['Frag'])[frag_pos], ids)]
+
+    layers = {}
+    for name, geoms, meta, attr_rows, attrs in [('segments', lines, seg, rows, segment_attrs),
+                                                ('fragments', frag_lines, frag, frag_rows, fragment_attrs)]:
+        tile, feature, indptr, commands = tile_features(geoms, zoom)
+        layers[name] = {'tile': tile, 'indptr': indptr, 'commands': commands}
+        for col in attrs:
+            layers[name]['attr_'+col] = np.asarray(meta['attr'][col])[attr_rows][feature].astype(np.float64)
+
+    return layers
+
+
+def _varints(values):
+    # Protocol buffer varints of unsigned integers and the bytes of each
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7f)).astype(np.uint8)
+    nbytes = np.maximum(1, 10 - np.argmax(groups[:, ::-1] > 0, axis=1))
+    nbytes = np.where((groups > 0).any(axis=1), nbytes, 1)
+    groups[np.arange(10)[None, :] < (nbytes[:, None] - 1)] |= 0x80
+    return groups[np.arange(10)[None, :] < nbytes[:, None]].tobytes(), nbytes
+
+
+def _field(number, payload):
+    # Length delimited protocol buffer field
+    return _varints([number << 3 | 2])[0] + _varints([len(payload)])[0] + payload
+
+
+def encode_layer(name, layer, start, stop):
+    """Encodes features start to stop of a layer as a vector tile layer.
+
+    Parameters:
+        name (string):
+            Name of the layer.
+        layer (dict):
+            Tile codes, geometry commands and attributes from cut_basin().
+        start, stop (int):
+            Range of the features of one tile.
+
+    Returns:
+        message (bytes): The layer message of the Mapbox vector tile format.
+    """
+    attrs = [col for col in layer if col.startswith('attr_')]
+    keys, tags = [], []
+    values = b''
+    offset = 0
+    for i, col in enumerate(attrs):
+        unique, inverse = np.unique(layer[col][start:stop], return_inverse=True)
+        keep = ~np.isnan(unique)
+        index = np.cumsum(keep) - 1 + offset
+        tags.append(np.where(keep[inverse], index[inverse], -1))
+        values += b''.join(_field(4, b'\x19' + v.astype('<f8').tobytes()) for v in unique[keep])
+        keys.append(_field(3, col[5:].encode()))
+        offset += keep.sum()
+    tags = np.column_stack([np.column_stack([np.full(len(t), i), t]) for i, t in enumerate(tags)]) \
+        if tags else np.zeros((stop-start, 0), dtype=np.int64)
+
+    indptr, commands = layer['indptr'], layer['commands']
+    geom_bytes, geom_len = _varints(commands[indptr[start]:indptr[stop]])
+    geom_off = np.r_[0, np.cumsum(geom_len)]
+    features = []
+    for f in range(stop - start):
+        pairs = tags[f].reshape(-1, 2)
+        pairs = pairs[pairs[:, 1] >= 0].ravel()
+        a, b = geom_off[indptr[start+f]-indptr[start]], geom_off[indptr[start+f+1]-indptr[start]]
+        features.append(_field(2, _field(2, _varints(pairs)[0]) + b'\x18\x02' + _field(4, geom_bytes[a:b])))
+
+    return _field(3, b'\x78\x02' + _field(1, name.encode()) + b''.join(features) + b''.join(keys)
+                  + values + b'\x28' + _varints([extent])[0])
+
+
+def _encode_tiles(layers):
+    # Encodes and compresses every tile of sorted layer features
+    codes = np.unique(np.concatenate([layer['tile'] for layer in layers.values()]))
+    ranges = {name: (np.searchsorted(layer['tile'], codes, 'left'), np.searchsorted(layer['tile'], codes, 'right'))
+              for name, layer in layers.items()}
+    tiles = []
+    for i, code in enumerate(codes):
+        data = b''.join(encode_layer(name, layer, ranges[name][0][i], ranges[name][1][i])
+                        for name, layer in layers.items() if ranges[name][1][i] > ranges[name][0][i])
+        tiles.append((int(code), gzip.compress(data)))
+
+    return tiles
+
+
+def _select(layer, keep):
+    # Features of a layer where keep is True
+    counts = np.diff(layer['indptr'])
+    selected = {col: values[keep] for col, values in layer.items() if col not in ['indptr', 'commands']}
+    selected['commands'] = layer['commands'][np.repeat(keep, counts)]
+    selected['indptr'] = np.r_[0, np.cumsum(counts[keep])]
+    return selected
+
+
+def _concat(layers):
+    # Stacks the features of many basins and sorts them by tile
+    if not layers:
+        return None
+    stacked = {col: np.concatenate([layer[col] for layer in layers]) for col in layers[0] if col != 'indptr'}
+    counts = np.concatenate([np.diff(layer['indptr']) for layer in layers])
+    order = np.argsort(stacked['tile'], kind='stable')
+    starts = np.cumsum(counts) - counts
+    stacked['commands'] = stacked['commands'][np.repeat(starts[order], counts[order])
+                                              + np.arange(counts.sum()) - np.repeat(np.cumsum(counts[order]) - counts[order], counts[order])]
+    stacked = {col: (values if col == 'commands' else values[order]) for col, values in stacked.items()}
+    stacked['indptr'] = np.r_[0, np.cumsum(counts[order])]
+    return stacked
+
+
+def _load_cache(path):
+    with np.load(path) as data:
+        cached = {'key': str(data['key']), 'layers': {}}
+        for name in ['segments', 'fragments']:
+            cached['layers'][name] = {k[len(name)+1:]: data[k] for k in data.files if k.startswith(name+'_')}
+    return cached
+
+
+def build_tiles(basin_ls, results_folder, year, path, n_workers=1):
+    """Builds a vector tile pyramid (MBTiles) of the segments and fragments of a scenario.
+
+    The tiles of every basin are cut from its spatial index (see spatial.py)
+    for every zoom level in zoom_stream_order and kept in the .tiles/ folder
+    of the results folder. Only basins whose spatial index, tile settings or
+    code changed are cut again, and if the MBTiles file was built with the
+    same settings only the tiles those basins touch are encoded again. The
+    (basin, zoom) cuts and the tile encoding are run by a process pool with
+    more than one worker. Tiles hold a 'segments' and a 'fragments' layer
+    in the Mapbox vector tile format, gzip compressed, with the attributes in
+    segment_attrs and fragment_attrs.
+
+    Parameters:
+        basin_ls (List):
+            Basins of the scenario.
+        results_folder (string):
+            Folder with the basin_spatial_year/ indices of the scenario.
+        year (string):
+            Scenario year.
+        path (string):
+            Output MBTiles file.
+        n_workers (int, optional):
+            Number of worker processes, 1 from worker processes of a pool
+            (e.g. the stages of pipeline.run_pipeline()).
+    """
+    settings = {'zooms': zoom_stream_order, 'extent': extent, 'buffer': tile_buffer,
+                'segments': segment_attrs, 'fragments': fragment_attrs}
+    settings_key = cache.stage_key(settings, code=['tiles', 'spatial'])
+    os.makedirs(results_folder+tile_dir, exist_ok=True)
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+
+    try:
+        # Cut the basins that changed, one job per basin and zoom level
+        caches, touched, changed = {}, [], []
+        jobs = []
+        for basin in basin_ls:
+            folder = results_folder+basin+'_spatial_'+year
+            cache_path = results_folder+tile_dir+basin+'_'+year+'.npz'
+            key = cache.stage_key(settings, files=[folder+'/index.json'], code=['tiles', 'spatial'])
+            old = _load_cache(cache_path) if os.path.isfile(cache_path) else None
+            if old is not None and old['key'] == key:
+                caches[basin] = old['layers']
+                continue
+            if old is not None:
+                touched += [layer['tile'] for layer in old['layers'].values()]
+            changed.append(basin)
+            jobs += [(basin, key, cache_path, folder, zoom) for zoom in zoom_stream_order]
+
+        results = pool.map(cut_basin, [j[3] for j in jobs], [j[4] for j in jobs]) if pool else \
+            (cut_basin(j[3], j[4]) for j in jobs)
+        cuts = {}
+        for job, layers in zip(jobs, results):
+            cuts.setdefault(job[0], []).append(layers)
+            if len(cuts[job[0]]) == len(zoom_stream_order):
+                basin, key, cache_path = job[:3]
+                zooms = cuts.pop(basin)
+                caches[basin] = {name: _concat([c[name] for c in zooms]) for name in ['segments', 'fragments']}
+                arrays = {name+'_'+col: values for name, layer in caches[basin].items() for col, values in layer.items()}
+                np.savez(cache_path, key=np.array(key), **arrays)
+                touched += [layer['tile'] for layer in caches[basin].values()]
+        print('Cut tiles of', len(changed), 'of', len(basin_ls), 'basins')
+
+        # Encode every tile, or only the tiles of the basins that changed
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE IF NOT EXISTS metadata (name text, value text)')
+        db.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, tile_column integer, '
+                   'tile_row integer, tile_data blob)')
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        meta = dict(db.execute('SELECT name, value FROM metadata').fetchall())
+        full = meta.get('rivfrag_key') != settings_key or json.loads(meta.get('rivfrag_basins', '[]')) != list(basin_ls)
+        if full:
+            db.execute('DELETE FROM tiles')
+            codes = None
+        else:
+            codes = np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int64)
+
+        layers = {}
+        for name in ['segments', 'fragments']:
+            stacked = [caches[basin][name] for basin in basin_ls]
+            if codes is not None:
+                stacked = [_select(layer, np.isin(layer['tile'], codes)) for layer in stacked]
+            layers[name] = _concat(stacked)
+
+        all_codes = np.unique(np.concatenate([layer['tile'] for layer in layers.values()]))
+        if codes is not None:
+            z, x, y = tile_zxy(codes)
+            db.executemany('DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                           zip(z.tolist(), x.tolist(), (2**z - 1 - y).tolist()))
+
+        # Chunks of whole tiles for the workers
+        n_chunks = max(1, 4*n_workers) if pool else 1
+        cuts = np.unique(np.searchsorted(all_codes, np.quantile(all_codes, np.linspace(0, 1, n_chunks+1)[1:-1])
+                                                       if len(all_codes) else []))
+        bounds = np.r_[0, cuts, len(all_codes)].astype(np.int64)
+        chunks = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if b <= a:
+                continue
+            chunks.append({name: _select(layer, (layer['tile'] >= all_codes[a]) & (layer['tile'] <= all_codes[b-1]))
+                           for name, layer in layers.items()})
+        encoded = pool.map(_encode_tiles, chunks) if pool else map(_encode_tiles, chunks)
+        n_tiles = 0
+        for tiles in encoded:
+            z, x, y = tile_zxy([code for code, _ in tiles])
+            db.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                           zip(z.tolist(), x.tolist(), (2**z - 1 - y).tolist(), [data for _, data in tiles]))
+            n_tiles += len(tiles)
+
+        # Metadata of the MBTiles format and the settings the tiles were built with
+        extents = [spatial.load_index(results_folder+basin+'_spatial_'+year)['layers']['segments']['bounds']
+                   for basin in basin_ls]
+        extents = [e for e in extents if e is not None] or [[-180.0, -85.0, 180.0, 85.0]]
+        bounds = [min(e[0] for e in extents), min(e[1] for e in extents),
+                  max(e[2] for e in extents), max(e[3] for e in extents)]
+        layer_meta = [{'id': name, 'fields': {col: 'Number' for col in attrs}}
+                      for name, attrs in [('segments', segment_attrs), ('fragments', fragment_attrs)]]
+        meta = {'name': os.path.basename(path), 'format': 'pbf', 'type': 'overlay',
+                'minzoom': min(zoom_stream_order), 'maxzoom': max(zoom_stream_order),
+                'bounds': ','.join(str(b) for b in bounds),
+                'center': '%f,%f,%d' % ((bounds[0]+bounds[2])/2, (bounds[1]+bounds[3])/2, min(zoom_stream_order)),
+                'json': json.dumps({'vector_layers': layer_meta}),
+                'rivfrag_key': settings_key, 'rivfrag_basins': json.dumps(list(basin_ls))}
+        db.execute('DELETE FROM metadata')
+        db.executemany('INSERT INTO metadata VALUES (?, ?)', [(k, str(v)) for k, v in meta.items()])
+        db.commit()
+        db.close()
+        print('Encoded', n_tiles, 'tiles' + (' (full build)' if full else ''))
+    finally:
+        if pool:
+            pool.shutdown()
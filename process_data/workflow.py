@@ -0,0 +1,536 @@
+"""
+Functions to run the river fragmentation and regulation workflow for a
+matrix of scenarios (years x dam sets x basins).
+
+Created by: Laura Condon and Rachel Spinti
+"""
+import pandas as pd, numpy as np, geopandas as gp, bifurcate as bfc
+import regulate as reg, fraggraph as fg, lineage as lng, read, extract as ex
+import scheduler as sched, shared, cache, create_basin_csvs as cbc, writer as wr
+import checkpoint as ckpt, rollup, cube, geometry as geo, store as st, spatial, ancestry as anc, sketch as sk
+import datetime, os
+
+# Segment columns used by the workflow (the columns read from the basin csvs)
+segment_cols = ['Hydroseq', 'UpHydroseq', 'DnHydroseq',
+                'LENGTHKM', 'StartFlag', 'DamCount',
+                'Coordinates', 'DamID',  'QC_MA', 'Norm_stor',
+                'HUC2', 'HUC4', 'HUC8', 'StreamOrde', 'REACHCODE', 'Grand_flag']
+
+# HUC levels summarized in step 5, any of HUC2 to HUC12 in one pass (see rollup.py)
+huc_levels = ['HUC2', 'HUC4', 'HUC8']
+
+# Segment values summed by upstream area in step 2, and the ID after which the
+# fragments ending at a basin outlet are numbered in step 4
+upstream_cols = ['Norm_stor', 'DamCount', 'LENGTHKM', 'QC_MA']
+frag_exit_id = 52000
+
+# Formats of the segment and fragment geometry ('gpkg', 'parquet' and/or 'shp', see
+# geometry.py) and the processes used to decode and dissolve the WKT when basins
+# are run one at a time
+geometry_formats = ['gpkg']
+geometry_workers = 1
+
+
+def scenario_folder(main_directory, dam_set, year):
+    """Returns the results folder for a scenario.
+
+    Results are saved to analyzed_data/<dam_set>_analyzed/<year>/ under the
+    main directory.
+    """
+    return main_directory+'analyzed_data/'+dam_set+'_analyzed/'+str(year)+'/'
+
+
+def convert_units(segments):
+    """Converts the flow to MCM/yr and the storage to MCM and adds the line
+    widths used for graphing."""
+    segments.QC_MA = (segments.QC_MA * 365 * 24 * 3600 * 0.0283168)/(10**6) #QC_MA = Average flow in cfs 
+    segments.Norm_stor = (segments.Norm_stor * 1233.48)/(10**6) #Norm_stor =  normal storage in acre feet
+    segments["line_width"] = segments["StreamOrde"]/10  #for graphing high Stream Orders thicker than low orders
+    #for graphing DOR, so high Stream Orders are even thicker
+    segments["new_width2"] = np.where(segments["line_width"] < 0.5,
+                                      segments["line_width"]/2, segments["line_width"])
+
+    return segments
+
+
+def process_basin(segments, basin, year, results_folder, dor_thresholds=(0.02, 0.1, 1.0), skip=(),
+                  writer=None, checkpoint=None, store=None, n_workers=1):
+    """Runs the fragmentation and regulation analysis for a single basin.
+
+    This function takes the segments of a basin (as written to <basin>.csv by
+    extract.py) and runs the workflow steps: unit conversions, upstream 
+    aggregation, degree of regulation, fragments, HUC indices and the segment
+    geometry. All outputs are written to the results folder.
+
+    Parameters:
+        segments (pandas.DataFrame): 
+            Dataframe of basin segments indexed by Hydroseq with the columns in
+            segment_cols.
+        basin (string):
+            Name of the basin, used for the output file names.
+        year (string):
+            Scenario year, used for the output file names.
+        results_folder (string):
+            Folder where the outputs are saved.
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+        skip (list, optional):
+            Output stages that are already up to date and are not written again
+            ('fragments', 'huc' and/or 'geometry', see stage_outputs()).
+        writer (writer.BackgroundWriter, optional):
+            Writer the outputs are handed to, so they are written while the
+            next step runs. Outputs are written before returning if None.
+        checkpoint (tuple, optional):
+            (path prefix, key) of the checkpoints. The upstream aggregates are
+            saved after step 2 and the fragment labels after step 4, and a
+            partial make_fragments() traversal is resumed. A checkpoint
+            saved with the same key is loaded instead of rerunning the step.
+        store (tuple, optional):
+            (store folder, dam set) of the results store (see store.py). The
+            segments, fragments, dams and HUC indices are also written as
+            partitions of the store.
+        n_workers (int, optional):
+            Number of processes used to decode and dissolve the geometry, 1 in
+            worker processes of a pool.
+
+    Returns:
+        segments (pandas.DataFrame): Segments with all of the workflow columns.
+        fragments (pandas.DataFrame): Fragments from agg_by_frag().
+    """
+    # 1. Convert units for the segment information
+    segments = convert_units(segments)
+
+    #__________________________________________________________
+
+    # 2. Aggregate segment values by upstream area
+    t0 = datetime.datetime.now()
+    agg_list = upstream_cols
+    uplist=[i+'_up' for i in agg_list]
+    print("---- "+basin+" Output"+" ----"+" \n")
+    # Topological levels of the network, every sweep below is one array
+    # operation per level
+    dn_pos, levels = bfc.topo_levels(segments, 'DnHydroseq')
+    segments_up, _ = ckpt.load(checkpoint[0]+'_upstream.npz', checkpoint[1]) if checkpoint else (None, None)
+    if segments_up is not None:
+        segments_up = segments_up.reindex(segments.index)
+        print("Aggregate by Upstream segments: loaded checkpoint")
+    else:
+        segments_up = bfc.upstream_sum(segments, dn_pos, levels, agg_list)
+        if checkpoint:
+            ckpt.save(checkpoint[0]+'_upstream.npz', segments_up[uplist+['upstream_count']], checkpoint[1])
+        t1 = datetime.datetime.now()
+        print("Aggregate by Upstream segments:", (t1-t0))
+
+    # Add the resulting upstream aggregates back into segments DF with the upstream_count
+    segments[uplist]=segments_up[uplist]
+    segments["upstream_count"] = segments_up["upstream_count"]
+
+    # Carry the largest upstream dam down the network for the regulation summary
+    segments = reg.dam_influence(segments, dn_pos, levels)
+
+    # Distance to the nearest dams upstream and downstream of every segment
+    td = datetime.datetime.now()
+    segments = bfc.dam_distance(segments, dn_pos, levels)
+    print("Dam distances:", (datetime.datetime.now()-td))
+
+    #__________________________________________________________
+    
+    # 3.  Calculate Degree of Regulation 
+    t2 = datetime.datetime.now()
+    segments['DOR'] = reg.dor_ratio(segments.Norm_stor_up, segments.QC_MA)
+    segments['DomDamDOR'] = reg.dor_ratio(segments.DomDamStor, segments.QC_MA)
+
+    t3 = datetime.datetime.now()
+    print("Calculate DOR:", (t3-t2))
+
+    #__________________________________________________________
+
+    # 4. Divide into fragments and get average fragment properties
+    t4 = datetime.datetime.now()
+    frag_cols = ['Frag', 'Headwater', 'FragEnd', 'step', 'Frag_Index']
+    labels, _ = ckpt.load(checkpoint[0]+'_frags.npz', checkpoint[1]) if checkpoint else (None, None)
+    partial = checkpoint[0]+'_frags_partial.npz' if checkpoint else None
+    columns, extra = ckpt.load(partial, checkpoint[1]) if checkpoint and labels is None else (None, None)
+    if labels is not None:
+        for col in labels.columns:
+            segments[col] = labels[col].reindex(segments.index).values
+        print("Make Fragments: loaded checkpoint")
+    elif columns is not None:
+        # Resume a make_fragments() traversal that was stopped partway through
+        progress = ckpt.traversal_saver(partial, checkpoint[1], frag_cols)
+        segments = bfc.make_fragments(segments, exit_id=frag_exit_id, verbose=False, subwatershed=True,
+                                      progress=progress, resume=(columns, extra['queue'], int(extra['exit_id'])))
+        ckpt.remove(partial)
+    else:
+        # Same labels as make_fragments() with one sweep per level
+        segments = bfc.label_fragments(segments, dn_pos, levels, exit_id=frag_exit_id)
+    if checkpoint and labels is None:
+        ckpt.save(checkpoint[0]+'_frags.npz', segments[[c for c in frag_cols if c in segments]],
+                  checkpoint[1])
+    segments = bfc.longest_path(segments, dn_pos, levels)
+    t5 = datetime.datetime.now()
+    print("Make Fragments:", (t5-t4))
+
+    fragments = bfc.agg_by_frag(segments)
+    fragments = fragments.join(reg.regulated_length(segments, 'Frag', dor_thresholds))
+    if 'fragments' not in skip:
+        prefix = results_folder+basin
+        _write(writer, 'fragments', fragments.to_csv, prefix+'_fragments'+'_' + year + '.csv')
+        _write(writer, 'fragments', fg.write_frag_graph, fragments, prefix+'_fraggraph'+'_' + year)
+        seg_frags = segments[['LENGTHKM', 'DamID', 'Frag']].copy()
+        _write(writer, 'fragments', lng.write_seg_frags, seg_frags, prefix+'_segfrags'+'_' + year + '.npz')
+        _write(writer, 'fragments', anc.write_ancestry, segments[['DnHydroseq', 'LENGTHKM', 'DamID']].copy(),
+               prefix+'_ancestry'+'_' + year)
+
+        # Regulated length and the end of each dam's influence downstream
+        dams = reg.dam_reach(segments, dor_thresholds)
+        _write(writer, 'fragments', dams.to_csv, prefix+'_dams'+'_' + year + '.csv')
+
+        # Summary cube by HUC8, stream order and dam size class
+        basin_cube = cube.basin_cube(segments, fragments, dor_thresholds)
+        _write(writer, 'fragments', cube.write_cube, basin_cube, prefix+'_cube'+'_' + year + '.npz')
+
+        # Quantile sketch of the fragment lengths, merged across basins and years by sketch.py
+        _write(writer, 'fragments', sk.write_sketch, sk.make_sketch(fragments['LENGTHKM'].values),
+               prefix+'_sketch'+'_' + year + '.npz')
+
+        # Partitions of the results store, the geometry is kept out of the segments table
+        if store is not None:
+            for table, frame in [('segments', segments.drop(columns=['Coordinates'])),
+                                 ('fragments', fragments), ('dams', dams)]:
+                _write(writer, 'fragments', st.write_partition, frame, store[0], table, store[1], year, basin)
+
+    #__________________________________________________________
+    
+    # 5. Aggregate by HUC
+    HUC_vallist = huc_levels
+    if 'huc' in skip:
+        HUC_vallist = []
+
+    t6 = datetime.datetime.now()
+    HUC_summaries = rollup.huc_rollup(segments, fragments, HUC_vallist, dor_thresholds)
+    for HUC_val, HUC_summary in HUC_summaries.items():
+        _write(writer, 'huc', HUC_summary.to_csv, results_folder + basin + HUC_val+ "_" + year+'_indices.csv')
+        if store is not None:
+            _write(writer, 'huc', st.write_partition, HUC_summary, store[0], HUC_val, store[1], year, basin)
+    if HUC_summaries:
+        print("HUC indices ("+', '.join(HUC_vallist)+"):", (datetime.datetime.now()-t6))
+
+    #__________________________________________________________
+
+    # 6. Make Segments into a geo dataframe for plotting
+    if 'geometry' not in skip:
+        t7 = datetime.datetime.now()
+        segmentsGeo = geo.segment_geometry(segments, n_workers)
+        print("Decode geometry:", (datetime.datetime.now()-t7))
+
+        _write(writer, 'geometry', geo.write_geometry, segmentsGeo,
+               results_folder + basin + '_segGeo'+'_' + year, geometry_formats)
+
+        # Packed R-tree of the segments and fragments for window queries (see spatial.py)
+        frag_attrs = fragments.drop(columns=reg.reg_labels(dor_thresholds))
+        _write(writer, 'geometry', spatial.write_index, segmentsGeo, frag_attrs,
+               results_folder + basin + '_spatial'+'_' + year)
+
+        # Segment lines dissolved by fragment, written a chunk of fragments at a time
+        _write(writer, 'geometry', geo.write_fragment_geometry, segments[['Frag', 'Coordinates']].copy(), frag_attrs,
+               results_folder + basin + '_fragGeo'+'_' + year, geometry_formats, n_workers)
+
+    return segments, fragments
+
+
+def _write(writer, stage, func, *args):
+    # Hands a write to the background writer, or writes now without one
+    if writer is None:
+        func(*args)
+    else:
+        writer.submit(next(str(a) for a in args if isinstance(a, str)), stage, func, *args)
+
+
+def stage_outputs(basin, year, results_folder, store=None):
+    """Lists the output files of every cached stage of a basin run.
+
+    The partitions of the results store are outputs of the stages that write
+    them if store, a (store folder, dam set) tuple, is given.
+
+    Returns:
+        outputs (dict): Output paths by stage ('extract', 'fragments', 'huc', 'geometry').
+    """
+    prefix = results_folder+basin
+    outputs = {'extract': [prefix+'.csv'],
+            'fragments': [prefix+'_fragments_'+year+'.csv', prefix+'_fraggraph_'+year,
+                          prefix+'_segfrags_'+year+'.npz', prefix+'_dams_'+year+'.csv',
+                          prefix+'_cube_'+year+'.npz', prefix+'_ancestry_'+year, prefix+'_sketch_'+year+'.npz'],
+            'huc': [prefix+huc+'_'+year+'_indices.csv' for huc in huc_levels],
+            'geometry': [prefix+'_segGeo_'+year+geo.geometry_exts[fmt] for fmt in geometry_formats]
+                        + [prefix+'_fragGeo_'+year+geo.geometry_exts[fmt] for fmt in geometry_formats]
+                        + [prefix+'_spatial_'+year]}
+    if store is not None:
+        outputs['fragments'] += [st.partition_path(store[0], table, store[1], year, basin) for table in st.tables]
+        outputs['huc'] += [st.partition_path(store[0], huc, store[1], year, basin) for huc in huc_levels]
+
+    return outputs
+
+
+def stage_keys(main_directory, basin, year, dam_set, dor_thresholds):
+    """Makes the stage cache keys for a basin run.
+
+    Every stage key includes the key of the extraction, so a change to the 
+    inputs, year or dam set invalidates every stage. The later stages also 
+    depend on the code of the modules they use.
+
+    Returns:
+        keys (dict): Cache key by stage ('extract', 'fragments', 'huc', 'geometry').
+    """
+    keys = {'extract': cbc.extract_key(main_directory, basin, year, dam_set)}
+    analysis = ['workflow', 'bifurcate', 'regulate']
+    keys['fragments'] = cache.stage_key({'extract': keys['extract'], 'dor': dor_thresholds},
+                                        code=analysis+['fraggraph', 'lineage', 'cube', 'store', 'ancestry', 'sketch'])
+    keys['huc'] = cache.stage_key({'extract': keys['extract'], 'dor': dor_thresholds, 'hucs': huc_levels},
+                                  code=analysis+['rollup', 'store'])
+    keys['geometry'] = cache.stage_key({'extract': keys['extract'], 'formats': geometry_formats},
+                                       code=analysis+['geometry', 'spatial'])
+
+    return keys
+
+
+def stale_stages(main_directory, basin, year, dam_set, results_folder, dor_thresholds):
+    """Lists the stages of a basin run that are not up to date in the stage cache."""
+    keys = stage_keys(main_directory, basin, year, dam_set, dor_thresholds)
+    outputs = stage_outputs(basin, year, results_folder, (st.store_root(main_directory), dam_set))
+
+    return [stage for stage in keys
+            if not cache.is_current(results_folder, basin+'_'+stage, keys[stage], outputs[stage])]
+
+
+def run_scenario_basin(main_directory, basin, year, dam_set, results_folder, dor_thresholds,
+                       basin_lines=None, dams=None, manifest=None, writer=None, n_workers=1):
+    """Extracts a basin for a scenario and runs the workflow on the stages that changed.
+
+    Stages that are up to date in the stage cache (see cache.py) are skipped.
+    If the extraction is up to date the basin csv is read instead of joining
+    the dams to the flowlines. If every stage is up to date nothing is run.
+
+    The upstream aggregates and fragment labels are checkpointed in the
+    .checkpoints/ folder of the results folder (see checkpoint.py), so a basin
+    that crashed, or is rerun for new DOR thresholds, resumes from them.
+
+    The outputs are handed to a background writer (see writer.py) and each
+    stage is recorded in the stage cache by the writer after its outputs are
+    written. Without a writer, one is made for the basin and flushed before
+    returning.
+
+    Parameters:
+        main_directory (string):
+            Folder containing the input data.
+        basin (string):
+            Name of the basin.
+        year (string):
+            Scenario year.
+        dam_set (string):
+            'nabd' for all dams or 'grand' for the large dams in GRanD.
+        results_folder (string):
+            Folder where the outputs are saved.
+        dor_thresholds (list):
+            DOR thresholds (as fractions) used to report regulated river length.
+        basin_lines (pandas.DataFrame, optional):
+            NHD flowlines of the basin from extract.basin_flowlines().
+        dams (pandas.DataFrame, optional):
+            Dams of the scenario from read.select_dams().
+        manifest (dict, optional):
+            Manifest from shared.publish_network(), used by worker processes
+            instead of basin_lines and dams.
+        writer (writer.BackgroundWriter, optional):
+            Writer shared by the basins of a run, so writing the outputs of
+            one basin overlaps with the next.
+        n_workers (int, optional):
+            Number of processes used for the geometry (see process_basin()).
+
+    Returns:
+        stale (list): Stages that were run.
+    """
+    stale = stale_stages(main_directory, basin, year, dam_set, results_folder, dor_thresholds)
+    if not stale:
+        print(basin+' '+dam_set+' '+year+': Up to date')
+        return stale
+
+    keys = stage_keys(main_directory, basin, year, dam_set, dor_thresholds)
+    store = (st.store_root(main_directory), dam_set)
+    outputs = stage_outputs(basin, year, results_folder, store)
+
+    if 'extract' in stale:
+        if manifest is not None:
+            basin_lines, catalog = shared.basin_network(manifest, ex.major_basins[basin])
+            dams = read.select_dams(catalog, year, dam_set)
+        segments = ex.join_dams_flowlines(basin, basin_lines, dams, results_folder)
+        segments = segments.reset_index()[segment_cols].set_index('Hydroseq')
+        cache.record(results_folder, basin+'_extract', keys['extract'], outputs['extract'])
+    else:
+        segments = pd.read_csv(outputs['extract'][0], index_col='Hydroseq', usecols=segment_cols)
+
+    own_writer = writer is None
+    if own_writer:
+        writer = wr.BackgroundWriter()
+
+    # Checkpoints of the slow steps, kept so a crashed or rerun basin resumes from them
+    checkpoint = (results_folder+ckpt.checkpoint_dir+basin+'_'+year,
+                  cache.stage_key({'extract': keys['extract']}, code=['workflow', 'bifurcate']))
+
+    skip = [stage for stage in ['fragments', 'huc', 'geometry'] if stage not in stale]
+    process_basin(segments, basin, year, results_folder, dor_thresholds, skip, writer, checkpoint, store, n_workers)
+    for stage in stale:
+        if stage != 'extract':
+            writer.submit(basin+'_'+stage, 'record', cache.record, results_folder,
+                          basin+'_'+stage, keys[stage], outputs[stage])
+
+    if own_writer:
+        writer.close()
+        writer.summary()
+
+    return stale
+
+
+def _existing(scenarios, kind):
+    # Scenarios whose file (last item) exists, the others are skipped with a message
+    found = []
+    for scenario in scenarios:
+        if os.path.isfile(scenario[-1]):
+            found.append(scenario)
+        else:
+            print('No', kind, 'for', ' '.join(scenario[:-1])+', skipped:', scenario[-1])
+    return found
+
+
+def run_scenarios(main_directory, basin_ls, years, dam_sets=('nabd',), dor_thresholds=(0.02, 0.1, 1.0),
+                  n_workers=1, mem_limit_gb=None):
+    """Runs the workflow for every combination of dam set, year and basin.
+
+    The NHD flowlines and the dam catalog are read once and kept in memory. 
+    The flowlines are split into basins once and every scenario only selects
+    its dams from the catalog and joins them to the basin flowlines. Results 
+    are written to scenario_folder() and the fragment lineage between
+    consecutive years is built for every dam set. The basin summary cubes are
+    combined into analyzed_data/summary_cube.npz (see cube.py) and the fragment
+    length sketches into analyzed_data/length_sketches.npz (see sketch.py). Stages that are up to date
+    in the stage cache are skipped, and the inputs are not read at all if no
+    basin needs extracting. The outputs are written by a background writer 
+    (see writer.py) while the next basin runs, and the write timings are saved
+    to analyzed_data/write_timings.csv.
+
+    With more than one worker the (basin, scenario) jobs are run in a process
+    pool by scheduler.run_jobs(), largest basins first and within the memory
+    budget. The numeric network arrays, the flowline geometry and the dam 
+    catalog are published once to shared memory (see shared.py) and every 
+    worker attaches to them by name. The job timings are written to 
+    analyzed_data/job_timings.csv. A failing job does not stop the others, the
+    failures are recorded in the job timings and raised at the end of the run.
+
+    Parameters:
+        main_directory (string):
+            Folder containing the input data.
+        basin_ls (List):
+            List of basins to be analyzed.
+        years (List):
+            Scenario years in chronological order (e.g. 'no_dams', '1920', '2012').
+        dam_sets (List, optional):
+            Dam sets to run, 'nabd' for all dams and 'grand' for GRanD dams.
+        dor_thresholds (list, optional):
+            DOR thresholds (as fractions) used to report regulated river length.
+        n_workers (int, optional):
+            Number of worker processes, 1 runs the jobs one after the other.
+        mem_limit_gb (float, optional):
+            Memory budget in GB for the jobs running at the same time.
+    """
+    t_start = datetime.datetime.now()
+
+    # Find the scenarios with work to do
+    todo = []
+    for dam_set in dam_sets:
+        for year in years:
+            results_folder = scenario_folder(main_directory, dam_set, year)
+            os.makedirs(results_folder, exist_ok=True)
+            for basin in basin_ls:
+                stale = stale_stages(main_directory, basin, year, dam_set, results_folder, dor_thresholds)
+                if stale:
+                    todo.append((dam_set, year, basin, results_folder, 'extract' in stale))
+                else:
+                    print(basin+' '+dam_set+' '+year+': Up to date')
+
+    # Only read the inputs if a basin needs extracting
+    manifest, basin_lines, catalog, blocks = None, {}, None, []
+    if any(job[4] for job in todo):
+        flowlines = read.read_flowlines(main_directory)
+        catalog = read.read_dams(main_directory)
+        basin_lines = {basin: ex.basin_flowlines(basin, flowlines) for basin in basin_ls}
+        basin_size = {basin: len(basin_lines[basin]) for basin in basin_ls}
+        print("Time to read in flowlines and dams:", datetime.datetime.now()-t_start)
+
+        if n_workers > 1:
+            # Publish the network once for all of the workers
+            manifest, blocks = shared.publish_network(flowlines, catalog, 'rivfrag_'+str(os.getpid()))
+            basin_lines = {}
+        del flowlines
+
+    jobs = []
+    writer = wr.BackgroundWriter()
+    for dam_set, year, basin, results_folder, extract in todo:
+        if n_workers > 1:
+            # The jobs run in worker processes, so the geometry is done in process
+            args = (main_directory, basin, year, dam_set, results_folder, dor_thresholds,
+                    None, None, manifest, None, 1)
+            # Basin csvs hold roughly 2 kB per segment
+            size = basin_size[basin] if extract else os.path.getsize(results_folder+basin+'.csv') / 2000
+            jobs.append({'name': basin+'_'+dam_set+'_'+year, 'args': args,
+                         'mem_gb': sched.estimate_mem_gb(size)})
+        else:
+            print("---------------"+dam_set+" "+year+"---------------")
+            dams = read.select_dams(catalog, year, dam_set) if extract else None
+            run_scenario_basin(main_directory, basin, year, dam_set, results_folder, dor_thresholds,
+                               basin_lines.get(basin), dams, writer=writer, n_workers=geometry_workers)
+
+    # Flush the outputs of the serial runs before building the lineage
+    writes = writer.close()
+    if len(writes):
+        writer.summary()
+        writes.to_csv(main_directory+'analyzed_data/write_timings.csv', index=False)
+
+    failed = None
+    if jobs:
+        try:
+            results, timings = sched.run_jobs(jobs, run_scenario_basin, n_workers, mem_limit_gb)
+        except sched.JobsFailed as err:
+            # The other basins are combined below before the failures are raised
+            failed, timings = err, err.timings
+        finally:
+            shared.release(blocks)
+        timings.to_csv(main_directory+'analyzed_data/job_timings.csv')
+
+    # Fragment lineage between consecutive years, only pairs of scenarios
+    # that were run (or whose lineage is missing) are rebuilt
+    for dam_set in dam_sets:
+        scenarios = [(year, scenario_folder(main_directory, dam_set, year)) for year in years]
+        changed = {(basin, year) for job_set, year, basin, _, _ in todo if job_set == dam_set}
+        lng.year_lineage(basin_ls, scenarios, changed)
+
+    # Summary cube of every scenario of the run
+    cube_path = main_directory+'analyzed_data/summary_cube.npz'
+    if todo or not os.path.isfile(cube_path):
+        cubes = [(dam_set, year, scenario_folder(main_directory, dam_set, year)+basin+'_cube_'+year+'.npz')
+                 for dam_set in dam_sets for year in years for basin in basin_ls]
+        cubes = _existing(cubes, 'cube')
+        if cubes:
+            cube.combine_cubes(cubes, cube_path)
+
+    # Fragment length sketches of every scenario and basin of the run
+    sketch_path = main_directory+'analyzed_data/length_sketches.npz'
+    if todo or not os.path.isfile(sketch_path):
+        sketches = [(dam_set, year, basin, scenario_folder(main_directory, dam_set, year)+basin+'_sketch_'+year+'.npz')
+                    for dam_set in dam_sets for year in years for basin in basin_ls]
+        sketches = _existing(sketches, 'sketch')
+        if sketches:
+            sk.combine_sketches(sketches, sketch_path)
+
+    t_end = datetime.datetime.now()
+    print('Time to run all scenarios = ', t_end-t_start)
+    if failed is not None:
+        raise failed
@@ -0,0 +1,111 @@
+import threading, queue, time, atexit
+import pandas as pd
+
+
+class BackgroundWriter:
+    """Writes outputs on a background thread while the next step is computed.
+
+    Writes are run in the order they are submitted by a single thread, so a
+    task submitted after a set of writes (e.g. recording a stage in the stage
+    cache) only runs once they are on disk. The queue holds at most max_pending
+    writes; submit() blocks when it is full, so the outputs waiting to be
+    written can not use up the memory. The writer is flushed when it is closed,
+    which also happens when python exits.
+
+    If a write fails the writes after it are dropped and the error is raised
+    by the next call to submit(), flush() or close().
+
+    Parameters:
+        max_pending (int, optional):
+            Number of writes that can wait in the queue.
+    """
+    def __init__(self, max_pending=4):
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.timings = []
+        self.flush_wait = 0.0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        # Runs the writes in the background thread until close() is called
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                return
+            timing, func, args = task
+            if self.error is None:
+                t0 = time.time()
+                try:
+                    func(*args)
+                except Exception as err:
+                    self.error = RuntimeError('Background write '+timing['name']+' failed: '+repr(err))
+                timing['write_time'] = time.time() - t0
+                self.timings.append(timing)
+            self.tasks.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, name, stage, func, *args):
+        """Queues func(*args) to run on the writer thread.
+
+        The objects in args must not be changed after they are submitted.
+
+        Parameters:
+            name (string):
+                Name of the write (e.g. the output path).
+            stage (string):
+                Workflow stage the write belongs to, used to group the timings.
+            func (function):
+                Function that writes the output.
+        """
+        if self.closed:
+            raise RuntimeError('Background writer is closed')
+        self._check()
+        timing = {'name': name, 'stage': stage}
+        t0 = time.time()
+        self.tasks.put((timing, func, args))  # blocks while the queue is full
+        timing['wait_time'] = time.time() - t0
+
+    def flush(self):
+        """Waits until every submitted write is on disk."""
+        t0 = time.time()
+        self.tasks.join()
+        self.flush_wait += time.time() - t0
+        self._check()
+
+    def close(self):
+        """Flushes and stops the writer.
+
+        Returns:
+            timings (pandas.DataFrame): Write time (s) and time the main thread
+                waited on the full queue (s) of every write.
+        """
+        if not self.closed:
+            self.closed = True
+            t0 = time.time()
+            self.tasks.put(None)
+            self.thread.join()
+            self.flush_wait += time.time() - t0
+            atexit.unregister(self.close)
+        self._check()
+
+        return pd.DataFrame(self.timings, columns=['name', 'stage', 'write_time', 'wait_time'])
+
+    def summary(self):
+        """Prints the write time, the time waited and the time hidden by the overlap by stage."""
+        timings = pd.DataFrame(self.timings, columns=['name', 'stage', 'write_time', 'wait_time'])
+        by_stage = timings.groupby('stage')[['write_time', 'wait_time']].sum()
+        by_stage['hidden_time'] = (by_stage.write_time - by_stage.wait_time).clip(lower=0)
+        print(by_stage.round(1).to_string())
+        write, waited = timings.write_time.sum(), timings.wait_time.sum() + self.flush_wait
+        print('Writes took', round(write, 1), 's, waited', round(waited, 1),
+              's, hidden', round(max(write - waited, 0), 1), 's')
+
+        return by_stage
@@ -0,0 +1,147 @@
+"""
+This script runs the full analysis, from the basin extraction to the figures,
+as a pipeline of stages (see process_data/pipeline.py). Stages that do not
+depend on each other are run at the same time and only the stages downstream
+of a change are rebuilt.
+
+Created by: Laura Condon and Rachel Spinti
+"""
+# %%
+import os, sys
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, 'process_data'), os.path.join(here, 'make_figures')]
+
+import pipeline as pl, workflow as wf, cache, read, geometry as geo, store as st, tiles as tl, raster as rs
+import create_csvs as crc, huc_merge as hm, fraglen_analysis as fla
+
+# Select basin/basins to run from list below
+basin_ls = ['California', 'Colorado', 'Columbia', 'Great_Basin', 'Great_Lakes',
+'Gulf_Coast','Mississippi', 'North_Atlantic', 'Red', 'Rio_Grande','South_Atlantic']
+
+# Scenario years (in chronological order) and dam sets, the figures use these
+# years. A scenario holds the dams completed before its year, so the 2012
+# scenario has every dam up to 2011 and is labelled 2010 on the figures
+years = ['no_dams', '1920', '1950', '1980', '2012']
+dam_sets = ['nabd', 'grand']
+
+# Basins with an exceedance probability figure ('all_basins' is CONUS)
+weibull_basins = ['Great_Basin', 'Rio_Grande', 'Gulf_Coast', 'Columbia', 'Great_Lakes', 'all_basins']
+
+# DOR thresholds (as fractions) used to report regulated river length
+dor_thresholds = [0.02, 0.1, 1.0]
+
+# Number of worker processes and memory budget (GB) for the basin runs, and
+# the number of pipeline stages run at the same time
+n_workers = 1
+mem_limit_gb = None
+n_stages = 4
+
+# Combine the basin segment geometry into a virtual layer (.vrt) that reads the
+# basin files in place instead of a copy (see create_csvs.py)
+virtual_segGeo = True
+
+# Specify input locations
+main_directory = 'Spinti_river_fragmentation_data_2022/'
+huc_folder = main_directory+'hucs/'
+state_folder = main_directory+'analyzed_data/'
+
+# %%
+# Basin extraction, fragments, HUC indices and geometry for every scenario
+# (each basin stage is also cached on its own, see workflow.py)
+workflow_outputs = []
+for dam_set in dam_sets:
+    for year in years:
+        folder = wf.scenario_folder(main_directory, dam_set, year)
+        for basin in basin_ls:
+            for paths in wf.stage_outputs(basin, year, folder, (st.store_root(main_directory), dam_set)).values():
+                workflow_outputs += paths
+
+stages = [{'name': 'workflow', 'func': wf.run_scenarios,
+           'args': (main_directory, basin_ls, years, dam_sets, dor_thresholds, n_workers, mem_limit_gb),
+           'inputs': read.input_paths(main_directory), 'outputs': workflow_outputs,
+           'code': cache.imported_modules('workflow')}]
+
+for dam_set in dam_sets:
+    for year in years:
+        folder = wf.scenario_folder(main_directory, dam_set, year)
+        tag = '_'+dam_set+'_'+year
+
+        # Combine the basins and join the HUC summaries to the HUC shapefiles
+        for huc, merge in [('HUC2', hm.HUC2_indices_merge), ('HUC4', hm.HUC4_indices_merge),
+                           ('HUC8', hm.HUC8_indices_merge)]:
+            stages.append({'name': 'combine_'+huc+tag, 'func': crc.combined_huc_csv,
+                           'args': (basin_ls, folder, huc, '_'+year),
+                           'inputs': [folder+basin+huc+'_'+year+'_indices.csv' for basin in basin_ls]
+                                     + [os.path.join(here, 'make_figures', 'create_csvs.py')],
+                           'outputs': [folder+huc+'_summary.csv']})
+            stages.append({'name': 'merge_'+huc+tag, 'func': merge,
+                           'args': (folder, year, huc_folder),
+                           'inputs': [folder+huc+'_summary.csv', huc_folder+huc+'_CONUS.shp',
+                                      os.path.join(here, 'make_figures', 'huc_merge.py')],
+                           'outputs': [folder+huc.lower()+'_indices_'+year+'.shp']})
+
+        ext = geo.geometry_exts[wf.geometry_formats[0]]
+        out_ext = '.vrt' if virtual_segGeo and ext != '.parquet' else ext
+        stages.append({'name': 'combine_segGeo'+tag, 'func': crc.combined_segGeo_csv,
+                       'args': (basin_ls, folder, year, '_'+year, ext, virtual_segGeo),
+                       'inputs': [folder+basin+'_segGeo_'+year+ext for basin in basin_ls]
+                                 + [os.path.join(here, 'make_figures', 'create_csvs.py')],
+                       'outputs': [folder+'all_basins_segGeo_'+year+out_ext]})
+        stages.append({'name': 'combine_frags'+tag, 'func': crc.combined_frag_csv,
+                       'args': (basin_ls, folder, year, '_'+year),
+                       'inputs': [folder+basin+'_fragments_'+year+'.csv' for basin in basin_ls]
+                                 + [os.path.join(here, 'make_figures', 'create_csvs.py')],
+                       'outputs': [folder+'all_basins_frags_'+year+'.csv']})
+
+        # Vector tile pyramid of the segments and fragments for the web viewers.
+        # Stages run in the worker processes of the pipeline, so they run in process
+        stages.append({'name': 'tiles'+tag, 'func': tl.build_tiles,
+                       'args': (basin_ls, folder, year, folder+'tiles_'+year+'.mbtiles', 1),
+                       'inputs': [folder+basin+'_spatial_'+year+'/index.json' for basin in basin_ls],
+                       'outputs': [folder+'tiles_'+year+'.mbtiles'], 'deps': ['workflow'],
+                       'code': cache.imported_modules('tiles')})
+
+        # Fragment, dam and DOR grids
+        stages.append({'name': 'grids'+tag, 'func': rs.rasterize_scenario,
+                       'args': (basin_ls, folder, year, folder+'grids_'+year+'.npz', rs.conus_grid, 1),
+                       'inputs': [folder+basin+'_spatial_'+year+'/index.json' for basin in basin_ls],
+                       'outputs': [folder+'grids_'+year+'.npz'], 'deps': ['workflow'],
+                       'code': cache.imported_modules('raster')})
+
+    # Change in fragment length by HUC8 between the scenario years
+    set_folder = main_directory+'analyzed_data/'+dam_set+'_analyzed/'
+    stages.append({'name': 'frag_diff_'+dam_set, 'func': fla.frag_diff,
+                   'args': (set_folder, years, 'LENGTHKM_len', huc_folder),
+                   'inputs': [set_folder+year+'/HUC8_summary.csv' for year in years]
+                             + [huc_folder+'HUC8_CONUS.shp', os.path.join(here, 'make_figures', 'fraglen_analysis.py')],
+                   'outputs': [set_folder+'huc8_frag_diff.csv', set_folder+'huc8_frag_diff.gpkg']})
+
+# Figures, the scripts read the scenario folders of main_directory
+def fragment_csvs(dam_set, year, basins):
+    return [fla.fragments_path(main_directory+'analyzed_data/', dam_set, year, basin) for basin in basins]
+
+last = years[-1]
+figure_folder = main_directory+'analyzed_data/'
+figures = {'dam_bar_plots': ([wf.scenario_folder(main_directory, dam_set, last)+basin+'_dams_'+last+'.csv'
+                              for dam_set in dam_sets for basin in basin_ls],
+                             [figure_folder+'bar_plots/dam_bar_plots.png'], ()),
+           'fraglen_plots': ([path for dam_set in dam_sets for year in years
+                              for path in fragment_csvs(dam_set, year, basin_ls+['all_basins'])]
+                             + [huc_folder+'huc2_clipped.shp'],
+                             [figure_folder+'len_analysis/tot_frags1x2_dens_conus.png',
+                              figure_folder+'len_analysis/frag_len_dens_conus.png'], ()),
+           'weibull_plots': (fragment_csvs('nabd', 'no_dams', weibull_basins) + fragment_csvs('nabd', last, weibull_basins)
+                             + fragment_csvs('grand', last, weibull_basins),
+                             [figure_folder+'weibull/'+('CONUS' if basin == 'all_basins' else basin.replace('_', ' '))
+                              +'_weibull.png' for basin in weibull_basins], (','.join(weibull_basins),))}
+for figure, (inputs, outputs, extra) in figures.items():
+    script = os.path.join(here, 'make_figures', figure+'.py')
+    stages.append({'name': figure, 'func': pl.run_script, 'args': (script, main_directory, ','.join(years))+extra,
+                   'inputs': inputs+[script, os.path.join(here, 'make_figures', 'fraglen_analysis.py')],
+                   'outputs': outputs})
+
+# %%
+if __name__ == '__main__':
+    os.makedirs(state_folder, exist_ok=True)
+    status = pl.run_pipeline(stages, state_folder, n_stages)
+    status.to_csv(state_folder+'pipeline_status.csv')